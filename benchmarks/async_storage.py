@@ -0,0 +1,88 @@
+"""
+Event-loop latency while workflows write to slow storage,
+with synchronous storage vs. the same storage on a thread pool.
+
+A ticker task measures how late the loop wakes it up;
+with synchronous storage every write stalls the whole loop.
+
+    PYTHONPATH=src python benchmarks/async_storage.py
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from quest import step, PersistentHistory, AsyncPersistentHistory, ThreadPoolBlobStorage, WorkflowManager
+from quest.persistence import InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+
+WORKFLOWS = 20
+STEPS = 10
+WRITE_DELAY = 0.005  # seconds per blob write
+
+
+class SlowBlobStorage(InMemoryBlobStorage):
+    def write_blob(self, key, blob):
+        time.sleep(WRITE_DELAY)
+        super().write_blob(key, blob)
+
+
+@step
+async def work(i):
+    return i
+
+
+async def workflow():
+    for i in range(STEPS):
+        await work(i)
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def run(name, history_type, create_storage, manager_storage):
+    histories = []
+
+    def create_history(wid):
+        histories.append(history := history_type(wid, create_storage()))
+        return history
+
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+
+    start = time.perf_counter()
+    async with WorkflowManager('bench', manager_storage, create_history, lambda wtype: workflow,
+                               serializer=NoopSerializer()) as manager:
+        for w in range(WORKFLOWS):
+            manager.start_workflow('workflow', f'wid{w}', delete_on_finish=False)
+        for w in range(WORKFLOWS):
+            await manager.get_workflow_result(f'wid{w}')
+        # Async histories write behind the workflow; include those writes
+        for history in histories:
+            if hasattr(history, 'commit'):
+                await history.commit()
+        await asyncio.sleep(0.01)  # let the manager store the results
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await tick
+    lags.sort()
+    print(f'{name:<28} total (incl. writes) {elapsed:6.2f} s'
+          f'  loop lag p50 {lags[len(lags) // 2] * 1000:7.1f} ms  max {lags[-1] * 1000:7.1f} ms')
+
+
+async def main():
+    await run('sync storage', PersistentHistory, SlowBlobStorage, InMemoryBlobStorage())
+
+    executor = ThreadPoolExecutor(8)
+    await run('thread-pool storage (8)', AsyncPersistentHistory,
+              lambda: ThreadPoolBlobStorage(SlowBlobStorage(), executor),
+              ThreadPoolBlobStorage(InMemoryBlobStorage(), executor))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Workflows started and events sent per second through one websocket Client, one call at a time or in batches.
+
+WORKFLOWS workflows are started, and then sent one event each.
+'one by one' awaits each call, like an ingest loop over Client.start_workflow/send_event;
+'pipelined' makes all the calls at once (each still a message of its own);
+the others send them with Client.batch(), BATCH calls per message
+(the server starts the workflows of a batch with one WorkflowManager.start_workflows call).
+start_workflows also persists the data of all the workflows (start_workflow leaves that to the manager's exit),
+so small batches of starts pay for a write of a blob that grows with the number of workflows.
+
+    PYTHONPATH=src python benchmarks/batch_calls.py
+"""
+import asyncio
+import time
+
+from quest import WorkflowManager, queue
+from quest.client import Client
+from quest.persistence import InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+from quest.server import Server
+
+PORT = 8766
+WORKFLOWS = 5000
+BATCHES = [10, 100, 1000]
+
+
+async def waiting_workflow():
+    async with queue('messages', None) as messages:
+        return await messages.get()
+
+
+async def one_by_one(client: Client, wids: list[str]):
+    for wid in wids:
+        await client.start_workflow('workflow', wid)
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    for wid in wids:
+        await client.send_event(wid, 'messages', None, 'put', 1)
+    return start
+
+
+async def pipelined(client: Client, wids: list[str]):
+    await asyncio.gather(*(client.start_workflow('workflow', wid) for wid in wids))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(client.send_event(wid, 'messages', None, 'put', 1) for wid in wids))
+    return start
+
+
+def batched(size: int):
+    async def run(client: Client, wids: list[str]):
+        for i in range(0, len(wids), size):
+            async with client.batch() as batch:
+                for wid in wids[i:i + size]:
+                    batch.start_workflow('workflow', wid)
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        for i in range(0, len(wids), size):
+            async with client.batch() as batch:
+                for wid in wids[i:i + size]:
+                    batch.send_event(wid, 'messages', None, 'put', 1)
+        return start
+
+    return run
+
+
+async def measure(label: str, run, round_: int):
+    manager = WorkflowManager(f'batch{round_}', InMemoryBlobStorage(), lambda wid: [],
+                              lambda w_type: waiting_workflow, serializer=NoopSerializer())
+    wids = [f'wid{i}' for i in range(WORKFLOWS)]
+    async with manager, Server(manager, 'localhost', PORT):
+        async with Client(f'ws://localhost:{PORT}') as client:
+            start = time.perf_counter()
+            events_start = await run(client, wids)
+            end = time.perf_counter()
+    print(f'{label:>12} {WORKFLOWS / (events_start - start):>12.0f} {WORKFLOWS / (end - events_start):>10.0f}')
+
+
+async def main():
+    print(f'{WORKFLOWS} workflows')
+    print(f'{"calls":>12} {"starts/s":>12} {"events/s":>10}')
+    await measure('one by one', one_by_one, 0)
+    await measure('pipelined', pipelined, 1)
+    for round_, size in enumerate(BATCHES, 2):
+        await measure(f'batch {size}', batched(size), round_)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
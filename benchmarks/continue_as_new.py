@@ -0,0 +1,75 @@
+"""
+Time to resume an event-loop workflow after many loop iterations,
+with continue_as_new every BATCH iterations vs. one ever-growing history.
+
+The workflow adds up the messages it gets from a queue. After each checkpoint
+(a number of iterations), it is suspended and the time to resume it
+(until its queue is ready again) is measured.
+Without continue_as_new, the checkpoints stop at BASELINE_LIMIT iterations.
+
+    PYTHONPATH=src python benchmarks/continue_as_new.py
+"""
+import asyncio
+import time
+
+from quest import step, queue, continue_as_new
+from quest.historian import Historian
+from quest.serializer import NoopSerializer
+
+CHECKPOINTS = [1_000, 10_000, 100_000, 1_000_000]
+BASELINE_LIMIT = 10_000
+BATCH = 1000
+
+
+@step
+async def add(total, value):
+    return total + value
+
+
+async def summing_workflow(total, batch):
+    async with queue('messages', None) as messages:
+        iteration = 0
+        while True:
+            total = await add(total, await messages.get())
+            iteration += 1
+            if batch and iteration == batch:
+                continue_as_new(total, batch)
+
+
+async def resume(history, batch) -> tuple[Historian, float]:
+    historian = Historian('wid', summing_workflow, history, serializer=NoopSerializer())
+    start = time.perf_counter()
+    historian.run(0, batch)
+    while ('messages', None) not in await historian.get_resources(None):
+        await asyncio.sleep(0)
+    return historian, time.perf_counter() - start
+
+
+async def run(batch: int | None):
+    history = []
+    historian, _ = await resume(history, batch)
+    done = 0
+    for checkpoint in CHECKPOINTS:
+        if not batch and checkpoint > BASELINE_LIMIT:
+            break
+        for value in range(done, checkpoint):
+            await historian.record_external_event('messages', None, 'put', value)
+            await asyncio.sleep(0)
+        done = checkpoint
+
+        await historian.suspend()
+        historian, elapsed = await resume(history, batch)
+        label = f'every {batch}' if batch else 'never'
+        print(f'{label:>12} {checkpoint:>10} {len(history):>10} {1000 * elapsed:>12.1f}')
+
+    await historian.suspend()
+
+
+async def main():
+    print(f'{"continue":>12} {"iterations":>10} {"records":>10} {"resume (ms)":>12}')
+    await run(BATCH)
+    await run(None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Many workflows appending to their histories in the same event-loop ticks,
+with and without a GroupCommitter.
+
+    PYTHONPATH=src python benchmarks/group_commit.py
+"""
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from quest import GroupCommitter, PersistentHistory, SegmentedLogHistory, LocalFileSystemBlobStorage
+
+WORKFLOWS = 200
+APPENDS = 50
+
+
+def make_record(i: int):
+    return {
+        'type': 'end',
+        'timestamp': datetime.utcnow().isoformat(),
+        'step_id': f'workflow.step_{i}',
+        'task_id': 'workflow.main',
+        'result': i,
+        'exception': None
+    }
+
+
+async def workflow(history):
+    for i in range(APPENDS):
+        history.append(make_record(i))
+        await asyncio.sleep(0)  # one append per tick, like a step boundary
+    if hasattr(history, 'commit'):
+        await history.commit()
+
+
+async def run(name, create_history, committer=None):
+    histories = [create_history(wid, committer) for wid in range(WORKFLOWS)]
+    start = time.perf_counter()
+    await asyncio.gather(*(workflow(history) for history in histories))
+    elapsed = time.perf_counter() - start
+
+    line = f'{name:<45} {elapsed:>8.2f} s  {WORKFLOWS * APPENDS / elapsed:>10.0f} appends/s'
+    if committer is not None:
+        metrics = committer.get_metrics()
+        line += (f'  batches={metrics["batches"]} mean_batch={metrics["batch_size_mean"]:.0f}'
+                 f' p99_flush={metrics["flush_latency_p99"] * 1000:.1f} ms')
+    print(line)
+
+
+async def main():
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        def blobs(folder):
+            return lambda wid, committer: PersistentHistory(
+                str(wid), LocalFileSystemBlobStorage(tmp / folder / str(wid)), committer=committer)
+
+        def log(folder):
+            return lambda wid, committer: SegmentedLogHistory(tmp / folder / str(wid), committer=committer)
+
+        await run('PersistentHistory', blobs('a'))
+        await run('PersistentHistory + batch commit', blobs('b'), GroupCommitter())
+        await run('SegmentedLogHistory', log('c'))
+        await run('SegmentedLogHistory + batch commit', log('d'), GroupCommitter())
+        await run('SegmentedLogHistory + 10ms interval commit', log('e'),
+                  GroupCommitter(window=0.01, durability='interval'))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Append cost of PersistentHistory vs SegmentedLogHistory as the history grows.
+
+PersistentHistory rewrites its whole key index on every append,
+so its per-append cost grows with the history (it is only run to 10k records).
+SegmentedLogHistory appends one line per record, so its cost stays flat.
+
+    PYTHONPATH=src python benchmarks/history_append.py
+"""
+import time
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from quest import PersistentHistory, SegmentedLogHistory, LocalFileSystemBlobStorage
+
+CHECKPOINTS = [1_000, 10_000, 50_000, 100_000]
+WINDOW = 500  # appends timed at each checkpoint
+
+
+def make_record(i: int):
+    return {
+        'type': 'end',
+        'timestamp': datetime.utcnow().isoformat(),
+        'step_id': f'workflow.step_{i}',
+        'task_id': 'workflow.main',
+        'result': i,
+        'exception': None
+    }
+
+
+def measure(history, max_records: int) -> dict[int, float]:
+    """Return the mean microseconds per append for the WINDOW appends after each checkpoint"""
+    costs = {}
+    count = 0
+    for checkpoint in CHECKPOINTS:
+        if checkpoint > max_records:
+            break
+        while count < checkpoint - WINDOW:
+            history.append(make_record(count))
+            count += 1
+        start = time.perf_counter()
+        while count < checkpoint:
+            history.append(make_record(count))
+            count += 1
+        costs[checkpoint] = (time.perf_counter() - start) / WINDOW * 1e6
+    return costs
+
+
+def main():
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        results = {
+            'PersistentHistory': measure(PersistentHistory('wid', LocalFileSystemBlobStorage(tmp / 'blobs')), 10_000),
+            'SegmentedLogHistory': measure(SegmentedLogHistory(tmp / 'log'), 100_000),
+        }
+
+    print(f'{"records":>10}' + ''.join(f'{name:>22}' for name in results))
+    for checkpoint in CHECKPOINTS:
+        row = ''.join(
+            f'{costs[checkpoint]:>19.1f} us' if checkpoint in costs else f'{"-":>22}'
+            for costs in results.values()
+        )
+        print(f'{checkpoint:>10}' + row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Startup time and memory of loading many PersistentHistory instances.
+
+'eager' reads every record into memory (what PersistentHistory used to do in __init__).
+'lazy' reads the key index and takes the replay snapshot, which only loads the first chunk.
+
+Each mode runs in a fresh process so peak RSS is comparable.
+The default sizes match the production scenario (1k workflows x 10k records)
+and need ~10M small files; use --workflows/--records for a quicker run.
+
+    PYTHONPATH=src python benchmarks/history_load.py --workflows 100 --records 1000
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from quest import PersistentHistory, LocalFileSystemBlobStorage
+
+
+def create_data(root: Path, workflows: int, records: int):
+    # Write the PersistentHistory layout directly; appending through the class would take O(N^2)
+    for w in range(workflows):
+        folder = root / f'wid{w}'
+        folder.mkdir(parents=True)
+        keys = []
+        for i in range(records):
+            key = f'wid{w}.{i}'
+            keys.append(key)
+            (folder / f'{key}.json').write_text(json.dumps({
+                'type': 'end',
+                'timestamp': f'2024-01-01T00:00:00.{i:06d}',
+                'step_id': f'wid{w}.main.step_{i}',
+                'task_id': f'wid{w}.main',
+                'result': {'value': i, 'text': 'x' * 64},
+                'exception': None
+            }))
+        (folder / f'wid{w}.json').write_text(json.dumps(keys))
+
+
+def load(root: Path, workflows: int, mode: str):
+    start = time.perf_counter()
+    held = []
+    for w in range(workflows):
+        history = PersistentHistory(f'wid{w}', LocalFileSystemBlobStorage(root / f'wid{w}'))
+        if mode == 'eager':
+            held.append(list(history))
+        else:
+            snapshot = history.snapshot()
+            if len(snapshot):
+                snapshot[0]  # the replay starts reading
+            held.append((history, snapshot))
+    elapsed = time.perf_counter() - start
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, rss_mb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workflows', type=int, default=1000)
+    parser.add_argument('--records', type=int, default=10_000)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        create_data(root, args.workflows, args.records)
+
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            for mode in ['eager', 'lazy']:
+                elapsed, rss_mb = pool.apply(load, (root, args.workflows, mode))
+                print(f'{mode:>6}: {args.workflows} workflows x {args.records} records'
+                      f'  startup {elapsed:8.2f} s  peak RSS {rss_mb:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
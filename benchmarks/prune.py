@@ -0,0 +1,79 @@
+"""
+Pruning a step with many substep records: removing the records one at a time
+(one index rewrite / log append per record) vs History.remove_many.
+
+    PYTHONPATH=src python benchmarks/prune.py
+"""
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from quest import PersistentHistory, SegmentedLogHistory, LocalFileSystemBlobStorage
+from quest.historian import _prune
+
+SUBSTEPS = [100, 500, 1000]
+
+
+def fill(history, substeps: int) -> dict:
+    """Fill the history with one step and its substeps and return the step's index entries (see Historian._index_record)"""
+    records = [{'type': 'start', 'timestamp': '', 'step_id': 'wid.main.outer', 'task_id': 'wid.main'}]
+    for i in range(substeps):
+        step_id = f'wid.main.outer.leaf_{i}'
+        records.append({'type': 'start', 'timestamp': '', 'step_id': step_id, 'task_id': 'wid.main'})
+        records.append({'type': 'end', 'timestamp': '', 'step_id': step_id, 'task_id': 'wid.main',
+                        'result': i, 'exception': None})
+    records.append({'type': 'end', 'timestamp': '', 'step_id': 'wid.main.outer', 'task_id': 'wid.main',
+                    'result': None, 'exception': None})
+    for record in records:
+        history.append(record)
+    return {id(record): (record, record['type'], record['step_id'], None) for record in records}
+
+
+class OneAtATime:
+    """Hides remove_many, so _prune removes the records one at a time"""
+
+    def __init__(self, history):
+        self._history = history
+
+    def append(self, item):
+        self._history.append(item)
+
+    def remove(self, item):
+        self._history.remove(item)
+
+    def clear(self):
+        self._history.clear()
+
+    def __iter__(self):
+        return iter(self._history)
+
+    def __reversed__(self):
+        return reversed(self._history)
+
+
+def run(name, create_history, substeps: int):
+    with TemporaryDirectory() as tmp:
+        history = create_history(Path(tmp))
+        entries = fill(history, substeps)
+        start = time.perf_counter()
+        _prune('wid.main.outer', history, entries, lambda record: record)
+        elapsed = time.perf_counter() - start
+    print(f'{name:<40} {substeps:>6} substeps {elapsed * 1000:>10.1f} ms')
+
+
+def main():
+    histories = {
+        'PersistentHistory, one at a time': lambda tmp: OneAtATime(
+            PersistentHistory('wid', LocalFileSystemBlobStorage(tmp))),
+        'PersistentHistory, remove_many': lambda tmp: PersistentHistory('wid', LocalFileSystemBlobStorage(tmp)),
+        'SegmentedLogHistory, one at a time': lambda tmp: OneAtATime(SegmentedLogHistory(tmp)),
+        'SegmentedLogHistory, remove_many': lambda tmp: SegmentedLogHistory(tmp),
+    }
+    for substeps in SUBSTEPS:
+        for name, create_history in histories.items():
+            run(name, create_history, substeps)
+        print()
+
+
+if __name__ == '__main__':
+    main()
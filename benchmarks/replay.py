@@ -0,0 +1,95 @@
+"""
+Time to replay a history with many tasks, with the per-task replay index
+vs. every task scanning the whole history (the previous approach).
+
+The workflow runs TASKS tasks that record their steps interleaved, is suspended,
+and is then resumed from its history (of roughly RECORDS records).
+
+    PYTHONPATH=src python benchmarks/replay.py
+"""
+import asyncio
+import time
+
+from quest import step, task
+from quest.historian import Historian
+from quest.serializer import NoopSerializer
+
+TASKS = [1, 10, 100, 1000]
+RECORDS = [1000, 10000]
+
+
+async def scanning_replay_records(self, task_id):
+    """The previous _task_replay_records: visit every record, waiting on those of other tasks"""
+    self._task_replays[task_id] = task_replay = asyncio.Event()
+    for position in range(len(self._existing_history)):
+        record = self._existing_history[position]
+        if record['task_id'] != task_id:
+            await self._wait_for_record(position)
+        else:
+            def complete(r, exc_type, exc_val, exc_tb, position=position):
+                self._complete_record(position)
+
+            self._index_record(record)
+            yield self._NextRecord(record, complete)
+    task_replay.set()
+    await self._replay_complete()
+
+
+@step
+async def work(i):
+    return i
+
+
+@task
+async def worker(steps, pause: asyncio.Event):
+    for i in range(steps):
+        await work(i)
+        await asyncio.sleep(0)  # interleave the records of the tasks
+    await pause.wait()
+
+
+async def workflow(tasks, steps, pause):
+    await asyncio.gather(*(worker(steps, pause) for _ in range(tasks)))
+
+
+async def record_history(tasks, records) -> list:
+    # Each step leaves its end record behind; each task records its start
+    steps = max(1, records // tasks - 1)
+    history = []
+    pause = asyncio.Event()
+    historian = Historian('wid', workflow, history, serializer=NoopSerializer())
+    historian.run(tasks, steps, pause)
+    while len(history) < tasks * (steps + 1):
+        await asyncio.sleep(0.01)
+    await historian.suspend()
+    return history
+
+
+async def replay(history: list) -> float:
+    historian = Historian('wid', workflow, list(history), serializer=NoopSerializer())
+    start = time.perf_counter()
+    historian.run()
+    await historian._replay_started.wait()
+    await historian._replay_complete()
+    elapsed = time.perf_counter() - start
+    await historian.suspend()
+    return elapsed
+
+
+async def main():
+    indexed_replay_records = Historian._task_replay_records
+    for records in RECORDS:
+        for tasks in TASKS:
+            history = await record_history(tasks, records)
+
+            Historian._task_replay_records = scanning_replay_records
+            scanned = await replay(history)
+            Historian._task_replay_records = indexed_replay_records
+            indexed = await replay(history)
+
+            print(f'{tasks:>4} tasks {len(history):>7} records   '
+                  f'scan {scanned:>8.3f} s   index {indexed:>8.3f} s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
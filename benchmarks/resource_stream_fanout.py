@@ -0,0 +1,76 @@
+"""
+Workflow latency while SUBSCRIBERS slow readers stream its resources, for each overflow policy.
+
+The workflow changes a state resource UPDATES times and measures how long each change takes
+(each change publishes a resource delta to every stream).
+Each reader takes READ_DELAY seconds to handle an update, like a slow websocket connection.
+
+    PYTHONPATH=src python benchmarks/resource_stream_fanout.py
+"""
+import asyncio
+import statistics
+import time
+
+from quest import state
+from quest.historian import Historian
+from quest.serializer import NoopSerializer
+
+SUBSCRIBERS = 1000
+UPDATES = 100
+READ_DELAY = 0.01
+
+POLICIES = [
+    ('none', None, None),
+    ('block', 0, 'block'),
+    ('block', 16, 'block'),
+    ('coalesce', 1, 'coalesce'),
+    ('drop', 16, 'drop'),
+]
+
+
+async def counting_workflow(latencies: list[float]):
+    async with state('count', None, 0) as count:
+        for i in range(UPDATES):
+            start = time.perf_counter()
+            await count.set(i)
+            latencies.append(time.perf_counter() - start)
+
+
+async def slow_reader(stream, received: list[int]):
+    with stream:
+        async for _ in stream:
+            received.append(1)
+            await asyncio.sleep(READ_DELAY)
+
+
+async def run(label, buffer_size, overflow):
+    latencies = []
+    received = []
+    historian = Historian('wid', counting_workflow, [], serializer=NoopSerializer())
+    streams = [] if overflow is None else [
+        historian.get_resource_stream(None, buffer_size, overflow) for _ in range(SUBSCRIBERS)
+    ]
+
+    start = time.perf_counter()
+    workflow = historian.run(latencies)
+    readers = [asyncio.create_task(slow_reader(stream, received)) for stream in streams]
+    await workflow
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*readers)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    delivered = len(received) / SUBSCRIBERS if streams else 0
+    print(f'{label:>9} {buffer_size if buffer_size is not None else "-":>7} {elapsed:>9.2f}'
+          f' {1000 * statistics.median(latencies):>11.3f} {1000 * p99:>9.3f} {delivered:>10.1f}')
+
+
+async def main():
+    print(f'{SUBSCRIBERS} subscribers, {UPDATES} updates, {1000 * READ_DELAY:.0f} ms per read')
+    print(f'{"overflow":>9} {"buffer":>7} {"seconds":>9} {"median (ms)":>11} {"p99 (ms)":>9} {"delivered":>10}')
+    for label, buffer_size, overflow in POLICIES:
+        await run(label, buffer_size, overflow)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Cost of a resource update against the number of open resource streams.
+
+SUBSCRIBERS streams ('coalesce', buffer 1) are spread over IDENTITIES identities.
+'update' is the time ResourceStreamManager.update takes for a public or a private change;
+'delivered' is the time until every reader has woken up and read a public change.
+With idle readers (streams that are open but not being read), the update only touches the channels.
+
+    PYTHONPATH=src python benchmarks/resource_stream_index.py
+"""
+import asyncio
+import statistics
+import time
+
+from quest.resources import ResourceStreamManager
+
+SUBSCRIBERS = [100, 1_000, 10_000, 50_000]
+IDENTITIES = 100
+UPDATES = 50
+
+
+async def no_resources():
+    return {}
+
+
+async def reader(stream, received: list[int]):
+    async for _ in stream.deltas():
+        received[0] += 1
+
+
+async def timed_updates(manager: ResourceStreamManager, identity, received=None, expected=0) -> tuple[float, float]:
+    update_times = []
+    delivery_times = []
+    for _ in range(UPDATES):
+        if received is not None:
+            received[0] = 0
+        start = time.perf_counter()
+        await manager.update(identity)
+        update_times.append(time.perf_counter() - start)
+        if received is not None:
+            while received[0] < expected:
+                await asyncio.sleep(0)
+            delivery_times.append(time.perf_counter() - start)
+    return statistics.median(update_times), statistics.median(delivery_times or [0])
+
+
+async def run(subscribers: int):
+    manager = ResourceStreamManager()
+    streams = [
+        manager.get_resource_stream(f'user{i % IDENTITIES}', no_resources, 1, 'coalesce')
+        for i in range(subscribers)
+    ]
+    for stream in streams:
+        stream.__enter__()
+
+    idle_public, _ = await timed_updates(manager, None)
+    idle_private, _ = await timed_updates(manager, 'user0')
+
+    received = [0]
+    readers = [asyncio.create_task(reader(stream, received)) for stream in streams]
+    await asyncio.sleep(0)
+    while received[0] < subscribers:  # Initial snapshots
+        await asyncio.sleep(0)
+    public, delivered = await timed_updates(manager, None, received, subscribers)
+
+    manager.notify_of_workflow_stop()
+    await asyncio.gather(*readers)
+    for stream in streams:
+        stream.__exit__(None, None, None)
+
+    print(f'{subscribers:>11} {1e6 * idle_public:>13.1f} {1e6 * idle_private:>14.1f}'
+          f' {1e6 * public:>15.1f} {1000 * delivered:>14.2f}')
+
+
+async def main():
+    print(f'{IDENTITIES} identities; median of {UPDATES} updates')
+    print(f'{"subscribers":>11} {"idle public":>13} {"idle private":>14} {"reading public":>15} {"delivered":>14}')
+    print(f'{"":>11} {"update (us)":>13} {"update (us)":>14} {"update (us)":>15} {"(ms)":>14}')
+    for subscribers in SUBSCRIBERS:
+        await run(subscribers)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
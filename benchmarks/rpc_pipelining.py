@@ -0,0 +1,65 @@
+"""
+Calls per second through one websocket Client against the number of calls in flight.
+
+CALLS calls are made by CONCURRENCY tasks sharing one Client (so one /call connection).
+'has_workflow' only costs the round trip; 'ping' also waits PING_DELAY seconds on the server,
+like a call that does I/O (a storage write, a remote lookup...).
+With one call in flight, every call waits for the previous response, as before pipelining.
+
+    PYTHONPATH=src python benchmarks/rpc_pipelining.py
+"""
+import asyncio
+import time
+
+from quest import WorkflowManager
+from quest.client import Client, forward
+from quest.persistence import InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+from quest.server import Server
+
+PORT = 8765
+CALLS = 2000
+CONCURRENCY = [1, 4, 16, 64, 256]
+PING_DELAY = 0.005
+
+
+class PingManager(WorkflowManager):
+    async def ping(self, delay):
+        await asyncio.sleep(delay)
+        return delay
+
+
+class PingClient(Client):
+    @forward
+    async def ping(self, delay):
+        ...
+
+
+async def measure(client: PingClient, method: str, concurrency: int) -> float:
+    async def caller(calls: int):
+        for _ in range(calls):
+            if method == 'has_workflow':
+                await client.has_workflow('wid')
+            else:
+                await client.ping(PING_DELAY)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(CALLS // concurrency) for _ in range(concurrency)))
+    return (CALLS // concurrency) * concurrency / (time.perf_counter() - start)
+
+
+async def main():
+    manager = PingManager('rpc', InMemoryBlobStorage(), lambda wid: [], lambda w_type: None,
+                          serializer=NoopSerializer())
+    async with manager, Server(manager, 'localhost', PORT, max_concurrent_calls=max(CONCURRENCY)):
+        async with PingClient(f'ws://localhost:{PORT}') as client:
+            await client.has_workflow('wid')  # Connect
+            print(f'{"in flight":>9} {"has_workflow/s":>15} {"ping/s":>9}')
+            for concurrency in CONCURRENCY:
+                cheap = await measure(client, 'has_workflow', concurrency)
+                slow = await measure(client, 'ping', concurrency)
+                print(f'{concurrency:>9} {cheap:>15.0f} {slow:>9.0f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
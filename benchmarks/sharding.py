@@ -0,0 +1,64 @@
+"""
+Workflow throughput of ShardedWorkflowManager with 1, 2, 4 and 8 worker processes.
+
+Each workflow runs STEPS CPU-bound steps, so a single manager is limited to one core.
+Workflows are started and awaited through the supervisor, as a client would.
+
+    PYTHONPATH=src python benchmarks/sharding.py
+"""
+import asyncio
+import os
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+from quest import step, create_filesystem_manager
+from quest.sharding import ShardedWorkflowManager
+
+WORKERS = [1, 2, 4, 8]
+WORKFLOWS = 200
+STEPS = 5
+WORK = 20000
+
+
+@step
+async def crunch(seed):
+    total = seed
+    for i in range(WORK):
+        total = (total * 31 + i) % 1000003
+    return total
+
+
+async def crunching_workflow(seed):
+    for _ in range(STEPS):
+        seed = await crunch(seed)
+    return seed
+
+
+def create_manager(shard: int, save_folder: Path):
+    return create_filesystem_manager(save_folder, f'bench-{shard}', lambda w_type: crunching_workflow)
+
+
+async def run(workers: int) -> float:
+    with tempfile.TemporaryDirectory() as folder:
+        async with ShardedWorkflowManager(partial(create_manager, save_folder=Path(folder)),
+                                          workers=workers) as manager:
+            wids = [f'wid{i}' for i in range(WORKFLOWS)]
+            start = time.perf_counter()
+            await asyncio.gather(*(manager.start_workflow('workflow', wid, i, delete_on_finish=False)
+                                   for i, wid in enumerate(wids)))
+            await asyncio.gather(*(manager.get_workflow_result(wid, delete=True) for wid in wids))
+            return time.perf_counter() - start
+
+
+async def main():
+    print(f'{os.cpu_count()} cores, {WORKFLOWS} workflows of {STEPS} steps')
+    print(f'{"workers":>8} {"seconds":>10} {"workflows/s":>12}')
+    for workers in WORKERS:
+        elapsed = await run(workers)
+        print(f'{workers:>8} {elapsed:>10.2f} {WORKFLOWS / elapsed:>12.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Event loop latency while workflows run heavy steps inline, in the thread pool and in the process pool.
+
+WORKFLOWS workflows each run STEPS CPU-bound steps while a probe task sleeps 1 ms at a time
+and records how late it wakes up (how long the loop was blocked).
+'hash' steps spend their time in hashlib (which releases the GIL);
+'python' steps are pure Python (which holds it).
+
+    PYTHONPATH=src python benchmarks/step_executors.py
+"""
+import asyncio
+import hashlib
+import statistics
+import time
+
+from quest import step
+from quest.executors import shutdown_executors
+from quest.historian import Historian
+from quest.serializer import NoopSerializer
+
+WORKFLOWS = 8
+STEPS = 4
+DATA = b'x' * 20_000_000
+LOOPS = 1_000_000
+
+
+def hash_work(seed):
+    return hashlib.sha256(DATA + str(seed).encode()).hexdigest()[:8]
+
+
+def python_work(seed):
+    total = seed
+    for i in range(LOOPS):
+        total = (total * 31 + i) % 1000003
+    return total
+
+
+async def inline_hash(seed):
+    return hash_work(seed)
+
+
+async def inline_python(seed):
+    return python_work(seed)
+
+
+STEP_FUNCTIONS = {
+    ('hash', 'inline'): step(inline_hash),
+    ('hash', 'thread'): step(executor='thread')(hash_work),
+    ('hash', 'process'): step(executor='process')(hash_work),
+    ('python', 'inline'): step(inline_python),
+    ('python', 'thread'): step(executor='thread')(python_work),
+    ('python', 'process'): step(executor='process')(python_work),
+}
+
+
+async def probe(delays: list[float]):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        delays.append(time.perf_counter() - start - 0.001)
+
+
+async def run(work: str, mode: str):
+    heavy_step = STEP_FUNCTIONS[work, mode]
+
+    async def workflow(index):
+        for i in range(STEPS):
+            await heavy_step(index * STEPS + i)
+
+    delays = []
+    probing = asyncio.create_task(probe(delays))
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        Historian(f'wid{i}', workflow, [], serializer=NoopSerializer()).run(i)
+        for i in range(WORKFLOWS)
+    ))
+    elapsed = time.perf_counter() - start
+    probing.cancel()
+
+    delays.sort()
+    p99 = delays[int(len(delays) * 0.99)] if delays else 0
+    print(f'{work:>7} {mode:>8} {elapsed:>9.2f} {1000 * statistics.median(delays or [0]):>10.2f}'
+          f' {1000 * p99:>9.2f} {1000 * max(delays or [0]):>9.2f}')
+
+
+async def main():
+    print(f'{WORKFLOWS} workflows x {STEPS} steps; loop delay in ms')
+    print(f'{"work":>7} {"executor":>8} {"seconds":>9} {"median":>10} {"p99":>9} {"max":>9}')
+    for work, mode in STEP_FUNCTIONS:
+        await run(work, mode)
+    shutdown_executors()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
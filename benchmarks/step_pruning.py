@@ -0,0 +1,115 @@
+"""
+Cost of completing steps, pruning through the historian's step index
+vs. searching the history backwards from the end of the step (the previous approach).
+
+- loops: many tasks running long loops of steps at the same time; the records of the
+  other tasks are interleaved with each step's own records, so the search walks all of them
+- tree: a deeply nested tree of steps, each step searching back over its children
+
+    PYTHONPATH=src python benchmarks/step_pruning.py
+"""
+import asyncio
+import time
+
+from quest import step, task
+from quest.historian import Historian
+from quest.history import remove_many
+from quest.serializer import NoopSerializer
+
+LOOP_TASKS = [10, 100, 400]
+LOOP_STEPS = 50
+TREE_DEPTH = 8
+TREE_BREADTH = 3
+
+
+class DictHistory:
+    """An in-memory history with O(1) removal, so only the pruning itself is measured"""
+
+    def __init__(self):
+        self._items = {}
+        self._next_seq = 0
+
+    def append(self, item):
+        item['seq'] = self._next_seq
+        self._next_seq += 1
+        self._items[item['seq']] = item
+
+    def remove(self, item):
+        del self._items[item['seq']]
+
+    def clear(self):
+        self._items.clear()
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __reversed__(self):
+        return reversed(self._items.values())
+
+
+def search_prune(self, step_id: str):
+    """The previous _prune: walk the history backwards until the start of the step"""
+    self._step_records.pop(step_id, None)
+    items = reversed(self._history)
+    record = next(items)
+    assert record['type'] == 'end' and record['step_id'] == step_id
+    to_delete = []
+    end_of_life_resources = set()
+    for record in items:
+        if record['step_id'].startswith(step_id):
+            if record['type'] == 'delete_resource':
+                end_of_life_resources.add(record['resource_id'])
+            to_delete.append(record)
+        if record['type'] == 'external' and record['resource_id'] in end_of_life_resources:
+            to_delete.append(record)
+        if record['step_id'] == step_id:
+            break
+    remove_many(self._history, to_delete)
+
+
+@step
+async def leaf(i):
+    await asyncio.sleep(0)  # let the other tasks record their steps
+    return i
+
+
+async def loops(tasks):
+    async def loop():
+        return sum([await leaf(i) for i in range(LOOP_STEPS)])
+
+    return sum(await asyncio.gather(*(task(loop)() for _ in range(tasks))))
+
+
+@step
+async def tree(depth):
+    if depth == 0:
+        return 1
+    total = 0
+    for _ in range(TREE_BREADTH):
+        total += await tree(depth - 1)
+    return total
+
+
+async def run(workflow, *args):
+    historian = Historian('wid', workflow, DictHistory(), serializer=NoopSerializer())
+    start = time.perf_counter()
+    await historian.run(*args)
+    return time.perf_counter() - start
+
+
+async def main():
+    cases = [(f'{n} tasks x {LOOP_STEPS} steps', loops, n) for n in LOOP_TASKS]
+    cases.append((f'tree depth={TREE_DEPTH} breadth={TREE_BREADTH} '
+                  f'({sum(TREE_BREADTH ** d for d in range(TREE_DEPTH + 1))} steps)', tree, TREE_DEPTH))
+
+    indexed_prune = Historian._prune_step
+    for name, workflow, arg in cases:
+        Historian._prune_step = search_prune
+        searched = await run(workflow, arg)
+        Historian._prune_step = indexed_prune
+        indexed = await run(workflow, arg)
+        print(f'{name:<45} search {searched:>8.3f} s   index {indexed:>8.3f} s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
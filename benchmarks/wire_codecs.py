@@ -0,0 +1,94 @@
+"""
+Encode and decode cost, and bytes on the wire, of each wire codec for typical Server/Client messages.
+
+'snapshot' is a /stream snapshot of RESOURCES resources spread over identities,
+'delta' a /stream delta with one resource added and one removed,
+'result' a /call response with a step result (a list of RECORDS records),
+and 'batch' a batch of BATCH send_event calls.
+'deflated' is the size of the frame after permessage-deflate (as negotiated with compression='deflate').
+Codecs whose package is not installed are skipped.
+
+    PYTHONPATH=src python benchmarks/wire_codecs.py
+"""
+import asyncio
+import time
+import zlib
+
+from quest.client import deserialize_resource_message
+from quest.codec import available_codecs, get_codec
+from quest.server import serialize_resource_message
+
+RESOURCES = 1000
+RECORDS = 500
+BATCH = 1000
+ROUNDS = 50
+
+
+def make_messages():
+    resources = {
+        (f'resource{i}', None if i % 10 == 0 else f'user{i % 100}'): 'quest.external.State'
+        for i in range(RESOURCES)
+    }
+    snapshot = {'epoch': 'a8f3c2', 'seq': 1234, 'resources': resources}
+    delta = {
+        'epoch': 'a8f3c2', 'seq': 1235,
+        'added': {('answer', 'user7'): 'quest.external.Queue'},
+        'removed': [('question', 'user7')]
+    }
+    result = {'id': 42, 'result': [
+        {'id': i, 'name': f'student{i}', 'score': i * 0.37, 'passed': i % 3 != 0, 'tags': ['lab', 'week3']}
+        for i in range(RECORDS)
+    ]}
+    batch = {'id': 43, 'batch': [
+        {'method': 'send_event', 'args': [f'wid{i}', 'messages', None, 'put', f'message {i}'], 'kwargs': {}}
+        for i in range(BATCH)
+    ]}
+    return snapshot, delta, result, batch
+
+
+def deflated_size(frame: str | bytes) -> int:
+    # permessage-deflate: a raw deflate stream, flushed at the end of each message
+    data = frame.encode() if isinstance(frame, str) else frame
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+async def timed(function, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await function(*args)
+    return (time.perf_counter() - start) / ROUNDS
+
+
+async def main():
+    snapshot, delta, result, batch = make_messages()
+    print(f'{"message":>8} {"codec":>8} {"encode (us)":>12} {"decode (us)":>12} {"bytes":>9} {"deflated":>9}')
+    for label, message in [('snapshot', snapshot), ('delta', delta), ('result', result), ('batch', batch)]:
+        for name in ['json', 'msgpack', 'cbor']:
+            if name not in available_codecs():
+                print(f'{label:>8} {name:>8} {"(not installed)":>12}')
+                continue
+            codec = get_codec(name)
+
+            if label in ('snapshot', 'delta'):
+                # Resource messages also turn the resource keys into the codec's format and back
+                async def encode():
+                    return codec.encode(await serialize_resource_message(message, codec))
+
+                async def decode(frame):
+                    return deserialize_resource_message(frame, codec)
+            else:
+                async def encode():
+                    return codec.encode(message)
+
+                async def decode(frame):
+                    return codec.decode(frame)
+
+            frame = await encode()
+            size = len(frame.encode() if isinstance(frame, str) else frame)
+            print(f'{label:>8} {name:>8} {1e6 * await timed(encode):>12.1f} {1e6 * await timed(decode, frame):>12.1f}'
+                  f' {size:>9} {deflated_size(frame):>9}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -89,3 +89,51 @@ async def test_basic_tasks_resume():
 
     assert counters['tasks_resume'] == 4
     assert result == 'foofooabcbarbarfoofooxyzbarbar'
+
+
+@step
+async def count_step(i):
+    return i
+
+
+@task
+async def count_task(n, counter):
+    total = 0
+    for i in range(n):
+        total += await count_step(i)
+        await asyncio.sleep(0)  # interleave the records of the tasks
+    await pauses[counter].wait()
+    return total
+
+
+async def many_tasks_workflow(tasks, n, counter):
+    return sum(await asyncio.gather(*(count_task(n, counter) for _ in range(tasks))))
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_replay_waits_per_task():
+    pauses['replay_waits'] = asyncio.Event()
+
+    history = []
+    historian = Historian('test', many_tasks_workflow, history, serializer=NoopSerializer())
+    historian.run(10, 20, 'replay_waits')
+    await asyncio.sleep(0.1)
+    await historian.suspend()
+    assert len(history) > 200
+
+    # The replay keeps track of the tasks that are waiting, not of every record
+    most_waiters = 0
+    wait_for_record = historian._wait_for_record
+
+    async def counting_wait_for_record(position):
+        nonlocal most_waiters
+        most_waiters = max(most_waiters, len(historian._replay_waiters) + 1)
+        await wait_for_record(position)
+
+    historian._wait_for_record = counting_wait_for_record
+
+    pauses['replay_waits'].set()
+    assert await historian.run() == 10 * sum(range(20))
+    assert 0 < most_waiters <= 12  # the tasks, the main task and the external handler
+    assert not historian._replay_waiters
@@ -0,0 +1,54 @@
+import pytest
+
+from quest.client import deserialize_resource_message
+from quest.codec import JSON_CODEC, available_codecs, get_codec
+from quest.server import serialize_resource_message
+
+snapshot = {
+    'epoch': 'e',
+    'seq': 3,
+    'resources': {('messages', None): 'quest.external.Queue', ('phrase', 'alice'): 'quest.external.State'}
+}
+delta = {
+    'epoch': 'e',
+    'seq': 4,
+    'added': {('score', 'bob'): 'quest.external.State'},
+    'removed': [('messages', None)]
+}
+
+
+def codec_params():
+    return [
+        pytest.param(name, marks=pytest.mark.skipif(name not in available_codecs(), reason=f'{name} not installed'))
+        for name in ['json', 'msgpack', 'cbor']
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('name', codec_params())
+async def test_resource_messages_round_trip(name):
+    codec = get_codec(name)
+    for message in [snapshot, delta]:
+        frame = codec.encode(await serialize_resource_message(message, codec))
+        assert isinstance(frame, str if name == 'json' else bytes)
+        assert deserialize_resource_message(frame, codec) == message
+
+
+@pytest.mark.parametrize('name', codec_params())
+def test_call_messages_round_trip(name):
+    codec = get_codec(name)
+    call = {'id': 7, 'method': 'send_event', 'args': ['wid', 'messages', None, 'put', [1, 2.5, 'x']], 'kwargs': {}}
+    assert codec.decode(codec.encode(call)) == call
+
+
+@pytest.mark.asyncio
+async def test_json_resource_keys():
+    # JSON keeps the format of clients from before codecs were negotiated
+    message = await serialize_resource_message(snapshot)
+    assert message['resources'] == {'messages||': 'quest.external.Queue', 'phrase||alice': 'quest.external.State'}
+    assert JSON_CODEC.encode_resource_keys(delta['removed']) == ['messages||']
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec('xml')
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from quest import Historian, PersistentHistory, continue_as_new, queue, step, alias
+from quest.manager import WorkflowManager
+from quest.persistence import InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+from .utils import timeout
+
+
+@step
+async def add(total, value):
+    return total + value
+
+
+async def count_messages(total):
+    # Continue as new after every 3 messages, so the history never holds more than 3 of them
+    async with queue('messages', None) as messages:
+        for _ in range(3):
+            value = await messages.get()
+            if value is None:
+                return total
+            total = await add(total, value)
+    continue_as_new(total)
+
+
+async def counting_workflow(total):
+    async with alias('counter'):
+        return await count_messages(total)
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_continue_as_new():
+    storage = InMemoryBlobStorage()
+    histories = {}
+
+    def create_history(wid: str):
+        if wid not in histories:
+            histories[wid] = PersistentHistory(wid, InMemoryBlobStorage())
+        return histories[wid]
+
+    def create_manager():
+        return WorkflowManager('test-continue', storage, create_history, lambda w_type: counting_workflow,
+                               serializer=NoopSerializer())
+
+    async with create_manager() as manager:
+        manager.start_workflow('workflow', 'wid', 0, delete_on_finish=False)
+        await asyncio.sleep(0.1)
+        sizes = []
+        for value in range(1, 11):
+            await manager.send_event('counter', 'messages', None, 'put', value)
+            await asyncio.sleep(0.01)
+            sizes.append(len(histories['wid']))
+
+        # The history starts over every 3 messages
+        assert sizes[3:6] == sizes[6:9]
+        assert [record['type'] for record in histories['wid']][0] == 'continue'
+
+    # The workflow resumes from its latest run (with the alias and queue rebuilt)
+    async with create_manager() as manager:
+        await asyncio.sleep(0.1)
+        assert await manager.get_resources('counter', None)
+        await manager.send_event('counter', 'messages', None, 'put', None)
+        assert await manager.get_workflow_result('wid') == 55
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_continue_as_new_finishes_interrupted_removal():
+    history = []
+
+    historian = Historian('wid', count_messages, history, serializer=NoopSerializer())
+    historian.run(0)
+    await asyncio.sleep(0.1)
+    await historian.record_external_event('messages', None, 'put', 5)
+    await asyncio.sleep(0.1)
+    await historian.suspend()
+
+    # As if continue_as_new had written its record but not removed the old ones
+    old_records = list(history)
+    history.append({'type': 'continue', 'timestamp': '', 'step_id': 'continue',
+                    'task_id': 'wid.external', 'args': [100], 'kwargs': {}})
+
+    historian = Historian('wid', count_messages, history, serializer=NoopSerializer())
+    task = historian.run(0)
+    await asyncio.sleep(0.1)
+    assert not any(record in history for record in old_records)
+
+    await historian.record_external_event('messages', None, 'put', None)
+    assert await task == 100
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_continue_as_new_keeps_unconsumed_items():
+    history = []
+
+    historian = Historian('wid', count_messages, history, serializer=NoopSerializer())
+    task = historian.run(0)
+    await asyncio.sleep(0.1)
+
+    # More items than one run gets: the last two are still in the queue when the run continues
+    for value in [1, 2, 3, 4, None]:
+        await historian.record_external_event('messages', None, 'put', value)
+    assert await task == 10
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_continue_as_new_keeps_unconsumed_items_across_resume():
+    history = []
+    gate = asyncio.Event()
+
+    @step
+    async def slow_add(total, value):
+        await gate.wait()
+        return total + value
+
+    async def gated_count(total):
+        async with queue('messages', None) as messages:
+            for _ in range(3):
+                value = await messages.get()
+                if value is None:
+                    return total
+                total = await slow_add(total, value)
+        continue_as_new(total)
+
+    historian = Historian('wid', gated_count, history, serializer=NoopSerializer())
+    historian.run(0)
+    await asyncio.sleep(0.1)
+    for value in [1, 2, 3, 4, 5, 6, 7]:
+        await historian.record_external_event('messages', None, 'put', value)
+    gate.set()
+    await asyncio.sleep(0.1)
+    await historian.suspend()
+    assert history[0]['type'] == 'continue'
+
+    # The items put again in the new run are replayed, not put a second time
+    historian = Historian('wid', gated_count, history, serializer=NoopSerializer())
+    task = historian.run(0)
+    await asyncio.sleep(0.1)
+    await historian.record_external_event('messages', None, 'put', None)
+    assert await task == 28
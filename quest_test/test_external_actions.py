@@ -3,7 +3,7 @@ import asyncio
 import pytest
 
 from quest.external import state, queue, event, wrap_as_state, wrap_as_queue, MultiQueue
-from quest.historian import Historian
+from quest.historian import Historian, continue_as_new
 from quest.wrappers import task, step
 from quest.serializer import NoopSerializer
 from .utils import timeout
@@ -168,6 +168,31 @@ async def test_queue_tasks():
     assert await workflow == [1, 2, 3, 4, 5]
 
 
+@pytest.mark.asyncio
+@timeout(3)
+async def test_has_resource():
+    id_foo = 'FOO'
+    id_bar = 'BAR'
+    historian = Historian('test', queue_task_workflow, [], serializer=NoopSerializer())
+
+    workflow = historian.run(id_foo, id_bar)
+    await wait_for(historian)
+
+    assert await historian.has_resource('foo', id_foo)
+    assert await historian.has_resource('foo_done', id_bar)
+    assert not await historian.has_resource('foo', None)
+    assert not await historian.has_resource('bar', id_foo)
+
+    await historian.record_external_event('foo_done', id_foo, 'set')
+    await historian.record_external_event('foo_done', id_bar, 'set')
+    assert await workflow == []
+
+    # The resources were deleted with the tasks that created them
+    assert not await historian.has_resource('foo', id_foo)
+    assert await historian.get_resources(id_foo) == {}
+    assert historian._identity_resources == {}
+
+
 @task
 async def level2():
     async with queue('the_queue', None) as the_queue:
@@ -406,3 +431,132 @@ def is_waiting(task: asyncio.Task):
     coro = task.get_coro()
     return hasattr(coro, 'cr_await') and getattr(coro, 'cr_await') is not None
 """
+
+
+# Test step pruning
+
+class ForwardOnlyHistory(list):
+    """Steps are pruned through the historian's step index, never by searching the history"""
+
+    def __reversed__(self):
+        raise AssertionError('The history should not be searched when pruning a step')
+
+
+@step
+async def countdown(n):
+    if n == 0:
+        return 0
+    return await countdown(n - 1) + 1
+
+
+@step
+async def read_scoped_queue(identity, gate: asyncio.Event):
+    async with queue('items', identity) as items:
+        await countdown(3)
+        await gate.wait()
+        return await items.get()
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_prune_uses_step_index():
+    gate = asyncio.Event()
+    history_seen = []
+
+    async def pruning_workflow(identity):
+        depth = await countdown(5)
+        item = await read_scoped_queue(identity, gate)
+        history_seen.extend(history)
+        return depth, item
+
+    history = ForwardOnlyHistory()
+    historian = Historian('test', pruning_workflow, history, serializer=NoopSerializer())
+    historian.run('foo_ident')
+    await wait_for(historian)
+
+    await wrap_as_queue('items', 'foo_ident', historian).put('hello')
+
+    # Suspend inside the step, so resuming replays its records before pruning it
+    await historian.suspend()
+    gate.set()
+    assert await historian.run('foo_ident') == (5, 'hello')
+
+    # Only the end records of the outermost steps are left,
+    #  the external event of the step-scoped queue is removed with the step
+    assert [(record['type'], record['step_id']) for record in history_seen if 'pruning_workflow.' in record['step_id']] == [
+        ('end', 'test.main.pruning_workflow.countdown'),
+        ('end', 'test.main.pruning_workflow.read_scoped_queue'),
+    ]
+    assert not any(record['type'] == 'external' for record in history_seen)
+
+
+# Test queue compaction
+
+async def summing_service(identity, count, gate: asyncio.Event):
+    total = 0
+    async with queue('numbers', identity) as numbers:
+        for i in range(count):
+            if i == count // 2:
+                await gate.wait()
+            total += await numbers.get()
+    return total
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_consumed_queue_items_are_compacted():
+    gate = asyncio.Event()
+    history = []
+    historian = Historian('test', summing_service, history, serializer=NoopSerializer())
+    historian.run('foo_ident', 10, gate)
+    await wait_for(historian)
+    numbers = wrap_as_queue('numbers', 'foo_ident', historian)
+
+    for value in range(7):
+        await numbers.put(value)
+        await wait_for(historian)
+
+    # Each consumed item leaves only the end of its get,
+    #  the items that are still in the queue keep their puts
+    assert [record['result'] for record in history if record['type'] == 'internal_end'] == [0, 1, 2, 3, 4]
+    assert [record['args'] for record in history if record['type'] == 'external'] == [[5], [6]]
+    assert not any(record['type'] == 'internal_start' and record['action'] == 'get' for record in history)
+
+    # The compacted gets replay from their results, the queued items from their puts
+    await historian.suspend()
+    gate.set()
+    workflow = historian.run('foo_ident', 10, gate)
+    await wait_for(historian)
+    for value in range(7, 10):
+        await numbers.put(value)
+    assert await workflow == sum(range(10))
+
+
+async def continuing_sum(total):
+    async with queue('numbers', None) as numbers:
+        for _ in range(5):
+            if (value := await numbers.get()) is None:
+                return total
+            total += value
+    continue_as_new(total)
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_compaction_with_continue_as_new_bounds_the_history():
+    history = []
+    historian = Historian('test', continuing_sum, history, serializer=NoopSerializer())
+    workflow = historian.run(0)
+    await wait_for(historian)
+
+    sizes = []
+    for value in range(50):
+        await historian.record_external_event('numbers', None, 'put', value)
+        await wait_for(historian)
+        sizes.append(len(history))
+    await historian.record_external_event('numbers', None, 'put', None)
+    assert await workflow == sum(range(50))
+
+    # Compaction leaves one record per consumed item, and each run starts a fresh history,
+    #  so the history grows with the items of a run rather than with the traffic
+    assert max(sizes) == max(sizes[5:10])
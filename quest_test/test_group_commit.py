@@ -0,0 +1,184 @@
+import asyncio
+import os
+
+import pytest
+
+from quest import GroupCommitter, PersistentHistory, SegmentedLogHistory, queue, step
+from quest.historian import Historian
+from quest.persistence import LocalFileSystemBlobStorage
+from quest.serializer import NoopSerializer
+from .utils import CountingBlobStorage, make_record, timeout
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_appends_in_one_tick_share_a_batch():
+    committer = GroupCommitter()
+    storages = [CountingBlobStorage() for _ in range(10)]
+    histories = [PersistentHistory('wid', storage, committer=committer) for storage in storages]
+
+    for i in range(5):
+        for history in histories:
+            history.append(make_record(i))
+
+    # Nothing is written until the end of the tick
+    assert all(storage.writes == 0 for storage in storages)
+    await histories[0].commit()
+
+    # 5 record blobs + a single index write per history
+    assert all(storage.writes == 6 for storage in storages)
+    assert all(len(PersistentHistory('wid', storage)) == 5 for storage in storages)
+
+    metrics = committer.get_metrics()
+    assert metrics['batches'] == 1
+    assert metrics['batch_size_max'] == 50
+    assert metrics['syncs'] == 0  # In-memory storage has nothing to sync
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_remove_before_flush_is_never_written():
+    committer = GroupCommitter()
+    storage = CountingBlobStorage()
+    history = PersistentHistory('wid', storage, committer=committer)
+
+    history.append(keep := make_record(0))
+    history.append(drop := make_record(1))
+    history.remove(drop)
+    await history.commit()
+
+    assert storage.writes == 2
+    assert list(PersistentHistory('wid', storage)) == [keep]
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_batch_policy_syncs_blob_files(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.append(fd) or fsync(fd))
+
+    committer = GroupCommitter()
+    history = PersistentHistory('wid', LocalFileSystemBlobStorage(tmp_path), committer=committer)
+    history.append(make_record(0))
+    history.append(make_record(1))
+    await history.commit()
+
+    # The two records, the index and the folder
+    assert len(synced) == 4
+    assert committer.get_metrics()['syncs'] == 1
+
+
+def test_always_policy_writes_immediately(tmp_path):
+    committer = GroupCommitter(durability='always')
+    history = SegmentedLogHistory(tmp_path, committer=committer)
+    records = [make_record(i) for i in range(3)]
+    for record in records:
+        history.append(record)
+
+    assert list(SegmentedLogHistory(tmp_path)) == records
+    assert committer.get_metrics()['syncs'] == 3
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_interval_policy_limits_syncs(tmp_path):
+    committer = GroupCommitter(durability='interval', sync_interval=60)
+    history = SegmentedLogHistory(tmp_path, committer=committer)
+    records = [make_record(i) for i in range(3)]
+    for record in records:
+        history.append(record)
+        await history.commit()
+
+    metrics = committer.get_metrics()
+    assert metrics['batches'] == 3
+    assert metrics['syncs'] == 0
+    assert list(SegmentedLogHistory(tmp_path)) == records
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_interval_policy_syncs_trailing_writes(tmp_path):
+    committer = GroupCommitter(durability='interval', sync_interval=0.1)
+    history = SegmentedLogHistory(tmp_path, committer=committer)
+    history.append(make_record(0))
+    await history.commit()
+    assert committer.get_metrics()['syncs'] == 0
+
+    # No more changes come, but the written lines are still synced once the interval has passed
+    await asyncio.sleep(0.2)
+    assert committer.get_metrics()['syncs'] == 1
+    assert not history._unsynced_segments
+
+
+class FlakyBlobStorage(CountingBlobStorage):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def write_blob(self, key, blob):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('disk full')
+        super().write_blob(key, blob)
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_failed_history_does_not_block_the_batch():
+    committer = GroupCommitter(window=0.01, retry_delay=0.05)
+    flaky = FlakyBlobStorage(failures=1)
+    storages = [CountingBlobStorage(), flaky, CountingBlobStorage()]
+    histories = [PersistentHistory('wid', storage, committer=committer) for storage in storages]
+    for history in histories:
+        history.append(make_record(0))
+        history.append(make_record(1))
+
+    # Waiting on the batch raises the error of the failed history only
+    results = await asyncio.gather(*(history.commit() for history in histories), return_exceptions=True)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], OSError)
+
+    # The histories after the failed one were written
+    assert len(PersistentHistory('wid', storages[2])) == 2
+    assert committer.get_metrics()['pending_histories'] == 1
+
+    # The failed history kept its changes and is written by the retry
+    await asyncio.sleep(0.1)
+    assert committer.get_metrics()['pending_histories'] == 0
+    assert list(PersistentHistory('wid', flaky)) == [make_record(0) | {'seq': 0}, make_record(1) | {'seq': 1}]
+
+
+@step
+async def double(value):
+    return value * 2
+
+
+async def workflow():
+    async with queue('numbers', None) as numbers:
+        total = 0
+        while (number := await numbers.get()) is not None:
+            total += await double(number)
+        return total
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_workflow_with_windowed_commit(tmp_path):
+    # External events wait for their batch; suspend flushes whatever is left
+    committer = GroupCommitter(window=0.05)
+
+    historian = Historian('test', workflow, SegmentedLogHistory(tmp_path, committer=committer), NoopSerializer())
+    historian.run()
+    await asyncio.sleep(0.01)
+    await historian.record_external_event('numbers', None, 'put', 1)
+    await historian.record_external_event('numbers', None, 'put', 2)
+    await asyncio.sleep(0.01)
+    await historian.suspend()
+    assert committer.get_metrics()['pending_histories'] == 0
+
+    historian = Historian('test', workflow, SegmentedLogHistory(tmp_path, committer=committer), NoopSerializer())
+    task = historian.run()
+    await asyncio.sleep(0.01)
+    await historian.record_external_event('numbers', None, 'put', None)
+    assert await task == 6
@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+
+from quest import GroupCommitter, PersistentHistory, queue
+from quest.leases import SqliteLeaseStore
+from quest.manager import WorkflowManager, DuplicateWorkflowException, LeaseLostException
+from quest.persistence import InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+from .utils import timeout
+
+
+def test_sqlite_lease_fencing(tmp_path):
+    leases = SqliteLeaseStore(tmp_path / 'leases.db')
+
+    lease = leases.create('wid', 'a', 0.05, {'x': 1})
+    assert lease['owner'] == 'a' and lease['data'] == {'x': 1}
+    assert leases.create('wid', 'b', 10, {}) is None
+    assert leases.acquire('wid', 'b', 10) is None  # Still held by a
+
+    time.sleep(0.1)
+    taken = leases.acquire('wid', 'b', 10)
+    assert taken['owner'] == 'b' and taken['token'] > lease['token']
+
+    # a's token is stale, so it can no longer touch the lease
+    assert leases.renew('a', {'wid': lease['token']}, 10) == set()
+    assert not leases.release('wid', 'a', lease['token'])
+    assert not leases.delete('wid', 'a', lease['token'])
+
+    assert leases.renew('b', {'wid': taken['token']}, 10) == {'wid'}
+    assert leases.release('wid', 'b', taken['token'])
+    assert leases.acquire('wid', 'a', 10)['owner'] == 'a'
+
+    # Another connection to the same database sees the same leases
+    assert [lease['owner'] for lease in SqliteLeaseStore(tmp_path / 'leases.db').get_leases()] == ['a']
+
+
+async def wait_until(condition, interval=0.05):
+    while not condition():
+        await asyncio.sleep(interval)
+
+
+@pytest.mark.asyncio
+@timeout(20)
+async def test_managers_share_workflows(tmp_path):
+    leases = SqliteLeaseStore(tmp_path / 'leases.db')
+    storages = {}
+
+    def create_history(wid: str):
+        return PersistentHistory(wid, storages.setdefault(wid, InMemoryBlobStorage()))
+
+    async def workflow(arg):
+        async with queue('messages', None) as messages:
+            return arg + await messages.get()
+
+    def create_manager(owner):
+        return WorkflowManager(f'test-{owner}', InMemoryBlobStorage(), create_history, lambda w_type: workflow,
+                               serializer=NoopSerializer(), leases=leases, owner=owner, lease_duration=0.3)
+
+    def owners():
+        return sorted(lease['owner'] or '' for lease in leases.get_leases())
+
+    wids = [f'wid{i}' for i in range(4)]
+    async with create_manager('a') as manager_a:
+        for i, wid in enumerate(wids):
+            manager_a.start_workflow('workflow', wid, i, delete_on_finish=False)
+        assert owners() == ['a'] * 4
+
+        manager_b = await create_manager('b').__aenter__()
+        with pytest.raises(DuplicateWorkflowException):
+            manager_b.start_workflow('workflow', 'wid0', 0)
+
+        # b joins and a hands half of the workflows over
+        await wait_until(lambda: owners() == ['a', 'a', 'b', 'b'])
+        await wait_until(lambda: len(manager_b._workflows) == 2)
+
+        # b stops renewing (as if its lease store hung), so its leases lapse and a takes its workflows back
+        b_historians = list(manager_b._workflows.values())
+        manager_b._lease_task.cancel()
+        # b suspends its workflows before the leases expire, i.e. before a can claim them
+        await wait_until(lambda: not manager_b._workflows, interval=0.01)
+        assert owners() == ['a', 'a', 'b', 'b']
+        assert all(historian._run_task.cancelled() for historian in b_historians)
+        await wait_until(lambda: owners() == ['a'] * 4)
+        await wait_until(lambda: len(manager_a._workflows) == 4)
+
+        # b cannot release the leases it lost
+        await manager_b.__aexit__(None, None, None)
+        assert owners() == ['a'] * 4
+
+        for wid in wids:
+            await manager_a.send_event(wid, 'messages', None, 'put', 10)
+        assert [await manager_a.get_workflow_result(wid) for wid in wids] == [10, 11, 12, 13]
+
+    assert leases.get_leases() == []
+    assert leases.get_members() == []
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_history_writes_check_the_lease(tmp_path):
+    leases = SqliteLeaseStore(tmp_path / 'leases.db')
+    storage = InMemoryBlobStorage()
+    committer = GroupCommitter(window=0.1)
+
+    async def workflow():
+        async with queue('messages', None) as messages:
+            total = 0
+            while (message := await messages.get()) is not None:
+                total += message
+            return total
+
+    async with WorkflowManager('test', InMemoryBlobStorage(),
+                               lambda wid: PersistentHistory(wid, storage, committer=committer),
+                               lambda w_type: workflow, serializer=NoopSerializer(),
+                               leases=leases, owner='a', lease_duration=10) as manager:
+        manager.start_workflow('workflow', 'wid')
+        await asyncio.sleep(0.2)
+
+        # The check makes no call to the lease store, so a busy store (e.g. a slow renewal) does not hold up writes
+        with leases._lock:
+            await manager.send_event('wid', 'messages', None, 'put', 1)
+        records = len(PersistentHistory('wid', storage))
+
+        # The event is buffered by the committer when the renewals stall past the deadline,
+        #  so it is dropped instead of being written, and the workflow is suspended
+        sending = asyncio.create_task(manager.send_event('wid', 'messages', None, 'put', 2))
+        await asyncio.sleep(0.05)
+        manager._lease_deadline = time.monotonic()
+        with pytest.raises(LeaseLostException):
+            await sending
+        assert len(PersistentHistory('wid', storage)) == records
+        await wait_until(lambda: not manager.has_workflow('wid'))
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from quest import step
+from quest.historian import Historian
+from quest.log_history import SegmentedLogHistory, migrate_persistent_history, MANIFEST
+from quest.persistence import PersistentHistory, InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+from .utils import make_record, timeout
+
+
+def test_log_recovers_appends_and_removes(tmp_path):
+    history = SegmentedLogHistory(tmp_path, segment_size=4)
+    records = [make_record(i) for i in range(10)]
+    for record in records:
+        history.append(record)
+    history.remove(records[3])
+    history.remove(records[7])
+
+    # 10 appends + 2 tombstones = 12 lines -> 3 segments
+    assert len(json.loads((tmp_path / MANIFEST).read_text())['segments']) == 3
+
+    recovered = SegmentedLogHistory(tmp_path, segment_size=4)
+    expected = [r for i, r in enumerate(records) if i not in (3, 7)]
+    assert list(recovered) == expected
+    assert list(reversed(recovered)) == expected[::-1]
+
+
+def test_log_compaction(tmp_path):
+    history = SegmentedLogHistory(tmp_path, segment_size=4)
+    records = [make_record(i) for i in range(10)]
+    for record in records:
+        history.append(record)
+    for record in records[:8]:
+        history.remove(record)
+
+    segments = json.loads((tmp_path / MANIFEST).read_text())['segments']
+    assert len(segments) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([MANIFEST, *segments])
+    assert list(SegmentedLogHistory(tmp_path)) == records[8:]
+
+
+def test_log_compaction_syncs_before_deleting(tmp_path, monkeypatch):
+    history = SegmentedLogHistory(tmp_path, segment_size=4)
+    records = [make_record(i) for i in range(4)]
+    for record in records:
+        history.append(record)
+
+    events = []
+    fsync, unlink = os.fsync, os.unlink
+    monkeypatch.setattr(os, 'fsync', lambda fd: events.append('fsync') or fsync(fd))
+    monkeypatch.setattr(os, 'unlink', lambda path, *args, **kwargs: events.append('unlink') or unlink(path))
+    history.compact()
+
+    # The new segment, the manifest and the folder are synced before the old segment is deleted
+    assert events == ['fsync', 'fsync', 'fsync', 'unlink']
+    assert list(SegmentedLogHistory(tmp_path)) == records
+
+
+def test_log_ignores_torn_tail(tmp_path):
+    history = SegmentedLogHistory(tmp_path)
+    records = [make_record(0), make_record(1)]
+    for record in records:
+        history.append(record)
+
+    segment = json.loads((tmp_path / MANIFEST).read_text())['segments'][-1]
+    with (tmp_path / segment).open('a') as file:
+        file.write('{"seq": 2, "rec')
+
+    assert list(SegmentedLogHistory(tmp_path)) == records
+
+
+def test_migrate_persistent_history(tmp_path):
+    storage = InMemoryBlobStorage()
+    old = PersistentHistory('wid', storage)
+    records = [make_record(i) for i in range(5)]
+    for record in records:
+        old.append(record)
+
+    history = migrate_persistent_history('wid', storage, tmp_path / 'wid')
+    assert list(history) == records
+    assert not storage._data
+
+    # The migrated history behaves like any other log
+    history.remove(records[0])
+    assert list(SegmentedLogHistory(tmp_path / 'wid')) == records[1:]
+
+
+@step
+async def double(value):
+    return value * 2
+
+
+gate = asyncio.Event()
+
+
+async def workflow(value):
+    value = await double(value)
+    await gate.wait()
+    return await double(value)
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_log_history_resume(tmp_path):
+    historian = Historian('test', workflow, SegmentedLogHistory(tmp_path), serializer=NoopSerializer())
+    historian.run(3)
+    await asyncio.sleep(0.01)
+    await historian.suspend()
+
+    gate.set()
+    historian = Historian('test', workflow, SegmentedLogHistory(tmp_path), serializer=NoopSerializer())
+    assert await historian.run(3) == 12
+
+    # Completed workflows clear their history
+    assert not any(tmp_path.iterdir())
+
+
+def test_log_remove_many(tmp_path):
+    history = SegmentedLogHistory(tmp_path, segment_size=100)
+    records = [make_record(i) for i in range(10)]
+    for record in records:
+        history.append(record)
+    history.remove_many(records[2:8])
+
+    assert list(SegmentedLogHistory(tmp_path)) == records[:2] + records[8:]
+    assert len((tmp_path / '00000000.log').read_text().splitlines()) == 16
+
+
+def test_log_appends_after_torn_tail(tmp_path):
+    history = SegmentedLogHistory(tmp_path)
+    records = [make_record(i) for i in range(6)]
+    for record in records[:3]:
+        history.append(record)
+
+    segment = json.loads((tmp_path / MANIFEST).read_text())['segments'][-1]
+    with (tmp_path / segment).open('a') as file:
+        file.write('{"seq": 3, "rec')
+
+    # The records appended after recovery are not lost behind the torn entry
+    history = SegmentedLogHistory(tmp_path)
+    for record in records[3:]:
+        history.append(record)
+    assert list(SegmentedLogHistory(tmp_path)) == records
@@ -2,11 +2,12 @@ import asyncio
 
 import pytest
 
-from quest import PersistentHistory, queue, state, event
-from quest.manager import WorkflowManager
+from quest import PersistentHistory, queue, state, event, alias
+from quest.manager import WorkflowManager, DuplicateWorkflowException
 from quest.persistence import InMemoryBlobStorage
 from quest.serializer import NoopSerializer
 from quest.utils import quest_logger
+from .utils import timeout
 
 
 @pytest.mark.asyncio
@@ -201,5 +202,221 @@ async def test_get_queue():
         await asyncio.sleep(0.1)
         assert await result.get() == 7
         await finish.set()
+        await asyncio.sleep(0.1)
+
+        # A finished workflow has no resources left
+        assert not await wm.has_resource('wid', 'messages', None)
+
+
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_hibernation():
+    starts = 0
+
+    async def workflow():
+        nonlocal starts
+        starts += 1
+        async with alias('the-alias'), queue('messages', None) as q, queue('private', 'ident') as p:
+            a = await q.get()
+            b = await q.get()
+            return a + b
+
+    storage = InMemoryBlobStorage()
+    histories = {}
+
+    def create_history(wid: str):
+        if wid not in histories:
+            histories[wid] = PersistentHistory(wid, InMemoryBlobStorage())
+        return histories[wid]
+
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer(), hibernate_after=0.05) as wm:
+        wm.start_workflow('workflow', 'wid', delete_on_finish=False)
+        await asyncio.sleep(0.2)
+
+        # The idle workflow was dropped from memory, but is still known
+        assert 'wid' not in wm._workflows
+        assert wm.has_workflow('wid')
+        assert wm.has_workflow('the-alias')
+        assert await wm.get_resources('wid', None) == {('messages', None): 'quest.external.Queue'}
+        assert ('private', 'ident') in await wm.get_resources('wid', 'ident')
+        assert starts == 1
 
+        # Sending an event wakes it up
+        q = await wm.get_queue('wid', 'messages', None)
+        await q.put(3)
+        assert 'wid' in wm._workflows
+        assert starts == 2
+
+        await asyncio.sleep(0.2)
+        assert 'wid' not in wm._workflows
+
+    # The hibernated workflow is not replayed when the manager starts again
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer(), hibernate_after=0.05) as wm:
+        assert 'wid' not in wm._workflows
+        assert wm.has_workflow('the-alias')
+
+        q = await wm.get_queue('the-alias', 'messages', None)
+        await q.put(4)
+        assert await wm.get_workflow_result('wid') == 7
+        assert starts == 3
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_bounded_rehydration():
+    started = []
+
+    async def workflow(i):
+        started.append(i)
+        async with queue('messages', None) as q:
+            return i + await q.get()
+
+    storage = InMemoryBlobStorage()
+    histories = {}
+
+    def create_history(wid: str):
+        if wid not in histories:
+            histories[wid] = PersistentHistory(wid, InMemoryBlobStorage())
+        return histories[wid]
+
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer()) as wm:
+        for i in range(6):
+            wm.start_workflow('workflow', f'w{i}', i, delete_on_finish=False)
+        await asyncio.sleep(0.1)
 
+    # The most recently active workflows are rehydrated first
+    data = storage.read_blob('test')
+    for i in range(6):
+        data[f'w{i}']['last_active'] = f'2024-01-01T00:00:0{i}'
+    storage.write_blob('test', data)
+    started.clear()
+
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer(), rehydrate_concurrency=2) as wm:
+        metrics = wm.get_rehydration_metrics()
+        assert metrics['total'] == 6
+        assert metrics['queued'] == 6
+
+        # A workflow that is needed skips the queue
+        assert wm.has_workflow('w0')
+        q = await wm.get_queue('w0', 'messages', None)
+        await q.put(10)
+        assert await wm.get_workflow_result('w0') == 10
+
+        await wm.wait_for_rehydration()
+        metrics = wm.get_rehydration_metrics()
+        assert metrics['done']
+        assert metrics['queued'] == 0
+        assert metrics['replayed'] == 5
+        assert metrics['started_on_demand'] == 1
+
+    assert started == [0, 5, 4, 3, 2, 1]
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_lazy_rehydration():
+    started = []
+
+    async def workflow(i):
+        started.append(i)
+        async with queue('messages', None) as q:
+            return i + await q.get()
+
+    storage = InMemoryBlobStorage()
+    histories = {}
+
+    def create_history(wid: str):
+        if wid not in histories:
+            histories[wid] = PersistentHistory(wid, InMemoryBlobStorage())
+        return histories[wid]
+
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer()) as wm:
+        for i in range(3):
+            wm.start_workflow('workflow', f'w{i}', i, delete_on_finish=False)
+        await asyncio.sleep(0.1)
+
+    started.clear()
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer(), lazy=True) as wm:
+        await wm.wait_for_rehydration()
+        await asyncio.sleep(0.1)
+        assert started == []
+        assert all(wm.has_workflow(f'w{i}') for i in range(3))
+
+        # Only the workflow that is needed is replayed
+        assert await wm.get_resources('w1', None) == {('messages', None): 'quest.external.Queue'}
+        assert started == [1]
+        assert wm.get_rehydration_metrics()['started_on_demand'] == 1
+
+        q = await wm.get_queue('w2', 'messages', None)
+        await q.put(5)
+        assert await wm.get_workflow_result('w2') == 7
+        assert started == [1, 2]
+
+    # The dormant workflow is still there
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer(), lazy=True) as wm:
+        q = await wm.get_queue('w0', 'messages', None)
+        await q.put(1)
+        assert await wm.get_workflow_result('w0') == 1
+
+
+@pytest.mark.asyncio
+@timeout(6)
+async def test_start_workflows():
+    class CountingStorage(InMemoryBlobStorage):
+        writes = 0
+
+        def write_blob(self, key, blob):
+            CountingStorage.writes += 1
+            super().write_blob(key, blob)
+
+    async def workflow(i, offset=0):
+        async with queue('messages', None) as q:
+            return i + offset + await q.get()
+
+    storage = CountingStorage()
+    histories = {}
+
+    def create_history(wid: str):
+        if wid not in histories:
+            histories[wid] = PersistentHistory(wid, InMemoryBlobStorage())
+        return histories[wid]
+
+    async with WorkflowManager('test', storage, create_history, lambda wid: workflow,
+                               serializer=NoopSerializer()) as wm:
+        wm.start_workflow('workflow', 'w0', 0)
+
+        # All the workflow data is persisted with one write
+        exceptions = await wm.start_workflows([
+            ('workflow', f'w{i}', [i], {'delete_on_finish': False, 'offset': 10}) for i in range(1, 5)
+        ])
+        assert exceptions == [None] * 4
+        assert CountingStorage.writes == 1
+        assert set(storage.read_blob('test')) == {'w0', 'w1', 'w2', 'w3', 'w4'}
+
+        # Nothing is started if a workflow already exists
+        with pytest.raises(DuplicateWorkflowException):
+            await wm.start_workflows([('workflow', 'w5', [5], {}), ('workflow', 'w0', [0], {})])
+        assert not wm.has_workflow('w5')
+
+        exceptions = await wm.start_workflows(
+            [('workflow', 'w5', [5], {}), ('workflow', 'w0', [0], {}), ('workflow', 'w5', [5], {})],
+            return_exceptions=True
+        )
+        assert exceptions[0] is None
+        assert isinstance(exceptions[1], DuplicateWorkflowException)
+        assert isinstance(exceptions[2], DuplicateWorkflowException)
+        assert wm.has_workflow('w5')
+
+        await asyncio.sleep(0.1)
+        q = await wm.get_queue('w3', 'messages', None)
+        await q.put(1)
+        assert await wm.get_workflow_result('w3') == 14
@@ -1,15 +1,20 @@
 import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import pytest
 
-from quest import step
-from quest.historian import Historian
+from quest import step, task
+from quest.historian import Historian, _prune
+from quest.history import record_headers
 from quest.serializer import NoopSerializer
-from quest.persistence import PersistentHistory, LocalFileSystemBlobStorage
-from .utils import timeout
+from quest.manager import WorkflowManager
+from quest.persistence import PersistentHistory, LocalFileSystemBlobStorage, InMemoryBlobStorage, \
+    AsyncPersistentHistory, ThreadPoolBlobStorage
+from .utils import CountingBlobStorage, make_record, timeout
 
 
 @step
@@ -208,3 +213,373 @@ async def test_workflow_cleanup_basic(tmp_path):
     await historian.run()
 
     assert not os.listdir(tmp_path)
+
+
+def test_history_loads_records_lazily():
+    storage = CountingBlobStorage()
+    history = PersistentHistory('test', storage)
+    records = [make_record(i) for i in range(20)]
+    for record in records:
+        history.append(record)
+
+    storage.reads = 0
+    history = PersistentHistory('test', storage, cache_size=4, chunk_size=5)
+    assert storage.reads == 1  # just the key index
+
+    view = history.snapshot()
+    assert len(view) == 20
+    assert view[7] == records[7]
+    assert storage.reads == 1 + 5  # one chunk
+
+    history.remove(records[12])
+    history.remove(records[5])
+    # Records removed after the snapshot are skipped if they were not loaded yet
+    assert view[12] is None
+    assert view[5] == records[5]
+    assert list(view) == records[:12] + records[13:]
+
+    remaining = records[:5] + records[6:12] + records[13:]
+    assert list(history) == remaining
+    assert list(reversed(history)) == remaining[::-1]
+
+
+def test_snapshot_ignores_later_records():
+    history = PersistentHistory('test', InMemoryBlobStorage())
+    history.append(first := make_record(0))
+    view = history.snapshot()
+
+    # Records appended (and removed) after the snapshot are not tracked by it
+    for i in range(1, 100):
+        history.append(record := make_record(i))
+        history.remove(record)
+    history.remove(first)
+    assert view._removed == {0}
+    assert list(view) == []
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_resume_with_small_chunks():
+    storage = InMemoryBlobStorage()
+    gate = asyncio.Event()
+
+    async def many_steps_workflow():
+        total = 0
+        for i in range(20):
+            total += await simple_step()
+        await gate.wait()
+        return total
+
+    historian = Historian('test', many_steps_workflow, PersistentHistory('test', storage), NoopSerializer())
+    historian.run()
+    await asyncio.sleep(0.01)
+    await historian.suspend()
+
+    gate.set()
+    history = PersistentHistory('test', storage, cache_size=2, chunk_size=3)
+    historian = Historian('test', many_steps_workflow, history, NoopSerializer())
+    assert await historian.run() == 140
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_resume_reads_each_record_once():
+    storage = CountingBlobStorage()
+    gate = asyncio.Event()
+
+    async def many_steps_workflow():
+        total = 0
+        for i in range(300):
+            total += await simple_step()
+        await gate.wait()
+        return total
+
+    historian = Historian('test', many_steps_workflow, PersistentHistory('test', storage), NoopSerializer())
+    historian.run()
+    await asyncio.sleep(0.2)
+    await historian.suspend()
+    records = len(PersistentHistory('test', storage))
+
+    storage.reads = 0
+    history = PersistentHistory('test', storage, cache_size=64, chunk_size=16)
+    historian = Historian('test', many_steps_workflow, history, NoopSerializer())
+    task = historian.run()
+    await asyncio.sleep(0.2)
+    # The key index, and then each record as the replay reaches it
+    assert storage.reads == 1 + records
+
+    gate.set()
+    assert await task == 2100
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_task_index_from_key_index():
+    storage = CountingBlobStorage()
+    gate = asyncio.Event()
+
+    @task
+    async def worker():
+        total = 0
+        for i in range(50):
+            total += await simple_step()
+            await asyncio.sleep(0)  # interleave the records of the tasks
+        await gate.wait()
+        return total
+
+    async def tasks_workflow():
+        return sum(await asyncio.gather(*(worker() for _ in range(4))))
+
+    historian = Historian('test', tasks_workflow, PersistentHistory('test', storage), NoopSerializer())
+    historian.run()
+    await asyncio.sleep(0.2)
+    await historian.suspend()
+    records = len(PersistentHistory('test', storage))
+
+    storage.reads = 0
+    history = PersistentHistory('test', storage, cache_size=16, chunk_size=8)
+    historian = Historian('test', tasks_workflow, history, NoopSerializer())
+    historian._reset_replay()
+    assert storage.reads == 1  # just the key index
+    assert len(historian._task_positions) == 1 + 4  # the workflow and its tasks
+    assert sum(len(positions) for positions in historian._task_positions.values()) == records
+
+    task_ = historian.run()
+    await asyncio.sleep(0.2)
+    assert storage.reads == 1 + records
+
+    gate.set()
+    assert await task_ == 4 * 350
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_step_index_does_not_hold_records():
+    storage = CountingBlobStorage()
+    gate = asyncio.Event()
+
+    @step
+    async def outer():
+        return sum([await simple_step() for _ in range(50)])
+
+    async def long_workflow():
+        total = await outer()
+        for i in range(50):
+            total += await simple_step()
+        await gate.wait()
+        return total
+
+    history = PersistentHistory('test', storage, cache_size=8, chunk_size=8)
+    historian = Historian('test', long_workflow, history, NoopSerializer())
+    task_ = historian.run()
+    await asyncio.sleep(0.2)
+
+    # The open workflow step indexes its records by sequence number, without keeping them
+    entries = [entry for step_entries in historian._step_records.values() for entry in step_entries.values()]
+    assert len(entries) == 1 + 1 + 50  # its start, and the end records of outer and of its own steps
+    assert all(isinstance(ref, int) for ref, _, _, _ in entries)
+    # The substeps of outer were loaded again to be pruned
+    assert [(record['type'], record['step_id']) for record in history if 'outer' in record['step_id']] == \
+           [('end', 'test.main.long_workflow.outer')]
+
+    gate.set()
+    assert await task_ == 700
+
+
+def test_index_without_headers():
+    # Key indexes written before they held the type and task of each record
+    storage = CountingBlobStorage()
+    history = PersistentHistory('test', storage)
+    records = [make_record(i) for i in range(3)]
+    for record in records:
+        history.append(record)
+    storage.write_blob('test', {'next_seq': 3, 'keys': [[seq, f'test.{seq}'] for seq in range(3)]})
+
+    history = PersistentHistory('test', storage)
+    assert record_headers(history.snapshot()) == [('start', 'main')] * 3
+    # The headers are learned from the records, and written with the next change of the index
+    assert history.snapshot().headers() == [('start', 'main')] * 3
+    history.append(make_record(3))
+    storage.reads = 0
+    assert PersistentHistory('test', storage).snapshot().headers() == [('start', 'main')] * 4
+    assert storage.reads == 1
+
+
+class SlowBlobStorage(InMemoryBlobStorage):
+    def __init__(self, delay: float):
+        super().__init__()
+        self._delay = delay
+
+    def write_blob(self, key, blob):
+        time.sleep(self._delay)
+        super().write_blob(key, blob)
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_async_history_writes_behind():
+    storage = InMemoryBlobStorage()
+    history = AsyncPersistentHistory('test', ThreadPoolBlobStorage(storage))
+    await history.load()
+
+    records = [make_record(i) for i in range(5)]
+    for record in records:
+        history.append(record)
+    history.remove(records[2])
+
+    await history.commit()
+    assert list(PersistentHistory('test', storage)) == records[:2] + records[3:]
+
+    history = AsyncPersistentHistory('test', ThreadPoolBlobStorage(storage))
+    await history.load()
+    assert list(history) == records[:2] + records[3:]
+
+    history.clear()
+    await history.commit()
+    assert not storage._data
+
+
+class FailOnceBlobStorage(InMemoryBlobStorage):
+    def __init__(self, failing_key):
+        super().__init__()
+        self._failing_key = failing_key
+
+    def write_blob(self, key, blob):
+        if key == self._failing_key:
+            self._failing_key = None
+            raise OSError('disk full')
+        super().write_blob(key, blob)
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_async_history_retries_failed_writes():
+    storage = FailOnceBlobStorage('test.1')
+    history = AsyncPersistentHistory('test', ThreadPoolBlobStorage(storage))
+    await history.load()
+
+    records = [make_record(i) for i in range(3)]
+    for record in records:
+        history.append(record)
+    with pytest.raises(OSError):
+        await history.commit()
+
+    # The index never lists a record that was not stored
+    assert not storage.has_blob('test') or 'test.1' in storage._data
+
+    # The failed write is kept and retried
+    await history.commit()
+    history = AsyncPersistentHistory('test', ThreadPoolBlobStorage(storage))
+    await history.load()
+    assert list(history) == records
+
+
+@pytest.mark.asyncio
+@timeout(3)
+async def test_slow_storage_does_not_block_other_workflows():
+    executor = ThreadPoolExecutor(4)
+    storages = {'slow': SlowBlobStorage(0.2), 'fast': InMemoryBlobStorage()}
+
+    def create_history(wid):
+        return AsyncPersistentHistory(wid, ThreadPoolBlobStorage(storages[wid], executor))
+
+    async def workflow():
+        for _ in range(3):
+            await simple_step()
+        return 'done'
+
+    manager_storage = ThreadPoolBlobStorage(InMemoryBlobStorage(), executor)
+    async with WorkflowManager('test', manager_storage, create_history, lambda wtype: workflow,
+                               serializer=NoopSerializer()) as manager:
+        start = time.monotonic()
+        manager.start_workflow('workflow', 'slow', delete_on_finish=False)
+        manager.start_workflow('workflow', 'fast', delete_on_finish=False)
+
+        assert await manager.get_workflow_result('fast') == 'done'
+        assert time.monotonic() - start < 0.1
+
+        assert await manager.get_workflow_result('slow') == 'done'
+
+
+def test_sequence_numbers():
+    storage = InMemoryBlobStorage()
+    history = PersistentHistory('test', storage)
+    records = [make_record(i) for i in range(4)]
+    for record in records:
+        history.append(record)
+    assert [record['seq'] for record in records] == [0, 1, 2, 3]
+
+    # Records that share a timestamp, step and type no longer collide
+    history.append(twin := make_record(3))
+    history.remove(records[3])
+    assert list(history) == records[:3] + [twin]
+
+    # Sequence numbers are never reused
+    history = PersistentHistory('test', storage)
+    history.remove(records[1])
+    history.append(record := make_record(5))
+    assert record['seq'] == 5
+    assert [r['seq'] for r in PersistentHistory('test', storage)] == [0, 2, 4, 5]
+
+
+def test_reads_index_of_hash_keyed_history():
+    # Histories written before records had sequence numbers
+    storage = InMemoryBlobStorage()
+    records = [make_record(i) for i in range(3)]
+    keys = [f'test.legacy{i}' for i in range(3)]
+    for key, record in zip(keys, records):
+        storage.write_blob(key, record)
+    storage.write_blob('test', keys)
+
+    history = PersistentHistory('test', storage)
+    loaded = list(history)
+    assert [r['step_id'] for r in loaded] == ['step_0', 'step_1', 'step_2']
+
+    history.remove(loaded[1])
+    history.append(make_record(3))
+    assert sorted(storage._data) == ['test', 'test.3', 'test.legacy0', 'test.legacy2']
+    assert [r['step_id'] for r in PersistentHistory('test', storage)] == ['step_0', 'step_2', 'step_3']
+
+
+class IndexCountingBlobStorage(InMemoryBlobStorage):
+    def __init__(self):
+        super().__init__()
+        self.index_writes = 0
+        self.deletes = 0
+
+    def write_blob(self, key, blob):
+        if '.' not in key:
+            self.index_writes += 1
+        super().write_blob(key, blob)
+
+    def delete_blobs(self, keys):
+        self.deletes += 1
+        super().delete_blobs(keys)
+
+
+def test_prune_rewrites_index_once():
+    storage = IndexCountingBlobStorage()
+    history = PersistentHistory('wid', storage)
+    entries = {}
+
+    def append(record):
+        history.append(record)
+        entries[record['seq']] = (record['seq'], record['type'], record['step_id'], None)
+
+    append({'type': 'start', 'timestamp': '', 'step_id': 'main.outer', 'task_id': 'main'})
+    for i in range(100):
+        append({'type': 'start', 'timestamp': '', 'step_id': f'main.outer.leaf_{i}', 'task_id': 'main'})
+        append({'type': 'end', 'timestamp': '', 'step_id': f'main.outer.leaf_{i}', 'task_id': 'main',
+                'result': i, 'exception': None})
+    append({'type': 'end', 'timestamp': '', 'step_id': 'main.outer', 'task_id': 'main',
+            'result': None, 'exception': None})
+
+    index_writes = storage.index_writes
+    assert len(_prune('main.outer', history, entries, history.get_record)) == 201
+
+    # One index write and one batch delete
+    assert storage.index_writes == index_writes + 1
+    assert storage.deletes == 1
+    assert [(record['type'], record['step_id']) for record in PersistentHistory('wid', storage)] == \
+           [('end', 'main.outer')]
+    assert len(storage._data) == 2  # the index and the end record
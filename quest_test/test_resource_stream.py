@@ -4,6 +4,7 @@ import pytest
 from quest import Historian
 from quest.external import state, queue, event, identity_queue, wrap_as_state, wrap_as_queue, wrap_as_identity_queue, \
     wrap_as_event
+from quest.resources import ResourceStreamManager, apply_delta
 from .utils import timeout, create_test_historian
 
 # A general-use workflow for these tests
@@ -390,3 +391,125 @@ async def test_suspend_resume_workflow():
         assert not resources
 
     await w_task
+
+
+async def gated_workflow(gate: asyncio.Event):
+    async with state('phrase1', None, 'Hello') as phrase1:
+        await phrase1.set('World!')
+        async with state('phrase2', 'private_identity', 'Goodbye') as phrase2:
+            await phrase2.set('Everyone!')
+            await gate.wait()
+
+
+# Test that streams which do not block never hold up the workflow.
+# The coalescing stream merges the deltas, the dropping stream gets a new snapshot instead.
+@pytest.mark.asyncio
+@timeout(3)
+async def test_non_blocking_streams():
+    gate = asyncio.Event()
+    historian = create_test_historian('non_blocking_streams', lambda: gated_workflow(gate))
+
+    with historian.get_resource_stream('private_identity', buffer_size=1, overflow='coalesce') as merged, \
+            historian.get_resource_stream('private_identity', buffer_size=1, overflow='drop') as dropped:
+        w_task = historian.run()
+        merged_deltas = merged.deltas()
+        dropped_deltas = dropped.deltas()
+        resources = (await anext(merged_deltas))['resources']
+        await anext(dropped_deltas)
+
+        # Nobody reads the streams while the workflow runs
+        await asyncio.sleep(0.1)
+        expected = await historian.get_resources('private_identity')
+        assert len(expected) == 2
+
+        delta = await anext(merged_deltas)
+        apply_delta(resources, delta)
+        assert resources == expected
+        assert merged.dropped > 0
+
+        snapshot = await anext(dropped_deltas)
+        assert snapshot['resources'] == expected
+        assert snapshot['seq'] == delta['seq']
+        assert dropped.dropped > 0
+
+        gate.set()
+        await w_task
+
+
+# Test that a subscriber can pick up where it left off
+@pytest.mark.asyncio
+@timeout(3)
+async def test_resync_stream():
+    gate = asyncio.Event()
+    historian = create_test_historian('resync_stream', lambda: gated_workflow(gate))
+    w_task = historian.run()
+
+    with historian.get_resource_stream(None) as resource_stream:
+        updates = resource_stream.deltas()
+        resources = (await anext(updates))['resources']
+        delta = await anext(updates)
+        apply_delta(resources, delta)
+    assert ('phrase1', None) in resources
+
+    # The private phrase2 is not visible to this stream, but the public phrase1 set is
+    await asyncio.sleep(0.1)
+    with historian.get_resource_stream(None) as resource_stream:
+        missed = await anext(resource_stream.deltas(since=(delta['epoch'], delta['seq'])))
+        assert 'resources' not in missed and missed['seq'] > delta['seq']
+        apply_delta(resources, missed)
+        assert resources == await historian.get_resources(None)
+
+    # Sequence numbers from another historian cannot be resumed from
+    with historian.get_resource_stream(None) as resource_stream:
+        snapshot = await anext(resource_stream.deltas(since=('other', delta['seq'])))
+        assert snapshot['resources'] == resources
+
+    gate.set()
+    await w_task
+
+
+# Test that a blocking stream with a buffer lets the workflow run that many updates ahead
+@pytest.mark.asyncio
+@timeout(3)
+async def test_buffered_blocking_stream():
+    historian = create_test_historian(
+        'buffered_blocking_stream',
+        lambda: simple_workflow(None, None)
+    )
+
+    with historian.get_resource_stream(None, buffer_size=2) as resource_stream:
+        w_task = historian.run()
+        await asyncio.sleep(0.1)
+
+        # phrase1 created and set, and the workflow waits to publish phrase2 created
+        assert resource_stream._pending() == 3
+        assert not w_task.done()
+
+        received = [resources async for resources in resource_stream]
+        assert len(received) == 7  # The initial snapshot and one update for each change
+        assert not received[-1]
+        await w_task
+
+
+@pytest.mark.asyncio
+async def test_invalid_stream_options():
+    historian = create_test_historian('invalid_stream_options', lambda: simple_workflow(None, None))
+    with pytest.raises(ValueError):
+        historian.get_resource_stream(None, overflow='ignore')
+    with pytest.raises(ValueError):
+        historian.get_resource_stream(None, buffer_size=0, overflow='coalesce')
+
+
+@pytest.mark.asyncio
+async def test_resync_does_not_change_logged_deltas():
+    manager = ResourceStreamManager()
+    with manager.get_resource_stream('b', lambda: asyncio.sleep(0, {}), 10, 'coalesce') as stream:
+        await manager.update(None, added={('shared', None): 'quest.external.State'})
+        await manager.update('b', added={('mine', 'b'): 'quest.external.State'})
+        logged = [delta['seq'] for delta in stream._channel.log]
+
+        missed = manager._changes_since((manager._epoch, 0), 'a')
+        assert missed['seq'] == 2
+        assert missed['added'] == {('shared', None): 'quest.external.State'}
+        assert [delta['seq'] for _, delta in manager._changes] == [1, 2]
+        assert [delta['seq'] for delta in stream._channel.log] == logged == [1, 2]
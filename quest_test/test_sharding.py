@@ -0,0 +1,111 @@
+import asyncio
+from collections import Counter
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+from quest import step, alias, queue, create_filesystem_manager
+from quest.manager import DuplicateWorkflowException, WorkflowNotFound
+from quest.sharding import ConsistentHashRing, ShardedWorkflowManager
+from .utils import timeout
+
+
+def test_hash_ring_spreads_and_keeps_keys():
+    keys = [f'wid{i}' for i in range(10000)]
+
+    ring = ConsistentHashRing(list(range(4)))
+    owners = {key: ring.get_node(key) for key in keys}
+    counts = Counter(owners.values())
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 1500
+
+    # Adding a node only moves keys to the new node
+    bigger = ConsistentHashRing(list(range(5)))
+    moved = [key for key in keys if bigger.get_node(key) != owners[key]]
+    assert all(bigger.get_node(key) == 4 for key in moved)
+    assert len(moved) < 3000
+
+
+@step
+async def double(value):
+    return 2 * value
+
+
+async def doubling_workflow(value):
+    return await double(value)
+
+
+# Called in each worker process, so it must be importable
+def create_test_manager(shard: int, save_folder: Path):
+    return create_filesystem_manager(save_folder, f'test-sharding-{shard}', lambda w_type: doubling_workflow)
+
+
+@pytest.mark.asyncio
+@timeout(30)
+async def test_sharded_manager(tmp_path):
+    async with ShardedWorkflowManager(partial(create_test_manager, save_folder=tmp_path), workers=2) as manager:
+        wids = [f'wid{i}' for i in range(20)]
+        assert {manager.get_shard(wid) for wid in wids} == {0, 1}
+
+        for i, wid in enumerate(wids):
+            await manager.start_workflow('workflow', wid, i, delete_on_finish=False)
+
+        results = await asyncio.gather(*(manager.get_workflow_result(wid) for wid in wids))
+        assert results == [2 * i for i in range(20)]
+
+        assert await manager.has_workflow('wid3')
+        assert not await manager.has_workflow('missing')
+
+        with pytest.raises(WorkflowNotFound):
+            await manager.get_workflow_result('missing')
+
+        # A bulk start goes to both shards, with the exceptions in the order of the workflows
+        bulk = [('workflow', f'bulk{i}', [i], {'delete_on_finish': False}) for i in range(10)]
+        exceptions = await manager.start_workflows(bulk + [('workflow', 'bulk3', [3], {})], return_exceptions=True)
+        assert exceptions[:10] == [None] * 10
+        assert isinstance(exceptions[10], DuplicateWorkflowException)
+        results = await asyncio.gather(*(manager.get_workflow_result(f'bulk{i}') for i in range(10)))
+        assert results == [2 * i for i in range(10)]
+
+    # Each shard saved the workflows it owns
+    for wid in wids:
+        shard = ConsistentHashRing([0, 1]).get_node(wid)
+        assert (tmp_path / f'test-sharding-{shard}').exists()
+
+
+async def aliased_workflow(name):
+    async with queue('messages', None) as messages:
+        async with alias(name):
+            return await messages.get()
+
+
+def create_alias_manager(shard: int, save_folder: Path):
+    return create_filesystem_manager(save_folder, f'test-aliases-{shard}', lambda w_type: aliased_workflow)
+
+
+@pytest.mark.asyncio
+@timeout(30)
+async def test_sharded_aliases(tmp_path):
+    ring = ConsistentHashRing([0, 1])
+    # Aliases that hash to another shard than their workflow
+    names = [(wid, name) for wid, name in ((f'wid{i}', f'name{i}') for i in range(50))
+             if ring.get_node(wid) != ring.get_node(name)][:4]
+    assert len(names) == 4
+
+    async with ShardedWorkflowManager(partial(create_alias_manager, save_folder=tmp_path), workers=2) as manager:
+        for wid, name in names:
+            await manager.start_workflow('workflow', wid, name, delete_on_finish=False)
+
+        # The workers report the aliases their workflows register
+        while len(manager._aliases) < len(names):
+            await asyncio.sleep(0.01)
+
+        for i, (wid, name) in enumerate(names):
+            assert await manager.has_workflow(name)
+            await manager.send_event(name, 'messages', None, 'put', i)
+        assert [await manager.get_workflow_result(wid) for wid, _ in names] == [0, 1, 2, 3]
+
+        # ...and the aliases the workflows drop
+        assert manager._aliases == {}
+        assert not await manager.has_workflow(names[0][1])
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from quest import Historian, PersistentHistory, sleep, sleep_until
+from quest.manager import WorkflowManager
+from quest.persistence import InMemoryBlobStorage
+from quest.serializer import NoopSerializer
+from .utils import timeout
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_sleep_keeps_deadline_across_suspend():
+    history = []
+
+    async def workflow():
+        await sleep(0.5)
+        await sleep_until(datetime.now(timezone.utc) - timedelta(seconds=1))  # Already past
+        return 'done'
+
+    start = time.monotonic()
+    historian = Historian('test', workflow, history, serializer=NoopSerializer())
+    historian.run()
+    await asyncio.sleep(0.3)
+    assert historian.get_next_timer() is not None
+
+    await historian.suspend()
+    assert await historian.run() == 'done'
+    # The resumed workflow waited for the recorded deadline, not another 0.5 seconds
+    assert time.monotonic() - start < 0.75
+
+
+@pytest.mark.asyncio
+@timeout(10)
+async def test_manager_wakes_sleeping_workflows():
+    storage = InMemoryBlobStorage()
+    histories = {}
+    woke = []
+
+    def create_history(wid: str):
+        if wid not in histories:
+            histories[wid] = PersistentHistory(wid, InMemoryBlobStorage())
+        return histories[wid]
+
+    async def workflow(delay):
+        await sleep(delay)
+        woke.append(time.monotonic())
+        return delay
+
+    def create_manager(**kwargs):
+        return WorkflowManager('test-timers', storage, create_history, lambda w_type: workflow,
+                               serializer=NoopSerializer(), **kwargs)
+
+    # A hibernated workflow is woken when its timer is due
+    async with create_manager(hibernate_after=0.1) as manager:
+        manager.start_workflow('workflow', 'wid1', 0.8, delete_on_finish=False)
+        await asyncio.sleep(0.5)
+        assert 'wid1' in manager._hibernated
+        assert 'wid1' in manager._timers
+
+        start = time.monotonic()
+        await asyncio.sleep(0.6)
+        assert len(woke) == 1 and woke[0] - start < 0.4
+        assert await manager.get_workflow_result('wid1') == 0.8
+
+        manager.start_workflow('workflow', 'wid2', 0.5, delete_on_finish=False)
+        await asyncio.sleep(0.1)
+
+    # Deadlines are persisted, so a lazy manager wakes the workflow without anyone asking for it
+    async with create_manager(lazy=True) as manager:
+        assert 'wid2' in manager._timers
+        await asyncio.sleep(0.6)
+        assert len(woke) == 2
+        assert 'wid2' in manager._results
+
+    assert not storage.has_blob('test-timers_timers')
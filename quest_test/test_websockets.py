@@ -1,11 +1,15 @@
 import asyncio
+import json
+
 import pytest
 from websockets import Headers
+from websockets.asyncio.client import connect as websockets_connect
 
 from quest import state, queue
 from quest.client import Client
+from quest.codec import available_codecs
 from quest.server import Server
-from quest_test.utils import create_in_memory_workflow_manager
+from quest_test.utils import create_in_memory_workflow_manager, timeout
 
 
 def authorize(headers: Headers) -> bool:
@@ -69,3 +73,154 @@ async def test_websockets_exception():
     await asyncio.gather(serve(manager, 8000, lambda h: True), connect_exception('fail'))
     await asyncio.sleep(0.1)
     await manager.delete_workflow(wid)
+
+
+async def resync_workflow():
+    async with queue('messages', None) as messages:
+        async with state('phrase', None, '') as phrase:
+            await phrase.set(await messages.get())
+            await messages.get()
+
+
+@pytest.mark.asyncio
+async def test_websockets_resync():
+    wid = 'test_resync'
+    manager = create_in_memory_workflow_manager({'workflow': resync_workflow})
+    manager.start_workflow('workflow', wid)
+    async with Server(manager, 'localhost', 8000, lambda h: True):
+        async with Client('ws://localhost:8000') as client:
+            resources = {}
+            async for message in client.stream_resource_deltas(wid, None):
+                last = message
+                if 'resources' in message:
+                    resources = message['resources']
+                else:
+                    resources.update(message['added'])
+                if ('phrase', None) in resources:
+                    break  # i.e. the connection is lost
+
+            await client.send_event(wid, 'messages', None, 'put', 'Hello')
+            await asyncio.sleep(0.1)
+
+            # Only the changes since the last message are sent
+            updates = client.stream_resource_deltas(wid, None, since=(last['epoch'], last['seq']))
+            message = await anext(updates)
+            assert 'resources' not in message
+            assert message['seq'] > last['seq']
+            await updates.aclose()
+
+            await client.send_event(wid, 'messages', None, 'put', 'Bye')
+            assert await manager.get_workflow_result(wid) is None
+
+
+async def echo_workflow():
+    async with queue('messages', None) as messages:
+        return await messages.get()
+
+
+@pytest.mark.asyncio
+async def test_websockets_pipelined_calls():
+    wid = 'test_pipelined'
+    manager = create_in_memory_workflow_manager({'workflow': echo_workflow})
+    manager.start_workflow('workflow', wid, delete_on_finish=False)
+    async with Server(manager, 'localhost', 8000, lambda h: True, max_concurrent_calls=8):
+        async with Client('ws://localhost:8000') as client:
+            # The result call waits for the event sent after it on the same connection
+            result = asyncio.create_task(client.get_workflow_result(wid))
+            await asyncio.sleep(0.1)
+            assert not result.done()
+
+            found = await asyncio.gather(*(client.has_workflow(w) for w in [wid, 'missing'] * 20))
+            assert found == [True, False] * 20
+
+            await client.send_event(wid, 'messages', None, 'put', 'Hello')
+            assert await result == 'Hello'
+
+            with pytest.raises(KeyError):
+                await client.send_event('missing', 'messages', None, 'put', 'Hello')
+
+
+@pytest.mark.asyncio
+async def test_websockets_batch():
+    manager = create_in_memory_workflow_manager({'workflow': echo_workflow})
+    async with Server(manager, 'localhost', 8000, lambda h: True, max_concurrent_calls=4):
+        async with Client('ws://localhost:8000') as client:
+            async with client.batch() as batch:
+                started = [batch.start_workflow('workflow', f'w{i}', delete_on_finish=False) for i in range(10)]
+                # The other calls find the workflows started in the same batch
+                found = batch.call('has_workflow', 'w9')
+                duplicate = batch.start_workflow('workflow', 'w0')
+
+            assert [await future for future in started] == [None] * 10
+            assert await found
+            with pytest.raises(Exception, match='already exists'):
+                await duplicate
+
+            await asyncio.sleep(0.1)
+            async with client.batch() as batch:
+                sent = [batch.send_event(f'w{i}', 'messages', None, 'put', i) for i in range(10)]
+                missing = batch.send_event('missing', 'messages', None, 'put', 0)
+
+            assert [await future for future in sent] == [None] * 10
+            with pytest.raises(KeyError):
+                await missing
+
+            results = [await client.get_workflow_result(f'w{i}') for i in range(10)]
+            assert results == list(range(10))
+
+            # Results come back in the order of the calls
+            batch = client.batch()
+            for i in range(10):
+                batch.call('has_workflow', f'w{i}' if i % 2 else 'missing')
+            assert await batch.send() == [bool(i % 2) for i in range(10)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('codecs', [['msgpack', 'json'], ['cbor', 'json'], ['json']])
+async def test_websockets_codecs(codecs):
+    if codecs[0] not in available_codecs():
+        pytest.skip(f'{codecs[0]} not installed')
+
+    wid = 'test_codecs'
+    manager = create_in_memory_workflow_manager({'workflow': echo_workflow})
+    manager.start_workflow('workflow', wid, delete_on_finish=False)
+    async with Server(manager, 'localhost', 8000, lambda h: True, compression=None):
+        async with Client('ws://localhost:8000', codecs=codecs, compression=None) as client:
+            async for stream_resources in client.stream_resources(wid, None):
+                if ('messages', None) in stream_resources:
+                    break
+            assert await client.has_workflow(wid)
+            assert client._call_codec.name == codecs[0]
+
+            # Resources (keyed by tuples) are sent in the codec's format for resources
+            resources = await client.get_resources(wid, None)
+            assert resources == stream_resources
+            async with client.batch() as batch:
+                batched = batch.call('get_resources', wid, None)
+            assert await batched == stream_resources
+
+            await client.send_event(wid, 'messages', None, 'put', {'numbers': [1, 2], 'text': 'Hello'})
+            assert await client.get_workflow_result(wid) == {'numbers': [1, 2], 'text': 'Hello'}
+
+        # A client that offers no codec gets JSON
+        async with websockets_connect('ws://localhost:8000/call') as ws:
+            assert ws.subprotocol is None
+            await ws.send(json.dumps({'method': 'has_workflow', 'args': [wid], 'kwargs': {}}))
+            assert json.loads(await ws.recv()) == {'result': True}
+
+
+async def set_workflow():
+    return {1, 2}
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_websockets_unencodable_result():
+    manager = create_in_memory_workflow_manager({'workflow': set_workflow})
+    manager.start_workflow('workflow', 'wid', delete_on_finish=False)
+    async with Server(manager, 'localhost', 8000, lambda h: True):
+        async with Client('ws://localhost:8000') as client:
+            # The caller gets the error instead of waiting forever
+            with pytest.raises(TypeError):
+                await client.get_workflow_result('wid')
+            assert await client.has_workflow('wid')
@@ -1,11 +1,15 @@
 import asyncio
+import os
+import threading
+import time
 
 import pytest
 
 from quest import Historian
 from quest.external import event, wrap_as_event
-from quest.wrappers import wrap_steps
+from quest.wrappers import wrap_steps, step
 from quest.serializer import NoopSerializer
+from .test_serializer import Stuff, serializer as stuff_serializer
 from .utils import timeout
 
 
@@ -65,3 +69,84 @@ async def test_wrap_steps():
     await wtask  # good hygiene
 
     assert calls == ['foo', 'bar', 'foo', 'bar']
+
+
+@step(executor='thread')
+def blocking_step(delay):
+    time.sleep(delay)
+    return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_thread_step():
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    calls = []
+    pause = asyncio.Event()
+
+    async def workflow():
+        calls.append(name := await blocking_step(0.3))
+        await pause.wait()
+        return name
+
+    history = []
+    ticking = asyncio.create_task(ticker())
+    historian = Historian('test', workflow, history, serializer=NoopSerializer())
+    historian.run()
+    await asyncio.sleep(0.5)
+    ticking.cancel()
+
+    assert calls[0].startswith('quest-step')
+    assert ticks > 10  # The event loop kept running during the step
+    assert history[-1]['result'] == calls[0]
+
+    # The recorded result is replayed (on the loop) without running the step again
+    await historian.suspend()
+    pause.set()
+    assert await historian.run() == calls[0]
+    assert calls == [calls[0], calls[0]]
+
+
+@step(executor='process')
+def repeat_stuff(stuff: Stuff, times: int) -> Stuff:
+    return Stuff(stuff.name * times, os.getpid())
+
+
+@pytest.mark.asyncio
+@timeout(30)
+async def test_process_step():
+    pause = asyncio.Event()
+
+    async def workflow():
+        stuff = await repeat_stuff(Stuff('ab', 1), times=2)
+        await pause.wait()
+        return stuff
+
+    history = []
+    historian = Historian('test', workflow, history, serializer=stuff_serializer)
+    task = historian.run()
+    while not history or history[-1]['type'] != 'end':
+        await asyncio.sleep(0.05)
+
+    # Crossing the process boundary and the history use the same serialized form
+    name, pid = history[-1]['result']['args']
+    assert history[-1]['result']['_ms_type'] == str(Stuff)
+    assert name == 'abab' and pid != os.getpid()
+
+    pause.set()
+    assert await task == Stuff('abab', pid)
+
+
+def test_step_executor_checks():
+    with pytest.raises(ValueError):
+        step(executor='gpu')(lambda: None)
+
+    with pytest.raises(ValueError):
+        step(lambda: None)  # Sync steps need an executor
@@ -23,6 +23,32 @@ def timeout(delay):
     return decorator
 
 
+class CountingBlobStorage(InMemoryBlobStorage):
+    """Counts the reads and writes of the blobs"""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+        self.writes = 0
+
+    def read_blob(self, key):
+        self.reads += 1
+        return super().read_blob(key)
+
+    def write_blob(self, key, blob):
+        self.writes += 1
+        super().write_blob(key, blob)
+
+
+def make_record(i: int):
+    return {
+        'type': 'start',
+        'timestamp': f'2024-01-01T00:00:{i:06d}',
+        'step_id': f'step_{i}',
+        'task_id': 'main'
+    }
+
+
 def create_in_memory_workflow_manager(workflows: dict, serializer=None):
     storage = InMemoryBlobStorage()
     histories = {}
@@ -3,12 +3,18 @@ from typing import Callable
 
 from .context import these
 from .external import state, queue, identity_queue, event
-from .historian import Historian, suspendable
+from .group_commit import GroupCommitter
+from .historian import Historian, suspendable, continue_as_new
 from .history import History
+from .leases import LeaseStore, SqliteLeaseStore
+from .log_history import SegmentedLogHistory, migrate_persistent_history
 from .manager import WorkflowManager, WorkflowFactory
 from .manager_wrappers import alias
-from .persistence import LocalFileSystemBlobStorage, PersistentHistory, BlobStorage, Blob
+from .persistence import LocalFileSystemBlobStorage, PersistentHistory, BlobStorage, Blob, \
+    AsyncBlobStorage, AsyncPersistentHistory, ThreadPoolBlobStorage
 from .serializer import StepSerializer, MasterSerializer, NoopSerializer
+from .timers import sleep, sleep_until
+from .sharding import ShardedWorkflowManager
 from .utils import ainput
 from .versioning import version, get_version
 from .wrappers import step, task, wrap_steps
@@ -31,11 +37,14 @@ def create_filesystem_manager(
         save_folder: Path,
         namespace: str,
         factory: WorkflowFactory,
-        serializer: StepSerializer = NoopSerializer()
+        serializer: StepSerializer = NoopSerializer(),
+        committer: GroupCommitter = None,
+        hibernate_after: float = None
 ) -> WorkflowManager:
     def create_history(wid: str) -> History:
-        return PersistentHistory(wid, LocalFileSystemBlobStorage(save_folder / namespace / wid))
+        return PersistentHistory(wid, LocalFileSystemBlobStorage(save_folder / namespace / wid), committer=committer)
 
     workflow_manager_storage = LocalFileSystemBlobStorage(save_folder / namespace)
 
-    return WorkflowManager(namespace, workflow_manager_storage, create_history, factory, serializer=serializer)
+    return WorkflowManager(namespace, workflow_manager_storage, create_history, factory, serializer=serializer,
+                           hibernate_after=hibernate_after)
@@ -1,57 +1,154 @@
 import asyncio
 import functools
-import json
 from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
 
-from quest.utils import deserialize_exception
+from quest.codec import Codec, JSON_CODEC, decode_resource_key, from_subprotocol, get_codec, to_subprotocol
+from quest.resources import apply_delta
+from quest.utils import deserialize_exception, quest_logger
 
 
-def deserialize_response(response):
-    data = json.loads(response)
+def deserialize_response(response, codec: Codec = JSON_CODEC):
+    data = codec.decode(response)
     if 'exception' in data:
         exception = deserialize_exception(data['exception'])
         raise exception
     if 'result' in data:
         return data['result']
     if 'resources' in data:
-        return deserialize_resources(data['resources'])
+        return codec.decode_resources(data['resources'])
+
+
+def deserialize_resource_key(key: str) -> tuple[str, str | None]:
+    return decode_resource_key(key)
 
 
 # TODO: Wrap resources on this end to send_event
-def deserialize_resources(raw_data):
-    resources = {}
-    for key, value in raw_data.items():
-        key0, key1 = key.split('||')
-        if key1 == '':
-            key1 = None
-        tuple_key = (key0, key1)
-        resources[tuple_key] = value
-    return resources
+def deserialize_resources(raw_data, codec: Codec = JSON_CODEC):
+    return codec.decode_resources(raw_data)
+
+
+def deserialize_resource_message(response, codec: Codec = JSON_CODEC):
+    """A snapshot or delta sent by the /stream endpoint (see ResourceStream.deltas)"""
+    data = codec.decode(response)
+    if 'exception' in data:
+        raise deserialize_exception(data['exception'])
+    if 'resources' in data:
+        return {'epoch': data['epoch'], 'seq': data['seq'], 'resources': codec.decode_resources(data['resources'])}
+    return {
+        'epoch': data['epoch'],
+        'seq': data['seq'],
+        'added': codec.decode_resources(data['added']),
+        'removed': codec.decode_resource_keys(data['removed'])
+    }
+
+
+def deserialize_call_result(data: dict, codec: Codec = JSON_CODEC):
+    """The result of one call answered on the /call endpoint (resources are sent in the codec's format)"""
+    if 'exception' in data:
+        raise deserialize_exception(data['exception'])
+    if 'resources' in data:
+        return codec.decode_resources(data['resources'])
+    return data.get('result')
 
 
 def forward(func):
     @functools.wraps(func)
     async def new_func(self, *args, **kwargs):
-        if not self._call_ws:
-            ws = connect(self._url + '/call', additional_headers=self._headers)
-            self._call_ws = await ws.__aenter__()
-        call = {
-            'method': func.__name__,
-            'args': args,
-            'kwargs': kwargs
-        }
-        await self._call_ws.send(json.dumps(call))
-        response = await self._call_ws.recv()
-        return deserialize_response(response)
+        return await self._call(func.__name__, args, kwargs)
 
     return new_func
 
 
+class Batch:
+    """
+    Calls that are sent together when the `async with` block exits (or with `send`).
+    The server runs them concurrently, except that start_workflow calls are made first (see Server._call_batch).
+    """
+
+    def __init__(self, client: 'Client'):
+        self._client = client
+        self._calls: list[dict] = []
+        self._futures: list[asyncio.Future] = []
+
+    async def __aenter__(self) -> 'Batch':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.send()
+        else:
+            self._cancel()
+
+    def call(self, method: str, *args, **kwargs) -> asyncio.Future:
+        self._calls.append({'method': method, 'args': args, 'kwargs': kwargs})
+        self._futures.append(future := asyncio.get_running_loop().create_future())
+        return future
+
+    def start_workflow(self, workflow_type: str, workflow_id: str, *workflow_args, **workflow_kwargs):
+        return self.call('start_workflow', workflow_type, workflow_id, *workflow_args, **workflow_kwargs)
+
+    def send_event(self, workflow_id: str, name: str, identity, action, *args, **kwargs):
+        return self.call('send_event', workflow_id, name, identity, action, *args, **kwargs)
+
+    async def send(self) -> list:
+        """Send the calls collected so far; return their results, with exceptions in place of failed calls"""
+        calls, futures = self._calls, self._futures
+        self._calls, self._futures = [], []
+        if not calls:
+            return []
+
+        try:
+            responses = await self._client._request({'batch': calls})
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as ex:
+            for future in futures:
+                future.set_exception(ex)
+            raise
+
+        results = []
+        for future, response in zip(futures, responses):
+            try:
+                result = deserialize_call_result(response, self._client._call_codec)
+                future.set_result(result)
+            except Exception as ex:
+                result = ex
+                future.set_exception(ex)
+            results.append(result)
+        return results
+
+    def _cancel(self):
+        for future in self._futures:
+            future.cancel()
+        self._calls, self._futures = [], []
+
+
 class Client:
-    def __init__(self, url, headers: dict[str, str] = None):
+    def __init__(self, url, headers: dict[str, str] = None, codecs: list[str] = None,
+                 compression: str | None = 'deflate'):
+        """
+        :param url: The ws:// URL of the Server.
+        :param headers: Sent with each connection, e.g. for the server's authorizer.
+        :param codecs: The wire codecs to offer the server, in order of preference (see codec.py),
+            e.g. ['msgpack', 'json'] to use msgpack with servers that have it; only JSON by default.
+        :param compression: 'deflate' to compress messages when the server supports it, or None.
+        """
         self._call_ws = None
+        self._call_codec: Codec = JSON_CODEC
         self._url = url
         self._headers = headers
+        self._subprotocols = [to_subprotocol(get_codec(name).name) for name in (codecs or ['json'])]
+        self._compression = compression
+
+        # Calls share one /call connection: each carries an id,
+        #  and _receive_responses hands each response to the future of its call
+        self._connecting = asyncio.Lock()
+        self._receiver: asyncio.Task | None = None
+        self._next_call_id = 0
+        self._pending_calls: dict[int, asyncio.Future] = {}
 
     async def __aenter__(self):
         return self
@@ -59,6 +156,83 @@ class Client:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self._call_ws:
             await self._call_ws.__aexit__(exc_type, exc_val, exc_tb)
+        if self._receiver is not None:
+            await self._receiver
+
+    async def _connect(self):
+        async with self._connecting:
+            if not self._call_ws:
+                ws = self._open('/call')
+                self._call_ws = await ws.__aenter__()
+                self._call_codec = from_subprotocol(self._call_ws.subprotocol)
+                self._receiver = asyncio.create_task(self._receive_responses(self._call_ws, self._call_codec))
+
+    def _open(self, path: str):
+        return connect(self._url + path, additional_headers=self._headers,
+                       subprotocols=self._subprotocols, compression=self._compression)
+
+    async def _receive_responses(self, ws, codec: Codec):
+        try:
+            async for response in ws:
+                try:
+                    data = codec.decode(response)
+                except Exception:
+                    # A response that cannot be read cannot be matched to its call:
+                    #  the connection is closed, which fails the calls still waiting
+                    quest_logger.exception('Could not decode a response on the /call connection')
+                    await ws.close(1002, 'Could not decode a response')
+                    break
+                if (future := self._pending_calls.pop(data.get('id'), None)) is None or future.done():
+                    continue
+                if 'results' in data:
+                    future.set_result(data['results'])
+                    continue
+                try:
+                    future.set_result(deserialize_call_result(data, codec))
+                except Exception as ex:
+                    future.set_exception(ex)
+        except ConnectionClosed:
+            pass
+        finally:
+            # Calls still waiting will not get a response
+            for future in self._pending_calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('The /call connection was closed'))
+            self._pending_calls.clear()
+            if self._call_ws is ws:
+                self._call_ws = None
+
+    async def _call(self, method: str, args, kwargs):
+        return await self._request({
+            'method': method,
+            'args': args,
+            'kwargs': kwargs
+        })
+
+    async def _request(self, message: dict):
+        if not self._call_ws:
+            await self._connect()
+
+        call_id = self._next_call_id
+        self._next_call_id += 1
+        future = self._pending_calls[call_id] = asyncio.get_running_loop().create_future()
+        try:
+            await self._call_ws.send(self._call_codec.encode({'id': call_id, **message}))
+            return await future
+        finally:
+            self._pending_calls.pop(call_id, None)
+
+    def batch(self) -> 'Batch':
+        """
+        Collect calls to send them to the server in one message, e.g.
+
+            async with client.batch() as batch:
+                for wid in wids:
+                    batch.start_workflow('workflow', wid)
+
+        Each call returns a future with its result.
+        """
+        return Batch(self)
 
     @forward
     async def start_workflow(self, workflow_type: str, workflow_id: str, *workflow_args, **workflow_kwargs):
@@ -84,16 +258,37 @@ class Client:
     async def get_resources(self, workflow_id: str, identity):
         ...
 
+    @forward
+    async def get_workflow_result(self, workflow_id: str, delete: bool = False):
+        ...
+
     async def stream_resources(self, workflow_id: str, identity: str | None):
-        async with connect(self._url + '/stream', additional_headers=self._headers) as ws:
+        """Yield the resources of the workflow every time they change"""
+        resources = {}
+        async for message in self.stream_resource_deltas(workflow_id, identity):
+            if 'resources' in message:
+                resources = message['resources']
+            else:
+                apply_delta(resources, message)
+            yield dict(resources)
+
+    async def stream_resource_deltas(self, workflow_id: str, identity: str | None,
+                                     since: tuple[str, int] | None = None):
+        """
+        Yield a snapshot of the resources and then the delta of each change.
+        To resync after a lost connection, pass the epoch and seq of the last message as `since`:
+         the stream starts with the deltas that were missed, or a new snapshot if the server no longer has them.
+        """
+        async with self._open('/stream') as ws:
+            codec = from_subprotocol(ws.subprotocol)
             first_message = {
                 'wid': workflow_id,
                 'identity': identity,
+                'since': since,
             }
-            await ws.send(json.dumps(first_message))
+            await ws.send(codec.encode(first_message))
             async for message in ws:
-                response = deserialize_response(message)
-                yield response
+                yield deserialize_resource_message(message, codec)
 
     @forward
     async def send_event(self, workflow_id: str, name: str, identity, action, *args, **kwargs):
@@ -0,0 +1,168 @@
+# Wire codecs for the websocket Server and Client
+#
+# A codec turns the messages of the /call and /stream endpoints into websocket frames and back.
+# The client offers the codecs it wants to use as websocket subprotocols ('quest.msgpack', 'quest.json', ...),
+#  and the server picks the first of its own codecs that the client offers.
+#  A client that offers none gets JSON, as before codecs were negotiated.
+# JSON is always available (and is what the Client offers by default);
+#  msgpack and CBOR need the 'msgpack' and 'cbor2' packages.
+#
+# Resource keys are (name, identity) tuples, which none of the formats has as map keys.
+#  JSON sends them as 'name||identity' strings (an identity of None is an empty string),
+#  and the binary codecs send resources as [name, identity, type] triples.
+#
+# Compression is not part of the codec: it is the websocket permessage-deflate extension,
+#  negotiated in the same handshake (see the `compression` parameter of Server and Client).
+import json
+from typing import Any, Protocol
+
+from .quest_types import ResourceKey
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+SUBPROTOCOL_PREFIX = 'quest.'
+
+
+class Codec(Protocol):
+    name: str
+
+    def encode(self, message: Any) -> str | bytes:
+        ...
+
+    def decode(self, frame: str | bytes) -> Any:
+        ...
+
+    def encode_resources(self, resources: dict[ResourceKey, str]) -> Any:
+        ...
+
+    def decode_resources(self, data: Any) -> dict[ResourceKey, str]:
+        ...
+
+    def encode_resource_keys(self, keys: list[ResourceKey]) -> Any:
+        ...
+
+    def decode_resource_keys(self, data: Any) -> list[ResourceKey]:
+        ...
+
+
+def encode_resource_key(key: ResourceKey) -> str:
+    assert isinstance(key, tuple)
+    return '||'.join(k if k is not None else '' for k in key)
+
+
+def decode_resource_key(key: str) -> ResourceKey:
+    key0, key1 = key.split('||')
+    if key1 == '':
+        key1 = None
+    return key0, key1
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def encode(self, message: Any) -> str:
+        return json.dumps(message)
+
+    def decode(self, frame: str | bytes) -> Any:
+        return json.loads(frame)
+
+    def encode_resources(self, resources: dict[ResourceKey, str]) -> dict[str, str]:
+        return {encode_resource_key(key): value for key, value in resources.items()}
+
+    def decode_resources(self, data: dict[str, str]) -> dict[ResourceKey, str]:
+        return {decode_resource_key(key): value for key, value in data.items()}
+
+    def encode_resource_keys(self, keys: list[ResourceKey]) -> list[str]:
+        return [encode_resource_key(key) for key in keys]
+
+    def decode_resource_keys(self, data: list[str]) -> list[ResourceKey]:
+        return [decode_resource_key(key) for key in data]
+
+
+class _BinaryCodec(Codec):
+    def encode_resources(self, resources: dict[ResourceKey, str]) -> list:
+        return [[name, identity, value] for (name, identity), value in resources.items()]
+
+    def decode_resources(self, data: list) -> dict[ResourceKey, str]:
+        return {(name, identity): value for name, identity, value in data}
+
+    def encode_resource_keys(self, keys: list[ResourceKey]) -> list:
+        return keys  # Tuples are sent as arrays
+
+    def decode_resource_keys(self, data: list) -> list[ResourceKey]:
+        return [(name, identity) for name, identity in data]
+
+
+class MsgpackCodec(_BinaryCodec):
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("The 'msgpack' package is required to use the msgpack codec. Run 'pip install msgpack'.")
+
+    def encode(self, message: Any) -> bytes:
+        return msgpack.packb(message)
+
+    def decode(self, frame: str | bytes) -> Any:
+        # Results may be dicts with keys that are not strings
+        return msgpack.unpackb(frame, strict_map_key=False)
+
+
+class CborCodec(_BinaryCodec):
+    name = 'cbor'
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ImportError("The 'cbor2' package is required to use the cbor codec. Run 'pip install cbor2'.")
+
+    def encode(self, message: Any) -> bytes:
+        return cbor2.dumps(message)
+
+    def decode(self, frame: str | bytes) -> Any:
+        return cbor2.loads(frame)
+
+
+JSON_CODEC = JsonCodec()
+
+_CODEC_TYPES: dict[str, type] = {
+    'msgpack': MsgpackCodec,
+    'cbor': CborCodec,
+    'json': JsonCodec,
+}
+_codecs: dict[str, Codec] = {'json': JSON_CODEC}
+
+
+def get_codec(name: str) -> Codec:
+    """The codec named `name`; raises ImportError if its package is not installed"""
+    if name not in _codecs:
+        if name not in _CODEC_TYPES:
+            raise ValueError(f'Unknown codec: {name}')
+        _codecs[name] = _CODEC_TYPES[name]()
+    return _codecs[name]
+
+
+def available_codecs() -> list[str]:
+    """The codecs whose packages are installed, binary codecs first"""
+    return [
+        name for name, installed in [('msgpack', msgpack is not None), ('cbor', cbor2 is not None), ('json', True)]
+        if installed
+    ]
+
+
+def to_subprotocol(name: str) -> str:
+    return SUBPROTOCOL_PREFIX + name
+
+
+def from_subprotocol(subprotocol: str | None) -> Codec:
+    """The codec of a negotiated subprotocol (JSON if there was none)"""
+    if subprotocol is None:
+        return JSON_CODEC
+    return get_codec(subprotocol.removeprefix(SUBPROTOCOL_PREFIX))
@@ -0,0 +1,92 @@
+# Running step bodies off the event loop
+#
+# A step declared with @step(executor=...) runs its body in a thread or process
+# pool, while the historian records its start and end on the event loop as usual.
+#
+#   executor='thread'   a shared ThreadPoolExecutor (good for blocking I/O, or
+#                       work that releases the GIL like hashing or compression)
+#   executor='process'  a shared ProcessPoolExecutor (good for CPU-bound Python)
+#   executor=<Executor> any concurrent.futures.Executor
+#
+# The body may be sync or async; an async body gets its own event loop in the worker.
+# It runs outside the workflow, so it cannot call other steps or workflow resources.
+#
+# Arguments and results cross the process boundary in the form produced by the
+# workflow's StepSerializer (the same form they have in the history), so anything
+# the serializer handles can be passed to a process step. The function itself is
+# sent by its module and qualified name, so it must be defined at module level.
+import asyncio
+import importlib
+import inspect
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Callable
+
+from .serializer import StepSerializer
+
+EXECUTORS = ('thread', 'process')
+
+_shared_executors: dict[str, Executor] = {}
+
+
+def get_executor(executor: str | Executor) -> Executor:
+    if isinstance(executor, Executor):
+        return executor
+    if executor not in EXECUTORS:
+        raise ValueError(f'Unknown step executor: {executor}')
+    if executor not in _shared_executors:
+        if executor == 'thread':
+            _shared_executors[executor] = ThreadPoolExecutor(thread_name_prefix='quest-step')
+        else:
+            _shared_executors[executor] = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+    return _shared_executors[executor]
+
+
+def shutdown_executors():
+    """Shut down the shared 'thread' and 'process' pools (they are created again when needed)"""
+    for executor in _shared_executors.values():
+        executor.shutdown()
+    _shared_executors.clear()
+
+
+def _call(func: Callable, args, kwargs):
+    result = func(*args, **kwargs)
+    if inspect.isawaitable(result):
+        result = asyncio.run(result)
+    return result
+
+
+def _find_function(module_name: str, qualname: str) -> Callable:
+    func = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        func = getattr(func, name)
+    # The module-level name refers to the @step wrapper
+    return inspect.unwrap(func)
+
+
+def _call_in_process(module_name: str, qualname: str, serializer: StepSerializer, args, kwargs):
+    async def call():
+        func = _find_function(module_name, qualname)
+        result = func(*await serializer.deserialize(args), **await serializer.deserialize(kwargs))
+        if inspect.isawaitable(result):
+            result = await result
+        return await serializer.serialize(result)
+
+    return asyncio.run(call())
+
+
+async def run_in_executor(executor: str | Executor, func: Callable, serializer: StepSerializer, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    pool = get_executor(executor)
+
+    if not isinstance(pool, ProcessPoolExecutor):
+        return await loop.run_in_executor(pool, partial(_call, func, args, kwargs))
+
+    if '<locals>' in func.__qualname__:
+        raise ValueError(f'Process steps must be defined at module level: {func.__qualname__}')
+    result = await loop.run_in_executor(pool, partial(
+        _call_in_process, func.__module__, func.__qualname__, serializer,
+        await serializer.serialize(list(args)), await serializer.serialize(kwargs)
+    ))
+    return await serializer.deserialize(result)
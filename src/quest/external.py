@@ -12,6 +12,11 @@ from .historian import Historian, find_historian, SUSPENDED, wrap_methods_as_his
 
 
 class Queue:
+    # Once a get has consumed an item from an external put, the historian
+    #  drops the put and the start of the get (see Historian._compact_queue_get).
+    # The end of the get stays, so service loops pair this with continue_as_new.
+    compact_consumed = True
+
     def __init__(self):
         self._queue = asyncio.Queue()
 
@@ -169,7 +174,8 @@ class MultiQueue:
             # Wait until any of the current task is done
             done, _ = await asyncio.wait(self.task_to_ident.keys(), return_when=asyncio.FIRST_COMPLETED)
 
-            for task in done:
+            # In the order the queues were listened to, not the (address-based) order of the set
+            for task in [task for task in self.task_to_ident if task in done]:
                 ident = self.task_to_ident.pop(task)
                 # Stop listening to this identity
                 del self.ident_to_task[ident]
@@ -1,5 +1,6 @@
 import os
 import json
+from typing import Iterable
 
 from .. import BlobStorage, Blob, WorkflowManager, WorkflowFactory, PersistentHistory, History
 
@@ -83,6 +84,15 @@ class S3BlobStorage(BlobStorage):
         object_key = f"{self._name}/{key}"
         self._s3_client.delete_object(Bucket=self._bucket_name, Key=object_key)
 
+    def delete_blobs(self, keys: Iterable[str]):
+        # delete_objects takes up to 1000 keys per request (missing keys are not an error)
+        object_keys = [{'Key': f"{self._name}/{key}"} for key in keys]
+        for start in range(0, len(object_keys), 1000):
+            self._s3_client.delete_objects(
+                Bucket=self._bucket_name,
+                Delete={'Objects': object_keys[start:start + 1000], 'Quiet': True}
+            )
+
 
 def create_s3_manager(
         namespace: str,
@@ -198,6 +208,12 @@ class DynamoDBBlobStorage(BlobStorage):
         }
         self._table.delete_item(Key=primary_key)
 
+    def delete_blobs(self, keys: Iterable[str]):
+        # The batch writer sends the deletes with batch_write_item, 25 at a time
+        with self._table.batch_writer() as batch:
+            for key in keys:
+                batch.delete_item(Key={'name': self._name, 'key': key})
+
 
 def create_dynamodb_manager(
         namespace: str,
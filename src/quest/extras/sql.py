@@ -1,3 +1,5 @@
+from typing import Iterable
+
 from .. import WorkflowFactory, WorkflowManager, PersistentHistory, History, BlobStorage, Blob
 
 try:
@@ -72,6 +74,13 @@ class SqlBlobStorage(BlobStorage):
                 self._get_session().delete(record)
                 self._get_session().commit()
 
+    def delete_blobs(self, keys: Iterable[str]):
+        # One DELETE ... IN statement and one commit
+        self._get_session().query(RecordModel).filter(
+            RecordModel.name == self._name, RecordModel.key.in_(list(keys))
+        ).delete(synchronize_session=False)
+        self._get_session().commit()
+
 
 def create_sql_manager(
         db_url: str,
@@ -0,0 +1,230 @@
+# Group commit for history writes
+#
+# Many workflows append history records within the same event-loop tick.
+# Instead of hitting storage on every append, histories that are given a
+# GroupCommitter buffer their changes and register themselves with it.
+# The committer flushes every pending history once per tick (or per window),
+# so each history performs a single storage write per batch.
+#
+# Records of one history are always written in order, so whatever survives
+# a crash is a prefix of the history; the workflow replays from there.
+#
+# Histories are written independently: if one history fails to write, the others
+# in the batch are still written, and the failed one keeps its changes and is
+# retried after `retry_delay` (committing it raises the error in the meantime).
+# Under the 'interval' policy, histories written without a sync are synced by
+# a timer once the interval has passed, so trailing writes are never left unsynced.
+import asyncio
+import time
+from collections import deque
+
+from .utils import quest_logger
+from typing import Literal, Protocol
+
+
+# 'always'   - write and sync every change immediately (no coalescing)
+# 'batch'    - coalesce changes and sync each batch
+# 'interval' - coalesce changes, but sync at most once per `sync_interval` seconds
+# Syncing is up to the history's storage (see BlobStorage.sync_blobs); over storage
+# that cannot sync (e.g. in memory), the policies only decide how changes are batched.
+DurabilityPolicy = Literal['always', 'batch', 'interval']
+
+
+class CommittableHistory(Protocol):
+    def write_pending(self, sync: bool) -> int:
+        """Write all buffered changes to storage and return how many were written"""
+        ...
+
+    def can_sync(self) -> bool:
+        """Whether write_pending(sync=True) makes the changes durable (not so over e.g. in-memory storage)"""
+        ...
+
+
+class GroupCommitter:
+    def __init__(self,
+                 window: float = 0,
+                 durability: DurabilityPolicy = 'batch',
+                 sync_interval: float = 1.0,
+                 retry_delay: float = 1.0,
+                 metrics_window: int = 1000):
+        """
+        :param window: Seconds to wait for more changes before flushing. 0 flushes at the end of the current tick.
+        :param durability: When storage is synced (see DurabilityPolicy).
+        :param sync_interval: Minimum seconds between syncs for the 'interval' policy.
+        :param retry_delay: Seconds to wait before writing a history again after its write failed.
+        :param metrics_window: Number of recent batches kept for the batch size and latency metrics.
+        """
+        if durability not in ('always', 'batch', 'interval'):
+            raise ValueError(f'Unknown durability policy: {durability}')
+
+        self._window = window
+        self._durability = durability
+        self._sync_interval = sync_interval
+        self._retry_delay = retry_delay
+
+        # dicts used as ordered sets
+        self._pending: dict[CommittableHistory, None] = {}
+        self._unsynced: dict[CommittableHistory, None] = {}  # written since the last sync
+        self._flush_handle: asyncio.Handle | None = None
+        self._sync_handle: asyncio.Handle | None = None
+        self._batch_done: asyncio.Future | None = None
+        self._last_sync = time.monotonic()
+
+        self._batch_count = 0
+        self._change_count = 0
+        self._sync_count = 0
+        self._batch_sizes: deque[int] = deque(maxlen=metrics_window)
+        self._flush_latencies: deque[float] = deque(maxlen=metrics_window)
+
+    def schedule(self, history: CommittableHistory):
+        """Called by a history when it has buffered a change"""
+        if self._durability == 'always':
+            failed = self._write_batch([history], sync=True)
+            if history in failed:
+                # The history keeps its changes; they are written with its next change
+                raise failed[history]
+            return
+
+        self._pending[history] = None
+        if not self._arm_flush(self._window):
+            # No event loop to coalesce with
+            self.flush()
+
+    def _arm_flush(self, delay: float) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        if self._flush_handle is not None:
+            handle = self._flush_handle
+            if not isinstance(handle, asyncio.TimerHandle) or handle.when() <= loop.time() + delay:
+                return True
+            # A retry waiting on `retry_delay` is brought forward by new changes
+            self._flush_handle.cancel()
+        if self._batch_done is None:
+            self._batch_done = loop.create_future()
+        if delay > 0:
+            self._flush_handle = loop.call_later(delay, self.flush)
+        else:
+            self._flush_handle = loop.call_soon(self.flush)
+        return True
+
+    def discard(self, history: CommittableHistory):
+        """Forget a history's pending changes (e.g. when the history is cleared)"""
+        self._pending.pop(history, None)
+        self._unsynced.pop(history, None)
+
+    def flush(self) -> dict[CommittableHistory, Exception]:
+        """Write every pending history now and return the histories that failed to write"""
+        return self._flush(self._durability == 'batch' or time.monotonic() - self._last_sync >= self._sync_interval)
+
+    def _flush(self, sync: bool) -> dict[CommittableHistory, Exception]:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch_done, self._batch_done = self._batch_done, None
+        histories, self._pending = list(self._pending), {}
+
+        if sync:
+            if self._sync_handle is not None:
+                self._sync_handle.cancel()
+                self._sync_handle = None
+            # Histories with nothing pending just sync what they wrote before
+            histories.extend(history for history in self._unsynced if history not in histories)
+            self._unsynced = {}
+
+        failed = self._write_batch(histories, sync)
+
+        if not sync:
+            self._unsynced.update(
+                (history, None) for history in histories if history not in failed and history.can_sync()
+            )
+            if self._unsynced:
+                self._arm_sync()
+
+        if failed:
+            # Without an event loop the failed histories are retried with the next flush
+            for history in failed:
+                self._pending[history] = None
+            self._arm_flush(self._retry_delay)
+
+        if batch_done is not None and not batch_done.done():
+            batch_done.set_result(failed)
+        return failed
+
+    def _arm_sync(self):
+        if self._sync_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Without an event loop the next flush after the interval syncs
+            return
+        delay = max(0.0, self._last_sync + self._sync_interval - time.monotonic())
+        self._sync_handle = loop.call_later(delay, self._flush, True)
+
+    def _write_batch(self, histories: list[CommittableHistory], sync: bool) -> dict[CommittableHistory, Exception]:
+        failed = {}
+        changes = 0
+        start = time.perf_counter()
+        for history in histories:
+            try:
+                changes += history.write_pending(sync)
+            except Exception as ex:
+                quest_logger.exception(f'Failed to write the pending changes of {history}')
+                failed[history] = ex
+        latency = time.perf_counter() - start
+
+        if sync:
+            self._last_sync = time.monotonic()
+            # Only syncs that made something durable are counted
+            if any(history.can_sync() for history in histories if history not in failed):
+                self._sync_count += 1
+
+        if changes:
+            self._batch_count += 1
+            self._change_count += changes
+            self._batch_sizes.append(changes)
+            self._flush_latencies.append(latency)
+
+        return failed
+
+    async def commit(self, history: CommittableHistory, immediate: bool = False):
+        """
+        Wait until the pending changes of `history` have been written.
+        If `immediate`, flush now instead of waiting for the batch.
+        Raises the error of the write if `history` failed to write.
+        """
+        if history not in self._pending:
+            return
+
+        if immediate or self._batch_done is None:
+            failed = self.flush()
+        else:
+            failed = await asyncio.shield(self._batch_done)
+
+        if history in failed:
+            raise failed[history]
+
+    def get_metrics(self) -> dict:
+        """Return batch size and flush latency metrics for the recent batches"""
+        sizes = sorted(self._batch_sizes)
+        latencies = sorted(self._flush_latencies)
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(p * len(values)))] if values else 0
+
+        return {
+            'durability': self._durability,
+            'batches': self._batch_count,
+            'changes': self._change_count,
+            'syncs': self._sync_count,
+            'pending_histories': len(self._pending),
+            'batch_size_mean': sum(sizes) / len(sizes) if sizes else 0,
+            'batch_size_max': sizes[-1] if sizes else 0,
+            'flush_latency_p50': percentile(latencies, 0.5),
+            'flush_latency_p99': percentile(latencies, 0.99),
+            'flush_latency_max': latencies[-1] if latencies else 0,
+        }
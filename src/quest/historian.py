@@ -1,15 +1,18 @@
 import asyncio
 import inspect
+import time
 import traceback
 from asyncio import Task
+from collections import deque
 from contextvars import ContextVar
 from datetime import datetime
 from functools import wraps
-from typing import Callable, TypeVar
+from typing import Callable, Sequence, TypeVar
 
-from .history import History
+from .executors import run_in_executor
+from .history import History, record_headers, remove_many, snapshot
 from .quest_types import ConfigurationRecord, VersionRecord, StepStartRecord, StepEndRecord, \
-    ResourceAccessEvent, ResourceEntry, ResourceLifecycleEvent, TaskEvent
+    ResourceAccessEvent, ResourceEntry, ResourceLifecycleEvent, TaskEvent, EventRecord, ContinueRecord
 from .resources import ResourceStreamManager
 from .serializer import StepSerializer
 from .utils import quest_logger, task_name_getter
@@ -135,52 +138,51 @@ def _get_type_name(obj):
     return obj.__class__.__module__ + '.' + obj.__class__.__name__
 
 
-def _get_id(item):
-    if isinstance(item, dict):
-        return tuple((k, _get_id(v)) for k, v in item.items())
+def _step_prefixes(step_id: str):
+    """The step ID followed by the IDs of the steps it is nested in, innermost first"""
+    end = len(step_id)
+    while end > 0:
+        yield step_id[:end]
+        end = step_id.rfind('.', 0, end)
 
-    if isinstance(item, list):
-        return tuple(_get_id(v) for v in item)
 
-    return item
+# What the step index keeps of a record (see Historian._index_record):
+#  (the record's sequence number, or the record itself if the history cannot look records up, type, step_id, resource_id)
+IndexEntry = tuple[EventRecord | int, str, str, str | None]
 
 
-def _prune(step_id: str, history: "History"):
+def _prune(step_id: str, history: "History", entries: dict[int, IndexEntry],
+           load_record: Callable[[EventRecord | int], EventRecord]) -> list[int]:
     """
     Remove substep work
+    `entries` index the records produced while the step was open, ending with its end record
+     (see Historian._index_record), so the rest of the history is never searched
     Records whose step_ids are prefixed by the step_id of the step are substep work
     Keep external events that belong to resources created outside the step
+    Only the records that are removed are loaded (see load_record)
+    Returns the keys of the entries that were removed
     """
-    items = reversed(history)
-    to_delete = []
+    items = list(entries.items())
 
     # Last record should be a step with the give step ID
-    record = next(items)
-    assert record['type'] == 'end', f'{record["type"]} != end'
-    assert record['step_id'] == step_id, f'{record["step_id"]} != {step_id}'
+    _, (_, record_type, record_step_id, _) = items.pop()
+    assert record_type == 'end', f'{record_type} != end'
+    assert record_step_id == step_id, f'{record_step_id} != {step_id}'
 
-    end_of_life_resources = set()
-    try:
-        while record := next(items):
-            if record['step_id'].startswith(step_id):
-                # Found a sub-record of the step, we can delete it
-                # But if it is a resource scoped to this step, keep track of it first
-                if record['type'] == 'delete_resource':
-                    end_of_life_resources.add(record['resource_id'])
-                to_delete.append(record)
+    # Resources scoped to this step
+    end_of_life_resources = {
+        resource_id for _, (_, record_type, record_step_id, resource_id) in items
+        if record_type == 'delete_resource' and record_step_id.startswith(step_id)
+    }
 
-            if record['type'] == 'external' and record['resource_id'] in end_of_life_resources:
-                to_delete.append(record)
+    to_delete = [
+        (key, ref) for key, (ref, record_type, record_step_id, resource_id) in items
+        if record_step_id.startswith(step_id)
+        or (record_type == 'external' and resource_id in end_of_life_resources)
+    ]
 
-            if record['step_id'] == step_id:
-                # Found the beginning of the step, we can stop searching
-                break
-
-    except StopIteration:
-        pass
-
-    for record in to_delete:
-        history.remove(record)
+    remove_many(history, [load_record(ref) for _, ref in to_delete])
+    return [key for key, _ in to_delete]
 
 
 def _get_current_timestamp() -> str:
@@ -207,6 +209,39 @@ def _create_resource_id(name: str, identity: str | None) -> str:
 historian_context = ContextVar('historian')
 
 
+class ContinueAsNew(BaseException):
+    """
+    Raised by continue_as_new.
+    It is a BaseException so that `except Exception` in the workflow does not stop it.
+    """
+
+    def __init__(self, args: tuple, kwargs: dict):
+        super().__init__(args, kwargs)
+        self.workflow_args = args
+        self.workflow_kwargs = kwargs
+
+
+def continue_as_new(*args, **kwargs):
+    """
+    End the current run of the workflow and start it over with these arguments, with a fresh history.
+    The workflow keeps its ID; resources and aliases are rebuilt by the new run.
+    Use this in long-running loops so the history (and the replay on resume) stays bounded.
+    With queue compaction (see Queue.compact_consumed), a run's history holds one record per item it consumed,
+     so continuing every N items bounds the history by N, whatever the total traffic.
+    """
+    historian = find_historian()
+    # External events for the open resources wait for the next run, which is expected to create them again
+    historian._continued_resources = set(historian._resources)
+    raise ContinueAsNew(args, kwargs)
+
+
+def _group_by_resource(events: list[ResourceAccessEvent]) -> dict[str, list[ResourceAccessEvent]]:
+    grouped = {}
+    for event in events:
+        grouped.setdefault(event['resource_id'], []).append(event)
+    return grouped
+
+
 def get_function_name(func):
     if hasattr(func, '__name__'):  # regular functions
         return func.__name__
@@ -234,6 +269,8 @@ class Historian:
 
         # These things need to be serialized
         self._history: History = history
+        # Histories that keep records in storage can look them up by sequence number (see PersistentHistory)
+        self._get_history_record: Callable[[int], EventRecord] | None = getattr(history, 'get_record', None)
 
         self._serializer: StepSerializer = serializer
 
@@ -264,10 +301,30 @@ class Historian:
         #  queues to push to, etc.
         # See also external.py
         self._resources: dict[str, ResourceEntry] = {}
+        # The same entries by identity (None for public resources) and then resource ID,
+        #  so the resources of one identity are found without looking at the others
+        self._identity_resources: dict[str | None, dict[str, ResourceEntry]] = {}
 
         # This is the resource stream manager that handles calls to stream the historian's resources
         self._resource_stream_manager = ResourceStreamManager()
 
+        # When the workflow last recorded something (see idle_time)
+        self._last_activity = time.monotonic()
+
+        # While a workflow continues as new, external events for the resources of the previous run
+        #  wait for the new run to create them again (see _wait_for_continued_resource)
+        self._continued_resources: set[str] = set()
+        self._resource_added = asyncio.Event()
+        # The external puts of the items the previous run did not get, by queue (see _put_continued_events)
+        self._continued_events: dict[str, list[ResourceAccessEvent]] = {}
+
+        # The task that runs the workflow (see run) and whether it is being suspended
+        self._run_task: asyncio.Task | None = None
+        self._suspending = False
+
+        # The deadlines (UTC) of the timers the workflow is waiting on (see timers.py)
+        self._timers: dict[object, datetime] = {}
+
         # We keep track of all open tasks so we can properly suspend them
         self._open_tasks: list[Task] = []
 
@@ -280,6 +337,8 @@ class Historian:
         #  Unique IDs keeps track of existing IDs so we can ensure
         #  each new ID is unique. See _get_unique_id
         self._unique_ids: set[str] = set()
+        # The last counter used for each name, so repeated names don't search from 0
+        self._unique_id_counters: dict[str, int] = {}
 
         # Replay Started ensures that no one tries to access resources
         #  until the resources have been rebuilt after resuming
@@ -287,28 +346,53 @@ class Historian:
         # Then we wait until the replay has completed (see _replay_complete)
         self._replay_started = asyncio.Event()
 
-        # The existing history is a copy of the initial history
+        # The existing history is a snapshot of the initial history
         #  This ensures that we only replay the pre-existing records
-        self._existing_history = []
+        # See history.snapshot()
+        self._existing_history: Sequence[EventRecord] = []
 
         # Each task needs to replay its separate event records,
         #  but the records are all interleaved.
         #  We use _task_replay_records to create a stream of records
         #  that belong to a specific task.
+        # _task_positions holds the positions of each task's records
+        #  in the existing history (see _reset_replay).
+        #  It is built from the record headers (see history.record_headers),
+        #  which PersistentHistory keeps in its key index, so no record is read to build it
+        self._task_positions: dict[str, list[int]] = {}
+
         # _replay_records stores the generators for each task ID
         # See also _next_record
         self._replay_records = {}
 
         # To ensure that past events are replayed in the exact order
-        #  they were created, a record gate exists for each record.
-        #  When a task finishes with a record, it opens the gate
-        #  which allows every task to move to the next record
-        # If something goes wrong while processing a record,
-        #  the error is put here, leading to the replay failing
-        self._record_gates: dict[str, asyncio.Future] = {}
-
-        # noinspection PyTypeChecker
-        self._last_record_gate: asyncio.Future = None
+        #  they were created, records are replayed one at a time.
+        #  The replay cursor is the position (in the existing history)
+        #  of the next record to be replayed. When a task finishes with a record,
+        #  the cursor moves on, which allows every task to move to the next record
+        # A task that must wait for another task's record waits on a future
+        #  for that position, so there is at most one waiter per task
+        # See _wait_for_record and _complete_record
+        self._replay_cursor = 0
+        self._replay_waiters: dict[int, asyncio.Future] = {}
+
+        # The records produced by each open step that are not part of an open substep
+        #  (including the records of the tasks it started and the resources it created),
+        #  keyed by _record_key. When the step ends it only has to prune these,
+        #  and what is left over moves to the enclosing step. See _index_record and _prune_step
+        # Open steps (the workflow itself, long-running loops) can produce many records,
+        #  so the index keeps just what pruning decides on (see IndexEntry),
+        #  and records are loaded again only to remove them
+        self._step_records: dict[str, dict[int, IndexEntry]] = {}
+
+        # The step ID of the create_resource record of each resource,
+        #  so external events can be indexed under the steps that created the resource
+        self._resource_steps: dict[str, str] = {}
+
+        # For each queue resource that compacts consumed items (see external.Queue),
+        #  the external put record of each item still in the queue, in queue order
+        #  (None for items the workflow put itself). See _consume_queue_put
+        self._queue_puts: dict[str, deque[EventRecord | None]] = {}
 
     def _reset_replay(self):
         quest_logger.debug('Resetting replay')
@@ -317,8 +401,13 @@ class Historian:
 
         self._versions = {}
 
-        self._existing_history = list(self._history)
+        self._existing_history = snapshot(self._history)
+        # Built from the record headers, so the records are read only when their task replays them
+        self._task_positions = {}
+        for position, (_, task_id) in enumerate(record_headers(self._existing_history)):
+            self._task_positions.setdefault(task_id, []).append(position)
         self._resources = {}
+        self._identity_resources = {}
 
         # The workflow ID is used as the task name for the root task
         self._prefix = {
@@ -327,6 +416,11 @@ class Historian:
         }
 
         self._unique_ids = set()
+        self._unique_id_counters = {}
+
+        self._step_records = {}
+        self._resource_steps = {}
+        self._queue_puts = {}
 
         self._task_replays = {}
 
@@ -339,21 +433,35 @@ class Historian:
             self._get_external_task_name(): None
         }
 
-        self._record_gates = {
-            _get_id(record): asyncio.Future()
-            for record in self._existing_history
-        }
-
-        for self._last_record_gate in self._record_gates.values():
-            pass  # i.e. when this loop finishes, _last_record_gate will be the last one
+        self._replay_cursor = 0
+        self._replay_waiters = {}
 
         self._open_tasks: list[Task] = []
 
         self._replay_started.set()
 
+    def _replay_done(self) -> bool:
+        return 0 < len(self._existing_history) <= self._replay_cursor
+
+    async def _wait_for_record(self, position: int):
+        """Wait until the record at this position of the existing history has been replayed"""
+        if position < self._replay_cursor:
+            return
+        if (waiter := self._replay_waiters.get(position)) is None:
+            waiter = self._replay_waiters[position] = asyncio.get_running_loop().create_future()
+        # Several tasks may wait on the same position
+        await asyncio.shield(waiter)
+
+    def _complete_record(self, position: int):
+        # Every record before this one has already been replayed,
+        #  so the cursor moves on by one
+        self._replay_cursor = position + 1
+        if (waiter := self._replay_waiters.pop(position, None)) is not None:
+            waiter.set_result(None)
+
     async def _replay_complete(self):
-        if self._last_record_gate is not None:
-            await self._last_record_gate
+        if self._existing_history:
+            await self._wait_for_record(len(self._existing_history) - 1)
 
         quest_logger.debug(f'{self.workflow_id} -- Replay Complete --')
         # TODO - log this only once?
@@ -374,16 +482,17 @@ class Historian:
             # TODO - is this catch necessary? It smells REALLY bad.
             return self._get_external_task_name()
 
-    def _get_prefixed_name(self, event_name: str) -> str:
-        return '.'.join(self._prefix[self._get_task_name()]) + '.' + event_name
+    def _get_prefixed_name(self, event_name: str, task_name: str = None) -> str:
+        return '.'.join(self._prefix[task_name or self._get_task_name()]) + '.' + event_name
 
-    def _get_unique_id(self, event_name: str) -> str:
-        prefixed_name_root = self._get_prefixed_name(event_name)
-        prefixed_name = prefixed_name_root
-        counter = 0
+    def _get_unique_id(self, event_name: str, task_name: str = None) -> str:
+        prefixed_name_root = self._get_prefixed_name(event_name, task_name)
+        counter = self._unique_id_counters.get(prefixed_name_root, 0)
+        prefixed_name = f'{prefixed_name_root}_{counter}' if counter else prefixed_name_root
         while prefixed_name in self._unique_ids:
             counter += 1
             prefixed_name = f'{prefixed_name_root}_{counter}'
+        self._unique_id_counters[prefixed_name_root] = counter
         self._unique_ids.add(prefixed_name)
         return prefixed_name
 
@@ -403,43 +512,106 @@ class Historian:
         self._task_replays[task_id] = task_replay
 
         """Yield the tasks for this task ID"""
-        for record in self._existing_history:
-            # If the record belongs to another task, we need to wait
-            #  for that other task to finish with the record
-            #  before we move on
-            if record['task_id'] != task_id:
-                if (gate := self._record_gates[_get_id(record)]).done():
-                    if gate.exception() is not None:
-                        quest_logger.debug(f'{task_id} found {record} errored: {gate.exception()}')
-                    else:
-                        quest_logger.debug(f'{task_id} found {record} completed')
-                else:
-                    quest_logger.debug(f'{task_id} waiting on {record}')
-                # We await either way so if the gate has an error we see it
-                await gate
-
-            else:  # task ID matches
-                def complete(r, exc_type, exc_val, exc_tb):
-                    if exc_type is not None:
-                        exc_info = "".join(traceback.format_exception(exc_type, exc_val, exc_tb))
-                        quest_logger.debug(f'Noting that record {r} raised: \n{exc_info}')
-                    # Note:
-                    # While Futures, the record gates are only used as gates
-                    # The return values are never used
-                    # Thus, even if there was an error when the task completed
-                    # we simply want to indicate the gate is finished
-                    # The relevant error will be raised in handle_step
-                    quest_logger.debug(f'{task_id} completing {r}')
-                    self._record_gates[_get_id(r)].set_result(None)
-
-                # noinspection PyUnboundLocalVariable
-                quest_logger.debug(f'{self._get_task_name()} replaying {record}')
-                yield self._NextRecord(record, complete)
+        for position in self._task_positions.get(task_id, []):
+            # The records before this one belong to other tasks
+            #  (or have been replayed by this task), so we need to wait
+            #  for the other tasks to finish with them before we move on
+            # Records are replayed in order, so waiting for the one
+            #  just before this one is enough
+            if position > self._replay_cursor:
+                quest_logger.debug(f'{task_id} waiting on record {position - 1}')
+                await self._wait_for_record(position - 1)
+
+            record = self._existing_history[position]
+
+            def complete(r, exc_type, exc_val, exc_tb, position=position):
+                if exc_type is not None:
+                    exc_info = "".join(traceback.format_exception(exc_type, exc_val, exc_tb))
+                    quest_logger.debug(f'Noting that record {r} raised: \n{exc_info}')
+                # Note:
+                # Even if there was an error when the task completed
+                # we simply want to indicate the record is finished
+                # The relevant error will be raised in handle_step
+                quest_logger.debug(f'{task_id} completing {r}')
+                self._complete_record(position)
+
+            quest_logger.debug(f'{self._get_task_name()} replaying {record}')
+            self._index_record(record)
+            yield self._NextRecord(record, complete)
 
         quest_logger.debug(f'Replay for {self._get_task_name()} complete')
         task_replay.set()
         await self._replay_complete()
 
+    def _add_record(self, record: EventRecord):
+        self._history.append(record)
+        self._index_record(record)
+        self._last_activity = time.monotonic()
+
+    def _record_key(self, record: EventRecord) -> int:
+        return record['seq'] if self._get_history_record is not None else id(record)
+
+    def _load_record(self, ref: EventRecord | int) -> EventRecord:
+        return self._get_history_record(ref) if isinstance(ref, int) else ref
+
+    def _index_record(self, record: EventRecord):
+        """Add the record to the index of the innermost open step it belongs to"""
+        if record['type'] == 'start':
+            self._step_records[record['step_id']] = {}
+        elif record['type'] == 'create_resource':
+            self._resource_steps[record['resource_id']] = record['step_id']
+        elif record['type'] == 'delete_resource':
+            self._resource_steps.pop(record['resource_id'], None)
+
+        ref = record['seq'] if self._get_history_record is not None else record
+        self._index_entry(self._record_key(record), (ref, record['type'], record['step_id'], record.get('resource_id')))
+
+    def _index_entry(self, key: int, entry: IndexEntry):
+        _, record_type, step_id, resource_id = entry
+        step_ids = [step_id]
+        if record_type == 'external' and resource_id in self._resource_steps:
+            # Otherwise, external events belong to the step that created the resource
+            step_ids.append(self._resource_steps[resource_id])
+
+        for step_id in step_ids:
+            for prefix in _step_prefixes(step_id):
+                if (entries := self._step_records.get(prefix)) is not None:
+                    entries[key] = entry
+                    return
+
+    def _prune_step(self, step_id: str):
+        entries = self._step_records.pop(step_id)
+        removed = set(_prune(step_id, self._history, entries, self._load_record))
+
+        # What is left (the end record and the events of resources that outlive the step)
+        #  now belongs to the enclosing step
+        for key, entry in entries.items():
+            if key not in removed:
+                self._index_entry(key, entry)
+
+    def _track_queue_put(self, resource_id: str, record: EventRecord | None):
+        if getattr(self._resources[resource_id]['resource'], 'compact_consumed', False):
+            self._queue_puts.setdefault(resource_id, deque()).append(record)
+
+    def _consume_queue_put(self, resource_id: str) -> EventRecord | None:
+        """A get took the oldest item of the queue: return the external put record of that item, if any"""
+        if not (puts := self._queue_puts.get(resource_id)):
+            return None
+        return puts.popleft()
+
+    def _compact_queue_get(self, put_record: EventRecord, start_record: EventRecord):
+        """
+        Remove the external put of an item and the start of the get that consumed it
+        The end of the get holds the item, so on replay the get returns it
+         without touching the queue (see handle_internal_event)
+        That end record stays, so the history still grows by one record per consumed item;
+         workflows that loop forever also need continue_as_new to keep their history bounded
+        """
+        for entries in self._step_records.values():
+            entries.pop(self._record_key(put_record), None)
+            entries.pop(self._record_key(start_record), None)
+        remove_many(self._history, [put_record, start_record])
+
     async def _external_handler(self):
         try:
             quest_logger.debug(f'External event handler {self._get_task_name()} starting')
@@ -494,7 +666,7 @@ class Historian:
         })
 
         # If the replay has already finished...
-        if self._last_record_gate is not None and self._last_record_gate.done():
+        if self._replay_done():
             self._process_discovered_versions()
 
     def _process_discovered_versions(self):
@@ -510,7 +682,7 @@ class Historian:
         quest_logger.debug(f'Version record: {version_name} = {version}')
         self._versions[version_name] = version
 
-        self._history.append(VersionRecord(
+        self._add_record(VersionRecord(
             type='set_version',
             timestamp=_get_current_timestamp(),
             step_id=version_name,
@@ -528,12 +700,15 @@ class Historian:
         quest_logger.debug(f'{self._get_task_name()} is waiting for version {version_name}=={version}')
 
         found = False
-        for record in self._existing_history:
-            if record['type'] == 'version' \
+        for position, (record_type, _) in enumerate(record_headers(self._existing_history)):
+            if record_type != 'version':
+                continue
+            record = self._existing_history[position]
+            if record is not None \
                     and record['version_name'] == version_name \
                     and record['version'] == version:
                 found = True
-                await self._record_gates[_get_id(record)]
+                await self._wait_for_record(position)
 
         if not found:
             quest_logger.error(f'{self._get_task_name()} did not find version {version_name}=={version}')
@@ -546,7 +721,7 @@ class Historian:
                 assert record['version'] == version, str(record)
 
         else:
-            self._history.append(VersionRecord(
+            self._add_record(VersionRecord(
                 type='after_version',
                 timestamp=_get_current_timestamp(),
                 step_id='version',
@@ -554,6 +729,10 @@ class Historian:
                 version=version
             ))
 
+    async def run_in_executor(self, executor, func: Callable, *args, **kwargs):
+        """Run a step body in a thread or process pool (see executors.py)"""
+        return await run_in_executor(executor, func, self._serializer, *args, **kwargs)
+
     async def handle_step(self, func_name, func: Callable, *args, **kwargs):
         step_id = self._get_unique_id(func_name)
         unique_func_name = step_id.split('.')[-1]
@@ -576,7 +755,7 @@ class Historian:
 
         if next_record is None:
             quest_logger.debug(f'{self._get_task_name()} starting step {func_name} with {args} and {kwargs}')
-            self._history.append(StepStartRecord(
+            self._add_record(StepStartRecord(
                 type='start',
                 timestamp=_get_current_timestamp(),
                 task_id=self._get_task_name(),
@@ -594,7 +773,7 @@ class Historian:
 
             serialized_result = await self._serializer.serialize(result)
 
-            self._history.append(StepEndRecord(
+            self._add_record(StepEndRecord(
                 type='end',
                 timestamp=_get_current_timestamp(),
                 task_id=self._get_task_name(),
@@ -605,6 +784,11 @@ class Historian:
 
             return result
 
+        except ContinueAsNew:
+            # The history of this run is replaced (see _continue_as_new)
+            prune_on_exit = False
+            raise
+
         except asyncio.CancelledError as cancel:
             if cancel.args and cancel.args[0] == SUSPENDED:
                 prune_on_exit = False
@@ -612,7 +796,7 @@ class Historian:
             else:
                 quest_logger.exception(f'{step_id} canceled')
                 serialized_exception = serialize_exception(cancel)
-                self._history.append(StepEndRecord(
+                self._add_record(StepEndRecord(
                     type='end',
                     timestamp=_get_current_timestamp(),
                     task_id=self._get_task_name(),
@@ -625,7 +809,7 @@ class Historian:
         except Exception as ex:
             quest_logger.exception(f'Error in {step_id}')
             serialized_exception = serialize_exception(ex)
-            self._history.append(StepEndRecord(
+            self._add_record(StepEndRecord(
                 type='end',
                 timestamp=_get_current_timestamp(),
                 step_id=step_id,
@@ -637,7 +821,7 @@ class Historian:
 
         finally:
             if prune_on_exit:
-                _prune(step_id, self._history)
+                self._prune_step(step_id)
             self._prefix[self._get_task_name()].pop(-1)
 
     async def record_external_event(self, name, identity, action, *args, **kwargs):
@@ -645,6 +829,7 @@ class Historian:
         When an external event occurs, this method is called.
         """
         resource_id = _create_resource_id(name, identity)
+        await self._wait_for_continued_resource(resource_id)
         step_id = self._get_unique_id(resource_id + '.' + action)
 
         quest_logger.debug(f'External event {step_id} with {args} and {kwargs}')
@@ -657,7 +842,7 @@ class Historian:
         else:
             result = function(*args, **kwargs)
 
-        self._history.append(ResourceAccessEvent(
+        self._add_record(record := ResourceAccessEvent(
             type='external',
             timestamp=_get_current_timestamp(),
             step_id=step_id,
@@ -668,9 +853,39 @@ class Historian:
             kwargs=kwargs,
             result=result
         ))
+        if action == 'put':
+            self._track_queue_put(resource_id, record)
+
+        # The caller is told the event happened, so make sure it is written
+        await self._commit_history()
 
         return result
 
+    async def _put_continued_events(self, resource_id: str):
+        """
+        Put the items the previous run left in this queue (see _continue_as_new) in the new run's queue,
+         as external events recorded right after the queue was created
+        """
+        external_task = self._get_external_task_name()
+        for event in self._continued_events.pop(resource_id, []):
+            function = getattr(self._resources[resource_id]['resource'], event['action'])
+            result = function(*event['args'], **event['kwargs'])
+            if inspect.iscoroutine(result):
+                result = await result
+
+            self._add_record(record := ResourceAccessEvent(
+                type='external',
+                timestamp=_get_current_timestamp(),
+                step_id=self._get_unique_id(resource_id + '.' + event['action'], external_task),
+                task_id=external_task,
+                resource_id=resource_id,
+                action=event['action'],
+                args=event['args'],
+                kwargs=event['kwargs'],
+                result=result
+            ))
+            self._track_queue_put(resource_id, record)
+
     async def _replay_external_event(self, record: ResourceAccessEvent):
         """
         When an external event is replayed, this method is called
@@ -687,6 +902,9 @@ class Historian:
 
         assert result == record['result']
 
+        if record['action'] == 'put':
+            self._track_queue_put(record['resource_id'], record)
+
     async def handle_internal_event(self, name, identity, action, *args, **kwargs):
         """
         Internal events are always played
@@ -700,7 +918,7 @@ class Historian:
         function = getattr(resource, action)
 
         if (next_record := await self._next_record()) is None:
-            self._history.append(ResourceAccessEvent(
+            self._add_record(start_record := ResourceAccessEvent(
                 type='internal_start',
                 timestamp=_get_current_timestamp(),
                 step_id=step_id,
@@ -712,7 +930,14 @@ class Historian:
                 result=None
             ))
         else:
-            with next_record as record:
+            with next_record as start_record:
+                if start_record['type'] == 'internal_end':
+                    # The get consumed an item from an external put, and both were compacted
+                    #  (see _compact_queue_get), so the queue no longer holds the item
+                    assert action == 'get', str(start_record)
+                    assert resource_id == start_record['resource_id'], str(start_record)
+                    return start_record['result']
+                record = start_record
                 assert 'internal_start' == record['type'], str(record)
                 assert resource_id == record['resource_id'], str(record)
                 assert action == record['action'], str(record)
@@ -726,7 +951,7 @@ class Historian:
             result = function(*args, **kwargs)
 
         if (next_record := await self._next_record()) is None:
-            self._history.append(ResourceAccessEvent(
+            self._add_record(ResourceAccessEvent(
                 type='internal_end',
                 timestamp=_get_current_timestamp(),
                 step_id=step_id,
@@ -737,6 +962,8 @@ class Historian:
                 kwargs=kwargs,
                 result=result
             ))
+            if action == 'get' and (put_record := self._consume_queue_put(resource_id)) is not None:
+                self._compact_queue_get(put_record, start_record)
             await self._update_resource_stream(identity)
 
         else:
@@ -747,9 +974,18 @@ class Historian:
                 assert list(args) == list(record['args'])
                 assert kwargs == record['kwargs']
                 assert result == record['result']
+            if action == 'get':
+                self._consume_queue_put(resource_id)
+
+        if action == 'put':
+            self._track_queue_put(resource_id, None)
 
         return result
 
+    async def _wait_for_continued_resource(self, resource_id: str):
+        while resource_id not in self._resources and resource_id in self._continued_resources:
+            await self._resource_added.wait()
+
     async def register_resource(self, name, identity, resource):
         resource_id = _create_resource_id(name, identity)
         # TODO - support the ability to limit the exposed API on the resource
@@ -761,15 +997,19 @@ class Historian:
         step_id = self._get_unique_id(resource_id + '.' + '__init__')
         quest_logger.debug(f'Creating {resource_id}')
 
-        self._resources[resource_id] = ResourceEntry(
+        self._resources[resource_id] = entry = ResourceEntry(
             name=name,
             identity=identity,
             type=_get_type_name(resource),
             resource=resource
         )
+        self._identity_resources.setdefault(identity, {})[resource_id] = entry
+        self._continued_resources.discard(resource_id)
+        self._resource_added.set()
+        self._resource_added = asyncio.Event()
 
         if (next_record := await self._next_record()) is None:
-            self._history.append(ResourceLifecycleEvent(
+            self._add_record(ResourceLifecycleEvent(
                 type='create_resource',
                 timestamp=_get_current_timestamp(),
                 step_id=step_id,
@@ -777,12 +1017,15 @@ class Historian:
                 resource_id=resource_id,
                 resource_type=_get_type_name(resource)
             ))
-            await self._update_resource_stream(identity)
+            await self._put_continued_events(resource_id)
+            await self._update_resource_stream(identity, added={(name, identity): _get_type_name(resource)})
 
         else:
             with next_record as record:
                 assert record['type'] == 'create_resource'
                 assert record['resource_id'] == resource_id
+            # The continued events were put when the resource was created, and are replayed
+            self._continued_events.pop(resource_id, None)
 
         return resource_id
 
@@ -795,10 +1038,14 @@ class Historian:
         step_id = self._get_unique_id(resource_id + '.' + '__del__')
         quest_logger.debug(f'Removing {resource_id}')
         resource_entry = self._resources.pop(resource_id)
+        identity_resources = self._identity_resources[identity]
+        del identity_resources[resource_id]
+        if not identity_resources:
+            del self._identity_resources[identity]
 
         if not suspending:
             if (next_record := await self._next_record()) is None:
-                self._history.append(ResourceLifecycleEvent(
+                self._add_record(ResourceLifecycleEvent(
                     type='delete_resource',
                     timestamp=_get_current_timestamp(),
                     step_id=step_id,
@@ -806,7 +1053,7 @@ class Historian:
                     resource_id=resource_id,
                     resource_type=resource_entry['type']
                 ))
-                await self._update_resource_stream(identity)
+                await self._update_resource_stream(identity, removed=[(name, identity)])
 
             else:
                 with next_record as record:
@@ -823,7 +1070,7 @@ class Historian:
             quest_logger.debug(f'Starting task {task_id}')
 
             if (next_record := await self._next_record()) is None:
-                self._history.append(TaskEvent(
+                self._add_record(TaskEvent(
                     type='start_task',
                     timestamp=_get_current_timestamp(),
                     step_id=task_id + '.start',
@@ -837,7 +1084,7 @@ class Historian:
             result = await func(*a, **kw)
 
             if (next_record := await self._next_record()) is None:
-                self._history.append(TaskEvent(
+                self._add_record(TaskEvent(
                     type='complete_task',
                     timestamp=_get_current_timestamp(),
                     step_id=task_id + '.complete',
@@ -885,9 +1132,31 @@ class Historian:
         historian_context.set(self)
         task_name_getter.set(self._get_task_name)
         quest_logger.debug(f'Running workflow {self.workflow_id}')
-        self._add_new_configurations()
-        self._reset_replay()
+        await self._load_history()
+
+        if (continuation := self._finish_continuation()) is not None:
+            # The workflow continued as new: its arguments are those of the latest run
+            args = await self._serializer.deserialize(continuation['args'])
+            kwargs = await self._serializer.deserialize(continuation['kwargs'])
+            self._continued_events = _group_by_resource(continuation.get('pending', []))
 
+        try:
+            while True:
+                self._add_new_configurations()
+                self._reset_replay()
+                try:
+                    return await self._run_tasks(*args, **kwargs)
+                except ContinueAsNew as continued:
+                    args, kwargs = continued.workflow_args, continued.workflow_kwargs
+                    await self._continue_as_new(args, kwargs)
+                    if self._suspending:
+                        # The workflow was suspended as it continued; the new run starts on resume
+                        raise asyncio.CancelledError(SUSPENDED)
+        finally:
+            self._continued_resources.clear()
+            self._resource_added.set()
+
+    async def _run_tasks(self, *args, **kwargs):
         # We use a TaskGroup here to ensure that the external_replay task
         #  exits when the main task fails
         try:
@@ -912,15 +1181,80 @@ class Historian:
             else:
                 raise
 
+        except BaseExceptionGroup as eg:
+            if continued := [ex for ex in eg.exceptions if isinstance(ex, ContinueAsNew)]:
+                raise continued[0]
+            raise
+
         # Workflow logic completed
 
+    async def _continue_as_new(self, args, kwargs):
+        quest_logger.debug(f'{self.workflow_id} continuing as new with {args} and {kwargs}')
+
+        # Tasks the workflow left running are stopped without recording anything
+        for task in list(reversed(self._open_tasks)):
+            task.cancel(SUSPENDED)
+        for task in list(self._open_tasks):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        # Items that external events put in the queues, and that this run did not get, were acknowledged:
+        #  they go with the continue record, to be put in the new run's queues (see _put_continued_events).
+        #  So do those the previous run carried, if this run did not create their queue.
+        pending = [record for puts in self._queue_puts.values() for record in puts if record is not None]
+        pending.extend(event for events in self._continued_events.values() for event in events)
+
+        # The continue record is written before the old records are removed (in one change),
+        #  so the history holds either the old run or the new one (see _finish_continuation)
+        self._add_record(ContinueRecord(
+            type='continue',
+            timestamp=_get_current_timestamp(),
+            step_id='continue',
+            task_id=self._get_external_task_name(),  # replayed (as a no-op) by the external handler
+            args=await self._serializer.serialize(list(args)),
+            kwargs=await self._serializer.serialize(kwargs),
+            pending=[ResourceAccessEvent(**{key: value for key, value in record.items() if key != 'seq'})
+                     for record in pending]
+        ))
+        self._continued_events = _group_by_resource(pending)
+        self._finish_continuation()
+        await self._commit_history(immediate=True)
+
+    def _finish_continuation(self) -> ContinueRecord | None:
+        """Remove the records of earlier runs (if any are left) and return the latest continue record"""
+        records = snapshot(self._history)
+        types = [record_type for record_type, _ in record_headers(records)]
+
+        # Right after continue_as_new (or if removing the old records was interrupted),
+        #  the continue record is the last record apart from configurations
+        position = len(types) - 1
+        while position >= 0 and types[position] == 'configuration':
+            position -= 1
+        if position >= 0 and types[position] == 'continue':
+            continuation = records[position]
+            stale = [records[i] for i in range(position) if types[i] != 'configuration']
+            if stale:
+                remove_many(self._history, stale)
+            return continuation
+
+        # Otherwise only configuration records precede it
+        position = 0
+        while position < len(types) and types[position] == 'configuration':
+            position += 1
+        if position < len(types) and types[position] == 'continue':
+            return records[position]
+        return None
+
     def _clear_history(self, task):
         if self._workflow_completed:
             self._history.clear()
 
     def run(self, *args, **kwargs):
         self._replay_started.clear()
-        task = asyncio.create_task(self._run(*args, **kwargs), name=self.workflow_id)
+        self._suspending = False
+        task = self._run_task = asyncio.create_task(self._run(*args, **kwargs), name=self.workflow_id)
         task.add_done_callback(self._clear_history)
         return task
 
@@ -936,10 +1270,12 @@ class Historian:
         self._configurations.append((config_function, list(args), kwargs))
 
     def _add_new_configurations(self):
+        # Only the configuration records are read
+        records = snapshot(self._history)
         config_records = [
-            record
-            for record in self._history
-            if record['type'] == 'configuration'
+            records[position]
+            for position, (record_type, _) in enumerate(record_headers(records))
+            if record_type == 'configuration'
         ]
 
         # We should have a configuration to replay for each record in the past
@@ -954,7 +1290,7 @@ class Historian:
         for config_function, args, kwargs in self._configurations[len(config_records):]:
             quest_logger.debug(f'Adding new configuration: {get_function_name(config_function)}(*{args}, **{kwargs}')
 
-            self._history.append(ConfigurationRecord(
+            self._add_record(ConfigurationRecord(
                 type='configuration',
                 timestamp=_get_current_timestamp(),
                 step_id='configuration',
@@ -968,6 +1304,7 @@ class Historian:
         quest_logger.debug(f'-- Suspending {self.workflow_id} --')
 
         self._resource_stream_manager.notify_of_workflow_stop()
+        self._suspending = True
 
         # Cancelling these in reverse order is important
         # If a parent thread cancels, it will cancel a child.
@@ -990,33 +1327,92 @@ class Historian:
             except asyncio.CancelledError:
                 quest_logger.debug(f'Task {task.get_name()} was cancelled')
                 pass
+            except ContinueAsNew:
+                quest_logger.debug(f'Task {task.get_name()} continued as new')
 
-    async def get_resources(self, identity):
-        # Wait until the replay is done.
-        # This ensures that all pre-existing resources have been rebuilt.
+        # A workflow that continued as new as it was suspended records the continuation first
+        if self._run_task is not None and self._run_task is not asyncio.current_task():
+            await asyncio.wait([self._run_task])
+
+        await self._commit_history(immediate=True)
+
+    async def _load_history(self):
+        # Histories over async storage read their records before the replay (see AsyncPersistentHistory)
+        if (load := getattr(self._history, 'load', None)) is not None:
+            await load()
+
+    async def _commit_history(self, immediate=False):
+        # Histories with a group committer buffer their writes (see group_commit.py)
+        if (commit := getattr(self._history, 'commit', None)) is not None:
+            await commit(immediate)
+
+    async def wait_for_replay(self):
+        """Wait until the replay is done, i.e. all pre-existing resources have been rebuilt"""
         await self._replay_started.wait()
         await self._replay_complete()
 
+    def idle_time(self) -> float:
+        """
+        Seconds since the workflow last recorded anything.
+        A workflow that is still replaying or has open resource streams is never idle.
+        """
+        if self._replay_cursor < len(self._existing_history) or self._resource_stream_manager.has_streams():
+            return 0
+        return time.monotonic() - self._last_activity
+
+    async def wait_until(self, deadline: datetime):
+        """Wait for a (UTC) deadline, which the manager can see through get_next_timer"""
+        self._timers[timer := object()] = deadline
+        try:
+            await asyncio.sleep(max(0.0, (deadline - datetime.utcnow()).total_seconds()))
+        finally:
+            del self._timers[timer]
+
+    def get_next_timer(self) -> datetime | None:
+        """The earliest deadline the workflow is waiting on, if any"""
+        return min(self._timers.values(), default=None)
+
+    def get_resource_entries(self) -> list[tuple[str, str | None, str]]:
+        """The name, identity and type of every resource of the workflow"""
+        return [(entry['name'], entry['identity'], entry['type']) for entry in self._resources.values()]
+
+    async def _wait_for_resources(self):
+        # Wait until the replay is done.
+        # This ensures that all pre-existing resources have been rebuilt.
+        await self.wait_for_replay()
+
         # If the application has failed, let the caller know
         if self._fatal_exception.done():
             await self._fatal_exception
 
+    async def get_resources(self, identity):
+        await self._wait_for_resources()
+
         resources: dict[(str, str), str] = {}  # dict[(name, identity), type]
-        for entry in self._resources.values():
-            # Always return public resources and private resources for the specified identity
-            if entry['identity'] is None or entry['identity'] == identity:
+        # Always return public resources and private resources for the specified identity
+        identities = [None] if identity is None else [None, identity]
+        for resource_identity in identities:
+            for entry in self._identity_resources.get(resource_identity, {}).values():
                 resources[(entry['name'], entry['identity'])] = entry['type']
 
         return resources
 
-    def get_resource_stream(self, identity):
+    async def has_resource(self, name, identity) -> bool:
+        """Whether get_resources(identity) would include (name, identity), without building it"""
+        await self._wait_for_resources()
+        return _create_resource_id(name, identity) in self._resources
+
+    def get_resource_stream(self, identity, buffer_size=0, overflow='block'):
+        """See ResourceStreamManager for the overflow policies"""
         return self._resource_stream_manager.get_resource_stream(
             identity,
             lambda: self.get_resources(identity),
+            buffer_size,
+            overflow
         )
 
-    async def _update_resource_stream(self, identity):
-        await self._resource_stream_manager.update(identity)
+    async def _update_resource_stream(self, identity, added=None, removed=None):
+        await self._resource_stream_manager.update(identity, added, removed)
 
 
 class HistorianNotFoundException(Exception):
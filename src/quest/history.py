@@ -1,4 +1,4 @@
-from typing import Protocol, Reversible
+from typing import Iterable, Protocol, Reversible, Sequence
 from .quest_types import EventRecord
 
 
@@ -7,8 +7,55 @@ class History(Protocol, Reversible):
 
     def remove(self, item: EventRecord): ...
 
+    def remove_many(self, items: Iterable[EventRecord]):
+        """
+        Remove several records at once.
+        Histories can store the removal as one change (see PersistentHistory);
+        by default the records are removed one at a time.
+        """
+        for item in items:
+            self.remove(item)
+
     def clear(self): ...
 
     def __iter__(self): ...
 
     def __reversed__(self): ...
+
+
+def snapshot(history: History) -> Sequence[EventRecord]:
+    """
+    The records currently in the history, unaffected by later appends and removals.
+    Histories can provide a `snapshot()` method that avoids copying every record into memory
+    (see PersistentHistory); otherwise the records are copied into a list.
+    """
+    if (take_snapshot := getattr(history, 'snapshot', None)) is not None:
+        return take_snapshot()
+    return list(history)
+
+
+def record_headers(records: Sequence[EventRecord]) -> list[tuple[str, str]]:
+    """
+    The type and task ID of each record of a snapshot, by position.
+    Snapshots can provide a `headers()` method that answers without reading the records
+    (see PersistentHistory, which keeps them in its key index); otherwise every record is read.
+    Records removed since the snapshot was taken (None) have a header of (None, None).
+    """
+    if (get_headers := getattr(records, 'headers', None)) is not None and (headers := get_headers()) is not None:
+        return headers
+    return [
+        (None, None) if record is None else (record['type'], record['task_id'])
+        for record in (records[i] for i in range(len(records)))
+    ]
+
+
+def remove_many(history: History, items: Iterable[EventRecord]):
+    """
+    Remove several records at once (see History.remove_many).
+    Plain lists, which can stand in for a history, remove them one at a time.
+    """
+    if isinstance(history, list):
+        for item in items:
+            history.remove(item)
+    else:
+        history.remove_many(items)
@@ -0,0 +1,154 @@
+# Workflow ownership across several managers sharing the same storage
+#
+# Each workflow has a lease in a shared LeaseStore. Only the manager that holds
+# a workflow's lease runs it. The lease also holds the workflow's WorkflowData,
+# so the lease store is the cluster's list of workflows.
+#
+# A lease has an owner, an expiry time and a fencing token. The token goes up
+# every time the lease changes hands. Renewing, releasing and deleting a lease
+# only succeed with the current token, so a manager that lost a lease (e.g. it
+# stalled past the expiry and a peer took over) cannot touch it any more.
+# A manager stops its workflows a safety margin before its leases can expire
+# without a renewal, so they are stopped before a peer can claim them.
+# Until then it writes their histories without asking the store: it only
+# checks that it still had the lease at the last renewal and that the
+# margin has not been reached (so a busy store never blocks the writes).
+#
+# Managers announce themselves with heartbeats. Each one aims to own its fair
+# share of the workflows (total / live managers, rounded up): it claims
+# unowned or expired leases while under its share and releases workflows
+# while over it, so managers can join and leave without stopping the cluster.
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Protocol, TypedDict, Any
+
+
+class Lease(TypedDict):
+    key: str
+    owner: str | None  # None once released
+    token: int  # fencing token
+    expires: float  # time.time() when the lease lapses
+    data: Any
+
+
+class LeaseStore(Protocol):
+    def create(self, key: str, owner: str, duration: float, data: Any) -> Lease | None:
+        """Create a lease owned by `owner`, or return None if the key already exists"""
+
+    def acquire(self, key: str, owner: str, duration: float) -> Lease | None:
+        """Take over a lease that is released or expired (or already ours); None if it is held by someone else"""
+
+    def renew(self, owner: str, tokens: dict[str, int], duration: float) -> set[str]:
+        """Extend the leases (key -> token) and return the keys that are still ours"""
+
+    def release(self, key: str, owner: str, token: int) -> bool: ...
+
+    def delete(self, key: str, owner: str, token: int) -> bool: ...
+
+    def get_leases(self) -> list[Lease]: ...
+
+    def heartbeat(self, owner: str, duration: float):
+        """Announce that `owner` is alive for the next `duration` seconds"""
+
+    def leave(self, owner: str): ...
+
+    def get_members(self) -> list[str]:
+        """The owners with a current heartbeat"""
+
+
+class SqliteLeaseStore:
+    """
+    LeaseStore in a SQLite database.
+    Every operation is one transaction, so managers in several processes can share the database file.
+    """
+
+    def __init__(self, path: Path | str):
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS leases ('
+                           'key TEXT PRIMARY KEY, owner TEXT, token INTEGER NOT NULL, '
+                           'expires REAL NOT NULL, data TEXT NOT NULL)')
+            cursor.execute('CREATE TABLE IF NOT EXISTS members (owner TEXT PRIMARY KEY, expires REAL NOT NULL)')
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    @staticmethod
+    def _get(cursor, key: str) -> Lease | None:
+        row = cursor.execute('SELECT key, owner, token, expires, data FROM leases WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return Lease(key=row[0], owner=row[1], token=row[2], expires=row[3], data=json.loads(row[4]))
+
+    def create(self, key: str, owner: str, duration: float, data: Any) -> Lease | None:
+        with self._transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO leases VALUES (?, ?, 1, ?, ?)',
+                           (key, owner, time.time() + duration, json.dumps(data)))
+            return self._get(cursor, key) if cursor.rowcount == 1 else None
+
+    def acquire(self, key: str, owner: str, duration: float) -> Lease | None:
+        now = time.time()
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE leases SET owner = ?, token = token + 1, expires = ? '
+                           'WHERE key = ? AND (owner IS NULL OR owner = ? OR expires < ?)',
+                           (owner, now + duration, key, owner, now))
+            return self._get(cursor, key) if cursor.rowcount == 1 else None
+
+    def renew(self, owner: str, tokens: dict[str, int], duration: float) -> set[str]:
+        expires = time.time() + duration
+        renewed = set()
+        with self._transaction() as cursor:
+            for key, token in tokens.items():
+                cursor.execute('UPDATE leases SET expires = ? WHERE key = ? AND owner = ? AND token = ?',
+                               (expires, key, owner, token))
+                if cursor.rowcount == 1:
+                    renewed.add(key)
+        return renewed
+
+    def release(self, key: str, owner: str, token: int) -> bool:
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE leases SET owner = NULL, expires = 0 WHERE key = ? AND owner = ? AND token = ?',
+                           (key, owner, token))
+            return cursor.rowcount == 1
+
+    def delete(self, key: str, owner: str, token: int) -> bool:
+        with self._transaction() as cursor:
+            cursor.execute('DELETE FROM leases WHERE key = ? AND owner = ? AND token = ?', (key, owner, token))
+            return cursor.rowcount == 1
+
+    def get_leases(self) -> list[Lease]:
+        with self._transaction() as cursor:
+            rows = cursor.execute('SELECT key, owner, token, expires, data FROM leases ORDER BY key').fetchall()
+        return [Lease(key=key, owner=owner, token=token, expires=expires, data=json.loads(data))
+                for key, owner, token, expires, data in rows]
+
+    def heartbeat(self, owner: str, duration: float):
+        with self._transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO members VALUES (?, ?)', (owner, time.time() + duration))
+
+    def leave(self, owner: str):
+        with self._transaction() as cursor:
+            cursor.execute('DELETE FROM members WHERE owner = ?', (owner,))
+
+    def get_members(self) -> list[str]:
+        with self._transaction() as cursor:
+            rows = cursor.execute('SELECT owner FROM members WHERE expires >= ? ORDER BY owner',
+                                  (time.time(),)).fetchall()
+        return [owner for owner, in rows]
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,298 @@
+# Append-only, segmented log storage for event histories
+#
+# PersistentHistory stores one blob per record plus an index blob that is
+# rewritten on every change, so a history of N records costs O(N^2) bytes
+# written over its life. SegmentedLogHistory appends each change as one line
+# to the active segment file instead:
+#
+#   <folder>/manifest.json   {"version": 1, "segments": ["00000000.log", ...]}
+#   <folder>/00000000.log    one JSON object per line
+#
+# Lines are either {"seq": ..., "record": {...}} (append)
+#  or {"seq": ..., "removed": true} (tombstone),
+#  where seq is the sequence number the history gave the record (also `record['seq']`).
+#
+# The manifest only changes when a segment is rolled or the log is compacted,
+# so an append costs O(record). Recovery replays the segments in order.
+import json
+import os
+from pathlib import Path
+from typing import Callable, Iterable
+
+from .group_commit import GroupCommitter
+from .history import History
+from .persistence import BlobStorage, PersistentHistory
+from .quest_types import EventRecord
+from .utils import quest_logger, sync_folder
+
+MANIFEST = 'manifest.json'
+LOG_VERSION = 1
+
+
+def _segment_name(number: int) -> str:
+    return f'{number:08d}.log'
+
+
+class SegmentedLogHistory(History):
+    def __init__(self, folder: Path, segment_size: int = 4096, compact_ratio: float = 1.0,
+                 committer: GroupCommitter = None):
+        """
+        :param folder: Folder that holds the manifest and segment files of this history.
+        :param segment_size: Number of lines written to a segment before a new one is started.
+        :param compact_ratio: The log is compacted when dead lines (removed records and tombstones)
+            outnumber live records by this ratio (and there is at least one full segment of dead lines).
+        :param committer: If given, lines are buffered and written (and synced) by the committer in batches.
+        """
+        folder.mkdir(parents=True, exist_ok=True)
+        self._folder = folder
+        self._segment_size = segment_size
+        self._compact_ratio = compact_ratio
+
+        self._items: dict[int, EventRecord] = {}  # by sequence number, in history order
+        self._next_seq = 0
+        self._segments: list[str] = []
+        self._active_lines = 0  # lines in the active (last) segment
+        self._dead_lines = 0
+
+        self._committer = committer
+        self._pending_lines: list[dict] = []
+        self._unsynced_segments: set[str] = set()
+        self._fence: Callable[[], None] | None = None
+
+        if (folder / MANIFEST).exists():
+            self._recover()
+
+    # Recovery
+
+    def _recover(self):
+        manifest = json.loads((self._folder / MANIFEST).read_text())
+        self._segments = manifest['segments']
+
+        total_lines = 0
+        for segment in self._segments:
+            self._active_lines = 0
+            for entry in self._read_segment(segment):
+                self._active_lines += 1
+                self._next_seq = max(self._next_seq, entry['seq'] + 1)
+                if entry.get('removed'):
+                    self._items.pop(entry['seq'], None)
+                else:
+                    self._items[entry['seq']] = entry['record']
+            total_lines += self._active_lines
+
+        self._dead_lines = total_lines - len(self._items)
+
+    def _read_segment(self, segment: str):
+        path = self._folder / segment
+        if not path.exists():
+            return
+        with path.open('rb') as file:
+            offset = 0  # The end of the last complete line
+            for line in file:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('Missing end of line')
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn write at the tail of the log (e.g. a crash mid-append).
+                    #  It is cut off, so the next append does not land after it
+                    quest_logger.warning(f'Dropping incomplete entry at the end of {path}')
+                    break
+                offset += len(line)
+                yield entry
+            else:
+                return
+        os.truncate(path, offset)
+
+    # Writing
+
+    def _write_manifest(self, sync: bool = False):
+        tmp = self._folder / (MANIFEST + '.tmp')
+        with tmp.open('w') as file:
+            file.write(json.dumps({'version': LOG_VERSION, 'segments': self._segments}))
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp, self._folder / MANIFEST)
+        if sync:
+            # The rename (and the files the manifest lists) only survive a power loss once the folder is synced
+            sync_folder(self._folder)
+
+    def _roll_segment(self, sync: bool = False):
+        number = int(self._segments[-1].split('.')[0]) + 1 if self._segments else 0
+        self._segments.append(_segment_name(number))
+        self._active_lines = 0
+        self._write_manifest(sync)
+
+    def _write_lines(self, entries: list[dict], sync: bool = False):
+        while entries:
+            if not self._segments or self._active_lines >= self._segment_size:
+                self._roll_segment(sync)
+
+            count = self._segment_size - self._active_lines
+            with (self._folder / self._segments[-1]).open('a') as file:
+                file.write(''.join(json.dumps(entry) + '\n' for entry in entries[:count]))
+                if sync:
+                    file.flush()
+                    os.fsync(file.fileno())
+                else:
+                    self._unsynced_segments.add(self._segments[-1])
+
+            self._active_lines += len(entries[:count])
+            entries = entries[count:]
+
+        if sync:
+            # Lines written without a sync before (see GroupCommitter's 'interval' policy)
+            for segment in self._unsynced_segments:
+                path = self._folder / segment
+                if path.exists():
+                    with path.open('rb') as file:
+                        os.fsync(file.fileno())
+            self._unsynced_segments.clear()
+
+    def _add_lines(self, entries: list[dict]):
+        if self._committer is None:
+            self._write_lines(entries)
+        else:
+            self._pending_lines.extend(entries)
+            self._committer.schedule(self)
+
+    def set_fence(self, fence: Callable[[], None]):
+        """`fence` is called before buffered lines are written, and raises if they must not be (see _FencedHistory)"""
+        self._fence = fence
+
+    def can_sync(self) -> bool:
+        return True
+
+    def write_pending(self, sync: bool) -> int:
+        if self._pending_lines and self._fence is not None:
+            try:
+                self._fence()
+            except Exception:
+                # The lines are never to be written
+                self._pending_lines = []
+                raise
+        lines, self._pending_lines = self._pending_lines, []
+        try:
+            self._write_lines(lines, sync)
+        except BaseException:
+            # Keep the lines for the committer's retry. Some may have been written, maybe torn,
+            #  so the retry starts a new segment; a line written twice replays the same record.
+            self._pending_lines = lines + self._pending_lines
+            self._active_lines = self._segment_size
+            raise
+        return len(lines)
+
+    async def commit(self, immediate: bool = False):
+        if self._committer is not None:
+            await self._committer.commit(self, immediate)
+
+    def append(self, item: EventRecord):
+        item['seq'] = seq = self._next_seq
+        self._next_seq += 1
+        self._items[seq] = item
+        self._add_lines([{'seq': seq, 'record': item}])
+
+    def remove(self, item: EventRecord):
+        self.remove_many([item])
+
+    def remove_many(self, items: Iterable[EventRecord]):
+        """Write the tombstones of all the records in one append"""
+        tombstones = []
+        for item in items:
+            seq = item['seq']
+            del self._items[seq]
+            tombstones.append({'seq': seq, 'removed': True})
+        if not tombstones:
+            return
+        self._add_lines(tombstones)
+        self._dead_lines += 2 * len(tombstones)  # the records and their tombstones
+        self._maybe_compact()
+
+    def clear(self):
+        if self._committer is not None:
+            self._committer.discard(self)
+        self._pending_lines = []
+        self._unsynced_segments.clear()
+        for segment in self._segments:
+            (self._folder / segment).unlink(missing_ok=True)
+        (self._folder / MANIFEST).unlink(missing_ok=True)
+        self._items.clear()
+        self._segments = []
+        self._active_lines = 0
+        self._dead_lines = 0
+
+    # Compaction
+
+    def _maybe_compact(self):
+        if self._dead_lines >= self._segment_size and self._dead_lines > self._compact_ratio * len(self._items):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the live records into fresh segments and drop the old ones.
+        The manifest swap is atomic, so a crash leaves either the old or the new log.
+        """
+        old_segments = self._segments
+        self._pending_lines = []  # every live record is rewritten below
+        number = int(old_segments[-1].split('.')[0]) + 1 if old_segments else 0
+
+        new_segments = []
+        entries = [{'seq': seq, 'record': record} for seq, record in self._items.items()]
+        for start in range(0, max(len(entries), 1), self._segment_size):
+            segment = _segment_name(number)
+            number += 1
+            with (self._folder / segment).open('w') as file:
+                file.write(''.join(json.dumps(entry) + '\n' for entry in entries[start:start + self._segment_size]))
+                file.flush()
+                os.fsync(file.fileno())
+            new_segments.append(segment)
+
+        # The new log is durable before the old one is deleted
+        self._segments = new_segments
+        self._write_manifest(sync=True)
+
+        for segment in old_segments:
+            (self._folder / segment).unlink(missing_ok=True)
+
+        self._active_lines = len(entries) - (len(new_segments) - 1) * self._segment_size
+        self._dead_lines = 0
+        quest_logger.debug(f'Compacted {self._folder} to {len(self._items)} records')
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __reversed__(self):
+        return reversed(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+
+def migrate_persistent_history(namespace: str, storage: BlobStorage, folder: Path, **kwargs) -> SegmentedLogHistory:
+    """
+    Move a history stored in the PersistentHistory layout
+    (an index blob at `namespace` plus one blob per record)
+    into a SegmentedLogHistory at `folder`.
+
+    The log is written completely before the old blobs are deleted,
+    so running the migration again after a crash finishes the cleanup.
+    """
+    already_migrated = (folder / MANIFEST).exists()
+    history = SegmentedLogHistory(folder, **kwargs)
+
+    old = PersistentHistory(namespace, storage)
+    if not already_migrated and len(old):
+        # Records keep their sequence numbers
+        for record in old:
+            history._items[record['seq']] = record
+        history._next_seq = old._next_seq
+        # compact() writes the segments before the manifest
+        history.compact()
+
+    # delete_blobs tolerates blobs already deleted by an interrupted migration
+    storage.delete_blobs(old._keys.values())
+    if storage.has_blob(namespace):
+        storage.delete_blob(namespace)
+
+    return history
@@ -1,16 +1,23 @@
 import asyncio
+import heapq
+import math
+import os
 import signal
+import socket
+import time
 from contextvars import ContextVar
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
-from typing import Protocol, Callable, TypeVar, Any, TypedDict
+from typing import Protocol, Callable, TypeVar, Any, TypedDict, NotRequired
 
 from .external import State, IdentityQueue, Queue, Event
 from .historian import Historian, _Wrapper, SUSPENDED
 from .history import History
-from .persistence import BlobStorage
+from .leases import LeaseStore
+from .persistence import BlobStorage, AsyncBlobStorage
+from .rehydration import RehydrationScheduler
 from .serializer import StepSerializer
-from .utils import quest_logger, serialize_exception, deserialize_exception
+from .utils import quest_logger, serialize_exception, deserialize_exception, maybe_await
 
 
 class WorkflowNotFound(Exception):
@@ -51,16 +58,117 @@ class WorkflowData(TypedDict):
     workflow_kwargs: dict
     delete_on_finish: bool
     start_time: str
+    last_active: NotRequired[str]  # when the workflow last recorded something before the manager exited
+
+
+class LeaseLostException(Exception):
+    pass
+
+
+class _FencedHistory(History):
+    """
+    The history of a leased workflow, written only while the manager holds the workflow's lease
+     (see WorkflowManager._holds_lease).
+    Changes are checked when they are made, which suspends the workflow if the lease is gone.
+    Histories that write their changes later (e.g. with a GroupCommitter) are given the check as their fence,
+     so a change is checked again when it is written, and dropped instead if the lease was lost in between.
+    """
+
+    def __init__(self, history: History, holds_lease: Callable[[], bool], on_lost: Callable[[], None]):
+        self._history = history
+        self._holds_lease = holds_lease
+        self._on_lost = on_lost
+        if (set_fence := getattr(history, 'set_fence', None)) is not None:
+            set_fence(self._check_write)
+
+    def _check_write(self):
+        if not self._holds_lease():
+            self._on_lost()
+            raise LeaseLostException('The lease of the workflow was lost before its history was written')
+
+    def _fence(self):
+        if not self._holds_lease():
+            self._on_lost()
+            raise asyncio.CancelledError(SUSPENDED)
+
+    def append(self, item):
+        self._fence()
+        self._history.append(item)
+
+    def remove(self, item):
+        self._fence()
+        self._history.remove(item)
+
+    def remove_many(self, items):
+        self._fence()
+        self._history.remove_many(items)
+
+    def clear(self):
+        self._fence()
+        self._history.clear()
+
+    def __iter__(self):
+        return iter(self._history)
+
+    def __reversed__(self):
+        return reversed(self._history)
+
+    def __len__(self):
+        return len(self._history)
+
+    def __getattr__(self, name):
+        # The optional hooks of the history (snapshot, get_record, load, commit...)
+        return getattr(self._history, name)
+
+
+class HibernatedWorkflow(TypedDict):
+    resources: list[tuple[str, str | None, str]]  # name, identity, type
+    aliases: list[str]
 
 
 class WorkflowManager:
     """
     Runs workflow tasks
     It remembers which tasks are still active and resumes them on replay
+
+    With `hibernate_after` (seconds), a workflow that has recorded nothing
+     (and has not been accessed through the manager) for that long is suspended and dropped from memory.
+    Only its resources and aliases are kept (and persisted on exit),
+     so has_workflow and get_resources still answer without loading it.
+    Anything else that needs the workflow (send_event, get_resource_stream, get_workflow_result...)
+     replays it first.
+
+    With `rehydrate_concurrency`, the workflows are rehydrated in the background when the manager starts,
+     most recently active first, with at most that many replaying at once (see RehydrationScheduler).
+    __aenter__ returns right away; see wait_for_rehydration and get_rehydration_metrics.
+    A workflow that is needed before its turn is started right away.
+
+    With `lazy`, __aenter__ only loads the list of workflows, and a workflow is only replayed
+     the first time something needs it (send_event, get_resources, get_resource_stream, get_workflow_result...).
+    Workflows that were making progress on their own are not resumed until then.
+
+    With `leases`, several managers (e.g. on different hosts) share the workflows in the same storage.
+    The workflows and their ownership are kept in the lease store instead of the namespace blob,
+     and this manager (named `owner`) only runs the workflows it holds the lease of (see leases.py).
+    Leases last `lease_duration` seconds and are renewed a few times per duration.
+    If the renewals fail (or hang), the manager stops its workflows `lease_margin` seconds
+     (by default a quarter of the duration) before its leases can expire.
+    Each write to the history of a workflow checks that the manager still holds its lease
+     (as of the last renewal, and before the deadline), and a write with a lost lease suspends the workflow.
+    Each manager claims its share of the workflows, including those of managers that died,
+     and hands workflows over to managers that join.
+    Results of finished workflows stay with the manager that ran them.
+
+    Workflows that wait on a timer (see timers.py) while they are not in memory
+     (hibernated, or not yet rehydrated) are woken when the timer's deadline comes.
+    The deadlines are persisted with the manager, so this also holds across restarts.
     """
 
-    def __init__(self, namespace: str, storage: BlobStorage, create_history: HistoryFactory,
-                 create_workflow: WorkflowFactory, serializer: StepSerializer):
+    def __init__(self, namespace: str, storage: BlobStorage | AsyncBlobStorage, create_history: HistoryFactory,
+                 create_workflow: WorkflowFactory, serializer: StepSerializer, hibernate_after: float = None,
+                 rehydrate_concurrency: int = None, lazy: bool = False,
+                 leases: LeaseStore = None, owner: str = None, lease_duration: float = 30,
+                 lease_margin: float = None):
         self._namespace = namespace
         self._storage = storage
         self._create_history = create_history
@@ -69,9 +177,37 @@ class WorkflowManager:
         self._workflows: dict[str, Historian] = {}
         self._workflow_tasks: dict[str, asyncio.Task] = {}
         self._alias_dictionary = {}
+        self._alias_listeners: list[Callable[[str, str | None], None]] = []
         self._serializer: StepSerializer = serializer
         self._results: dict[str, WorkflowResult] = {}
 
+        self._hibernate_after = hibernate_after
+        self._hibernated: dict[str, HibernatedWorkflow] = {}
+        self._hibernating: dict[str, asyncio.Future] = {}  # workflows being suspended for hibernation
+        self._last_access: dict[str, float] = {}
+        self._hibernation_task: asyncio.Task | None = None
+
+        self._rehydrate_concurrency = rehydrate_concurrency
+        self._lazy = lazy
+        self._rehydration: RehydrationScheduler | None = None
+
+        # The timer deadlines of workflows that are not in memory, with a heap of (deadline, wid) to find the next
+        # (entries that no longer match _timers are skipped)
+        self._timers: dict[str, datetime] = {}
+        self._timer_heap: list[tuple[datetime, str]] = []
+        self._timers_changed = asyncio.Event()
+        self._timer_task: asyncio.Task | None = None
+
+        self._leases = leases
+        self._owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self._lease_duration = lease_duration
+        self._lease_margin = lease_margin if lease_margin is not None else lease_duration / 4
+        self._lease_tokens: dict[str, int] = {}  # the fencing token of each lease we hold
+        self._lease_deadline = 0.0  # (monotonic) when our leases expire without a renewal
+        self._lease_renewed = asyncio.Event()
+        self._lease_task: asyncio.Task | None = None
+        self._lease_watch_task: asyncio.Task | None = None
+
     async def __aenter__(self) -> 'WorkflowManager':
         """Load the workflows and get them running again"""
 
@@ -82,30 +218,92 @@ class WorkflowManager:
         # TODO - add cancel api - get cancel from historian api
         signal.signal(signal.SIGINT, our_handler)
 
-        if self._storage.has_blob(self._namespace):
-            self._workflow_data = self._storage.read_blob(self._namespace)
+        if self._leases is not None:
+            self._lease_deadline = time.monotonic() + self._lease_duration
+            self._leases.heartbeat(self._owner, self._lease_duration)
+            self._claim_workflows()
+        elif await maybe_await(self._storage.has_blob(self._namespace)):
+            self._workflow_data = await maybe_await(self._storage.read_blob(self._namespace))
 
         # Check storage to load stored workflow results from persistent storage
-        if self._storage.has_blob(f'{self._namespace}_results'):
-            self._results = self._storage.read_blob(f'{self._namespace}_results')
+        if await maybe_await(self._storage.has_blob(f'{self._namespace}_results')):
+            self._results = await maybe_await(self._storage.read_blob(f'{self._namespace}_results'))
+
+        if await maybe_await(self._storage.has_blob(f'{self._namespace}_hibernated')):
+            hibernated = await maybe_await(self._storage.read_blob(f'{self._namespace}_hibernated'))
+            self._hibernated = {wid: entry for wid, entry in hibernated.items() if wid in self._workflow_data}
+            for wid, entry in self._hibernated.items():
+                for alias in entry['aliases']:
+                    self._set_alias(alias, wid)
+
+        # Rehydrate workflows (hibernated workflows stay asleep until they are needed)
+        to_rehydrate = [wid for wid in self._workflow_data if wid not in self._hibernated]
+        if self._rehydrate_concurrency is None and not self._lazy:
+            for wid in to_rehydrate:
+                self._start_workflow_from_data(wid)
+        else:
+            to_rehydrate.sort(key=self._get_last_active, reverse=True)
+            self._rehydration = RehydrationScheduler(self._rehydrate_workflow, self._rehydrate_concurrency or 1)
+            self._rehydration.schedule(to_rehydrate, background=not self._lazy)
 
-        # Rehydrate workflows
-        for wid, data in self._workflow_data.items():
-            wtype = data["workflow_type"]
-            args = data["workflow_args"]
-            kwargs = data["workflow_kwargs"]
-            delete_on_finish = data["delete_on_finish"]
-            self._start_workflow(wtype, wid, args, kwargs, delete_on_finish=delete_on_finish)
+        if self._leases is None and await maybe_await(self._storage.has_blob(f'{self._namespace}_timers')):
+            # Workflows that are running again wait on their own timers
+            timers = await maybe_await(self._storage.read_blob(f'{self._namespace}_timers'))
+            for wid, deadline in timers.items():
+                if wid in self._workflow_data and self._is_asleep(wid):
+                    self._add_timer(wid, datetime.fromisoformat(deadline))
+
+        if self._hibernate_after is not None:
+            self._hibernation_task = asyncio.create_task(self._hibernate_idle_workflows())
+
+        if self._leases is not None:
+            self._lease_task = asyncio.create_task(self._maintain_leases())
+            self._lease_watch_task = asyncio.create_task(self._watch_lease_deadline())
+
+        self._timer_task = asyncio.create_task(self._run_timers())
 
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Save whatever state is necessary before exiting"""
-        for wid, historian in self._workflows.items():
+        if self._rehydration is not None:
+            await self._rehydration.stop()
+
+        for background_task in [self._hibernation_task, self._lease_task, self._lease_watch_task, self._timer_task]:
+            if background_task is not None:
+                background_task.cancel()
+                try:
+                    await background_task
+                except asyncio.CancelledError:
+                    pass
+
+        # Workflows may finish (and remove themselves) while we await
+        for wid, historian in list(self._workflows.items()):
+            self._timers.pop(wid, None)
+            if (deadline := historian.get_next_timer()) is not None:
+                self._add_timer(wid, deadline)
             await historian.suspend()
+            if wid in self._workflow_data:
+                last_active = datetime.utcnow() - timedelta(seconds=historian.idle_time())
+                self._workflow_data[wid]['last_active'] = last_active.isoformat()
 
-        self._storage.write_blob(self._namespace, self._workflow_data)
-        self._storage.write_blob(f'{self._namespace}_results', self._results)
+        if self._leases is None:
+            await maybe_await(self._storage.write_blob(self._namespace, self._workflow_data))
+        else:
+            # Hand our workflows over to the other managers right away
+            for wid, token in self._lease_tokens.items():
+                self._leases.release(wid, self._owner, token)
+            self._lease_tokens.clear()
+            self._leases.leave(self._owner)
+
+        await maybe_await(self._storage.write_blob(f'{self._namespace}_results', self._results))
+        if self._leases is None and (self._hibernate_after is not None or self._hibernated):
+            await maybe_await(self._storage.write_blob(f'{self._namespace}_hibernated', self._hibernated))
+        if self._leases is None and self._timers:
+            timers = {wid: deadline.isoformat() for wid, deadline in self._timers.items() if wid in self._workflow_data}
+            await maybe_await(self._storage.write_blob(f'{self._namespace}_timers', timers))
+        elif await maybe_await(self._storage.has_blob(f'{self._namespace}_timers')):
+            await maybe_await(self._storage.delete_blob(f'{self._namespace}_timers'))
 
         self._workflows.clear()
         self._workflow_tasks.clear()
@@ -118,8 +316,251 @@ class WorkflowManager:
     # TODO: Do a key check to see if workflow_id exists. If not return a WorkflowDoesNotExistException
     def _get_workflow(self, workflow_id: str):
         workflow_id = self._alias_dictionary.get(workflow_id, workflow_id)
+        self._last_access[workflow_id] = time.monotonic()
+        if self._is_asleep(workflow_id):
+            self._wake_workflow(workflow_id)
         return self._workflows[workflow_id]
 
+    def _is_asleep(self, workflow_id: str) -> bool:
+        """The workflow exists but is not loaded: it is hibernated or still waiting to be rehydrated"""
+        return workflow_id in self._hibernated or \
+            (self._rehydration is not None and self._rehydration.is_queued(workflow_id))
+
+    async def _get_awake_workflow(self, workflow_id: str) -> Historian:
+        """Like _get_workflow, but waits for a workflow that is being hibernated or woken up"""
+        workflow_id = self._alias_dictionary.get(workflow_id, workflow_id)
+        if (hibernating := self._hibernating.get(workflow_id)) is not None:
+            await hibernating
+
+        woken = self._is_asleep(workflow_id)
+        historian = self._get_workflow(workflow_id)
+        if woken:
+            await historian.wait_for_replay()
+        return historian
+
+    def _wake_workflow(self, workflow_id: str):
+        quest_logger.debug(f'Waking {workflow_id}')
+        self._timers.pop(workflow_id, None)  # The workflow waits on its own timers while it runs
+        if workflow_id in self._hibernated:
+            # The aliases stay registered; the workflow registers them again as it replays
+            del self._hibernated[workflow_id]
+        else:
+            self._rehydration.take(workflow_id)
+        self._start_workflow_from_data(workflow_id)
+
+    def _add_timer(self, workflow_id: str, deadline: datetime):
+        self._timers[workflow_id] = deadline
+        heapq.heappush(self._timer_heap, (deadline, workflow_id))
+        self._timers_changed.set()
+
+    async def _run_timers(self):
+        """Wake sleeping workflows as their deadlines come"""
+        while True:
+            self._timers_changed.clear()
+            while self._timer_heap and self._timers.get(self._timer_heap[0][1]) != self._timer_heap[0][0]:
+                heapq.heappop(self._timer_heap)  # The workflow was woken, or has a new deadline
+
+            if not self._timer_heap:
+                await self._timers_changed.wait()
+                continue
+
+            deadline, wid = self._timer_heap[0]
+            if (delay := (deadline - datetime.utcnow()).total_seconds()) > 0:
+                try:
+                    await asyncio.wait_for(self._timers_changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._timer_heap)
+            del self._timers[wid]
+            if self._is_asleep(wid):
+                quest_logger.debug(f'Timer of {wid} is due')
+                self._wake_workflow(wid)
+
+    def _get_last_active(self, workflow_id: str) -> str:
+        data = self._workflow_data[workflow_id]
+        return data.get('last_active', data['start_time'])
+
+    async def _rehydrate_workflow(self, workflow_id: str):
+        """Start the workflow and wait until it has replayed (or stopped)"""
+        self._start_workflow_from_data(workflow_id)
+        replay = asyncio.create_task(self._workflows[workflow_id].wait_for_replay())
+        try:
+            await asyncio.wait([replay, self._workflow_tasks[workflow_id]], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            replay.cancel()
+
+    async def wait_for_rehydration(self):
+        """Wait until every workflow has been rehydrated (see rehydrate_concurrency; returns right away when lazy)"""
+        if self._rehydration is not None:
+            await self._rehydration.wait()
+
+    def get_rehydration_metrics(self) -> dict | None:
+        """Progress of the rehydration at startup, or None without rehydrate_concurrency or lazy"""
+        if self._rehydration is None:
+            return None
+        return self._rehydration.get_metrics()
+
+    async def _hibernate_idle_workflows(self):
+        while True:
+            await asyncio.sleep(self._hibernate_after / 2)
+            now = time.monotonic()
+            for wid, historian in list(self._workflows.items()):
+                if wid in self._hibernating or self._workflow_tasks[wid].done():
+                    continue
+                if historian.idle_time() < self._hibernate_after:
+                    continue
+                if now - self._last_access.get(wid, 0) < self._hibernate_after:
+                    continue
+                await self._hibernate_workflow(wid)
+
+    async def _hibernate_workflow(self, workflow_id: str):
+        quest_logger.debug(f'Hibernating {workflow_id}')
+        self._hibernating[workflow_id] = hibernated = asyncio.get_running_loop().create_future()
+        try:
+            historian = self._workflows[workflow_id]
+            task = self._workflow_tasks[workflow_id]
+            entry = HibernatedWorkflow(
+                resources=historian.get_resource_entries(),
+                aliases=[alias for alias, wid in self._alias_dictionary.items() if wid == workflow_id]
+            )
+
+            deadline = historian.get_next_timer()
+            await historian.suspend()
+            if not task.cancelled():
+                return  # The workflow finished instead; _store_result cleans up
+
+            if deadline is not None:
+                self._add_timer(workflow_id, deadline)
+
+            # Suspending the workflow deregistered its aliases
+            for alias in entry['aliases']:
+                self._set_alias(alias, workflow_id)
+            self._hibernated[workflow_id] = entry
+            del self._workflows[workflow_id]
+            del self._workflow_tasks[workflow_id]
+            self._last_access.pop(workflow_id, None)
+
+        finally:
+            del self._hibernating[workflow_id]
+            hibernated.set_result(None)
+
+    def _claim_workflows(self) -> list[str]:
+        """Take the leases of unowned or expired workflows until we have our share; return the ones taken"""
+        now = time.time()
+        leases = self._leases.get_leases()
+        members = self._leases.get_members()
+        share = math.ceil(len(leases) / max(len(members), 1))
+
+        claimed = []
+        for lease in leases:
+            if len(self._lease_tokens) >= share:
+                break
+            if lease['key'] in self._lease_tokens:
+                continue
+            if lease['owner'] is not None and lease['owner'] != self._owner and lease['expires'] >= now:
+                continue
+            if (lease := self._leases.acquire(lease['key'], self._owner, self._lease_duration)) is None:
+                continue  # Another manager got it first
+            quest_logger.debug(f'{self._owner} claimed {lease["key"]}')
+            self._lease_tokens[lease['key']] = lease['token']
+            self._workflow_data[lease['key']] = lease['data']
+            claimed.append(lease['key'])
+        return claimed
+
+    async def _maintain_leases(self):
+        while True:
+            await asyncio.sleep(self._lease_duration / 3)
+            # The leases run from when they are renewed, not from when the renewal returns
+            renewing = time.monotonic()
+            tokens = dict(self._lease_tokens)
+            try:
+                # In a thread, so a slow lease store does not hold up the deadline (see _watch_lease_deadline)
+                await asyncio.to_thread(self._leases.heartbeat, self._owner, self._lease_duration)
+                renewed = await asyncio.to_thread(self._leases.renew, self._owner, tokens, self._lease_duration)
+            except Exception as ex:
+                quest_logger.exception(f'{self._owner} could not renew its leases: {ex}')
+                continue
+            self._lease_deadline = renewing + self._lease_duration
+            self._lease_renewed.set()
+
+            for wid in tokens:
+                if wid not in renewed and self._lease_tokens.get(wid) == tokens[wid]:
+                    quest_logger.warning(f'{self._owner} lost the lease of {wid}')
+                    del self._lease_tokens[wid]
+                    await self._drop_workflow(wid)
+
+            for wid in self._claim_workflows():
+                self._start_workflow_from_data(wid)
+
+            # Hand workflows over to managers that have less than their share
+            share = math.ceil(len(self._leases.get_leases()) / max(len(self._leases.get_members()), 1))
+            for wid in list(self._lease_tokens)[share:]:
+                if await self._drop_workflow(wid) and (token := self._lease_tokens.pop(wid, None)) is not None:
+                    self._leases.release(wid, self._owner, token)
+
+    async def _watch_lease_deadline(self):
+        """Stop our workflows a safety margin before our leases expire, however long the renewals take"""
+        while True:
+            if (remaining := self._lease_deadline - self._lease_margin - time.monotonic()) > 0:
+                self._lease_renewed.clear()
+                try:
+                    await asyncio.wait_for(self._lease_renewed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._lease_tokens:
+                quest_logger.warning(f'{self._owner} could not renew its leases in time; stopping its workflows')
+                for wid in list(self._lease_tokens):
+                    if self._lease_tokens.pop(wid, None) is not None:
+                        await self._drop_workflow(wid)
+            # Workflows are claimed again once a renewal goes through
+            self._lease_renewed.clear()
+            await self._lease_renewed.wait()
+
+    def _holds_lease(self, workflow_id: str) -> bool:
+        """
+        Whether this manager may still write the workflow's history (see _FencedHistory).
+        This runs on every write, so it makes no call to the lease store:
+         the token is checked by the renewals, and a manager whose renewals stall stops before the deadline.
+        """
+        return workflow_id in self._lease_tokens and time.monotonic() < self._lease_deadline - self._lease_margin
+
+    def _lose_lease(self, workflow_id: str):
+        if self._lease_tokens.pop(workflow_id, None) is not None:
+            quest_logger.warning(f'{self._owner} lost the lease of {workflow_id}')
+            asyncio.create_task(self._drop_workflow(workflow_id))
+
+    async def _drop_workflow(self, workflow_id: str) -> bool:
+        """Stop running the workflow here (without finishing it) so another manager can run it"""
+        if (hibernating := self._hibernating.get(workflow_id)) is not None:
+            await hibernating
+        if self._rehydration is not None and self._rehydration.is_queued(workflow_id):
+            self._rehydration.take(workflow_id)
+
+        if (historian := self._workflows.get(workflow_id)) is not None:
+            task = self._workflow_tasks[workflow_id]
+            await historian.suspend()
+            if not task.cancelled():
+                return False  # The workflow finished instead; _store_result cleans up
+            del self._workflows[workflow_id]
+            del self._workflow_tasks[workflow_id]
+
+        self._hibernated.pop(workflow_id, None)
+        for alias in [alias for alias, wid in self._alias_dictionary.items() if wid == workflow_id]:
+            self._remove_alias(alias)
+        self._workflow_data.pop(workflow_id, None)
+        self._last_access.pop(workflow_id, None)
+        self._timers.pop(workflow_id, None)
+        return True
+
+    def _start_workflow_from_data(self, workflow_id: str):
+        data = self._workflow_data[workflow_id]
+        self._start_workflow(data['workflow_type'], workflow_id, data['workflow_args'], data['workflow_kwargs'],
+                             delete_on_finish=data['delete_on_finish'])
+
     def _start_workflow(self,
                         workflow_type: str, workflow_id: str, workflow_args, workflow_kwargs,
                         delete_on_finish: bool = True):
@@ -129,6 +570,9 @@ class WorkflowManager:
         workflow_manager.set(self)
 
         history = self._create_history(workflow_id)
+        if self._leases is not None:
+            history = _FencedHistory(history, lambda: self._holds_lease(workflow_id),
+                                     lambda: self._lose_lease(workflow_id))
         historian: Historian = Historian(workflow_id, workflow_function, history, serializer=self._serializer)
         self._workflows[workflow_id] = historian
 
@@ -144,7 +588,9 @@ class WorkflowManager:
         if workflow_id in self._results:
             del self._results[workflow_id]
 
-        elif workflow_id in self._workflows:
+        elif workflow_id in self._workflows or self._is_asleep(workflow_id):
+            # A workflow that is not loaded is woken so it can be cancelled like any other
+            await self._get_awake_workflow(workflow_id)
             task = self._workflow_tasks[workflow_id]
             if not task.done():
                 task.cancel()
@@ -182,47 +628,115 @@ class WorkflowManager:
             )
 
         # Completed workflow
+        if self._leases is not None and (token := self._lease_tokens.pop(workflow_id, None)) is not None:
+            self._leases.delete(workflow_id, self._owner, token)
         del self._workflows[workflow_id]
         del self._workflow_tasks[workflow_id]
         del self._workflow_data[workflow_id]
+        self._last_access.pop(workflow_id, None)
+        self._timers.pop(workflow_id, None)
 
     def start_workflow(self, workflow_type: str, workflow_id: str, *workflow_args, delete_on_finish: bool = True,
                        **workflow_kwargs):
         """Start the workflow, but do not restart previously canceled ones"""
-        start_time = datetime.utcnow().isoformat()
+        data = self._new_workflow_data(workflow_type, workflow_id, workflow_args, workflow_kwargs,
+                                       delete_on_finish, datetime.utcnow().isoformat())
+        self._workflow_data[workflow_id] = data
+        self._start_workflow(workflow_type, workflow_id, workflow_args, workflow_kwargs,
+                             delete_on_finish=delete_on_finish)
 
-        if workflow_id in self._workflow_tasks:
+    async def start_workflows(self, workflows, return_exceptions: bool = False) -> list[Exception | None]:
+        """
+        Start many workflows, each given as (workflow_type, workflow_id, workflow_args, workflow_kwargs),
+         and persist the workflow data once for all of them.
+        If a workflow already exists, DuplicateWorkflowException is raised and none of them are started.
+        With `return_exceptions`, the other workflows are started instead,
+         and the result has the exception of each workflow that was not started (None for the others).
+        """
+        start_time = datetime.utcnow().isoformat()
+        new_workflows = []
+        new_ids = set()
+        exceptions = []
+        for workflow_type, workflow_id, workflow_args, workflow_kwargs in workflows:
+            workflow_kwargs = dict(workflow_kwargs)
+            delete_on_finish = workflow_kwargs.pop('delete_on_finish', True)
+            try:
+                if workflow_id in new_ids:
+                    raise DuplicateWorkflowException(f'Workflow "{workflow_id}" already exists')
+                data = self._new_workflow_data(workflow_type, workflow_id, tuple(workflow_args), workflow_kwargs,
+                                               delete_on_finish, start_time)
+            except DuplicateWorkflowException as ex:
+                if not return_exceptions:
+                    for _, wid, _ in new_workflows:
+                        if (token := self._lease_tokens.pop(wid, None)) is not None:
+                            self._leases.delete(wid, self._owner, token)
+                    raise
+                exceptions.append(ex)
+                continue
+            new_workflows.append((workflow_type, workflow_id, data))
+            new_ids.add(workflow_id)
+            exceptions.append(None)
+
+        for workflow_type, workflow_id, data in new_workflows:
+            self._workflow_data[workflow_id] = data
+            self._start_workflow(workflow_type, workflow_id, data['workflow_args'], data['workflow_kwargs'],
+                                 delete_on_finish=data['delete_on_finish'])
+
+        # With leases, each workflow was persisted with its lease
+        if new_workflows and self._leases is None:
+            await maybe_await(self._storage.write_blob(self._namespace, self._workflow_data))
+        return exceptions
+
+    def _new_workflow_data(self, workflow_type: str, workflow_id: str, workflow_args, workflow_kwargs,
+                           delete_on_finish: bool, start_time: str) -> WorkflowData:
+        """The data of a workflow about to start (leased to this manager, if there are leases)"""
+        if workflow_id in self._workflow_tasks or self._is_asleep(workflow_id):
             raise DuplicateWorkflowException(f'Workflow "{workflow_id}" already exists')
 
-        self._workflow_data[workflow_id] = WorkflowData(
+        data = WorkflowData(
             workflow_type=workflow_type,
             workflow_args=workflow_args,
             workflow_kwargs=workflow_kwargs,
             delete_on_finish=delete_on_finish,
             start_time=start_time
         )
-        self._start_workflow(workflow_type, workflow_id, workflow_args, workflow_kwargs,
-                             delete_on_finish=delete_on_finish)
+        if self._leases is not None:
+            if (lease := self._leases.create(workflow_id, self._owner, self._lease_duration, data)) is None:
+                raise DuplicateWorkflowException(f'Workflow "{workflow_id}" already exists on another manager')
+            self._lease_tokens[workflow_id] = lease['token']
+        return data
 
     def has_workflow(self, workflow_id: str) -> bool:
         workflow_id = self._alias_dictionary.get(workflow_id, workflow_id)
 
-        return workflow_id in self._workflows or workflow_id in self._results
+        return workflow_id in self._workflows or workflow_id in self._results or self._is_asleep(workflow_id)
 
     async def get_resources(self, workflow_id: str, identity):
         if workflow_id in self._results:
             raise NotImplementedError('todo')  # TODO
 
+        workflow_id = self._alias_dictionary.get(workflow_id, workflow_id)
+        if (hibernating := self._hibernating.get(workflow_id)) is not None:
+            await hibernating
+        if (hibernated := self._hibernated.get(workflow_id)) is not None:
+            # Answered from the resource index, without waking the workflow
+            return {
+                (name, resource_identity): resource_type
+                for name, resource_identity, resource_type in hibernated['resources']
+                if resource_identity is None or resource_identity == identity
+            }
+
         return await self._get_workflow(workflow_id).get_resources(identity)
 
-    def get_resource_stream(self, workflow_id: str, identity):
+    def get_resource_stream(self, workflow_id: str, identity, buffer_size=0, overflow='block'):
         if workflow_id in self._results:
             raise NotImplementedError('todo')  # TODO
 
-        return self._get_workflow(workflow_id).get_resource_stream(identity)
+        return self._get_workflow(workflow_id).get_resource_stream(identity, buffer_size, overflow)
 
     async def send_event(self, workflow_id: str, name: str, identity, action, *args, **kwargs):
-        return await self._get_workflow(workflow_id).record_external_event(name, identity, action, *args, **kwargs)
+        historian = await self._get_awake_workflow(workflow_id)
+        return await historian.record_external_event(name, identity, action, *args, **kwargs)
 
     def _make_wrapper_func(self, workflow_id: str, name: str, identity, field, attr):
         # Why have _make_wrapper_func?
@@ -251,8 +765,23 @@ class WorkflowManager:
 
         return dummy
 
+    async def has_resource(self, workflow_id: str, name: str, identity) -> bool:
+        if workflow_id in self._results:
+            return False  # A finished workflow has released all its resources
+
+        workflow_id = self._alias_dictionary.get(workflow_id, workflow_id)
+        if (hibernating := self._hibernating.get(workflow_id)) is not None:
+            await hibernating
+        if (hibernated := self._hibernated.get(workflow_id)) is not None:
+            return any(
+                resource_name == name and resource_identity == identity
+                for resource_name, resource_identity, _ in hibernated['resources']
+            )
+
+        return await self._get_workflow(workflow_id).has_resource(name, identity)
+
     async def _check_resource(self, workflow_id: str, name: str, identity):
-        if (name, identity) not in await self.get_resources(workflow_id, identity):
+        if not await self.has_resource(workflow_id, name, identity):
             raise Exception(f'{name} is not a valid resource for {workflow_id}')
             # TODO - custom exception
 
@@ -273,14 +802,34 @@ class WorkflowManager:
         return self._wrap(IdentityQueue(), workflow_id, name, identity)
 
     async def _register_alias(self, alias: str, workflow_id: str):
-        if alias not in self._alias_dictionary:
-            self._alias_dictionary[alias] = workflow_id
+        # A woken workflow registers the aliases it kept while hibernating again
+        if self._alias_dictionary.get(alias, workflow_id) == workflow_id:
+            self._set_alias(alias, workflow_id)
         else:
             raise DuplicateAliasException(f'Alias "{alias}" already exists')
 
     async def _deregister_alias(self, alias: str):
         if alias in self._alias_dictionary:
-            del self._alias_dictionary[alias]
+            self._remove_alias(alias)
+
+    def _set_alias(self, alias: str, workflow_id: str):
+        self._alias_dictionary[alias] = workflow_id
+        for listener in self._alias_listeners:
+            listener(alias, workflow_id)
+
+    def _remove_alias(self, alias: str):
+        del self._alias_dictionary[alias]
+        for listener in self._alias_listeners:
+            listener(alias, None)
+
+    def watch_aliases(self, listener: Callable[[str, str | None], None]) -> dict[str, str]:
+        """
+        Call `listener(alias, workflow_id)` whenever an alias is registered,
+         and `listener(alias, None)` whenever one is removed.
+        Returns the aliases registered so far (see ShardedWorkflowManager).
+        """
+        self._alias_listeners.append(listener)
+        return dict(self._alias_dictionary)
 
     def get_workflow_metrics(self):
         """Return metrics for active workflows"""
@@ -300,6 +849,9 @@ class WorkflowManager:
         return metrics
 
     async def get_workflow_result(self, workflow_id: str, delete: bool = False):
+        if self._is_asleep(workflow_id) or workflow_id in self._hibernating:
+            await self._get_awake_workflow(workflow_id)
+
         if workflow_id in self._workflow_tasks:
             # The workflow is still running, so return the running
             return await self._workflow_tasks[workflow_id]
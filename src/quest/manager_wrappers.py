@@ -1,5 +1,5 @@
 from .manager import find_workflow_manager
-from .historian import find_historian
+from .historian import find_historian, ContinueAsNew
 
 
 class Alias:
@@ -12,7 +12,10 @@ class Alias:
         await self._manager._register_alias(self._alias, self._workflow_id)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self._manager._deregister_alias(self._alias)
+        # The next run of a workflow that continues as new registers the alias again,
+        #  so it stays in place in between
+        if not isinstance(exc_val, ContinueAsNew):
+            await self._manager._deregister_alias(self._alias)
 
 
 def alias(alias: str) -> Alias:
@@ -1,17 +1,27 @@
 # Enable event histories to be persistent
+import asyncio
 import copy
 import json
-from hashlib import md5
+import os
+from collections import OrderedDict
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Executor, ThreadPoolExecutor
+from weakref import WeakSet
 from pathlib import Path
-from typing import Protocol, Union
+from typing import Callable, Literal, Protocol, Union
 
+from .group_commit import GroupCommitter
 from .history import History
 from .quest_types import EventRecord
+from .utils import quest_logger, sync_folder
 
 Blob = Union[dict, list, str, int, bool, float]
 
 
 class BlobStorage(Protocol):
+    # Whether sync_blobs makes writes durable (storages that do not sync cannot honor a GroupCommitter's policy)
+    can_sync: bool = False
+
     def write_blob(self, key: str, blob: Blob): ...
 
     def read_blob(self, key: str) -> Blob: ...
@@ -20,49 +30,477 @@ class BlobStorage(Protocol):
 
     def delete_blob(self, key: str): ...
 
+    def delete_blobs(self, keys: Iterable[str]):
+        """
+        Delete several blobs at once, skipping any that do not exist.
+        Storages can override this to make one request or transaction of it.
+        """
+        for key in keys:
+            if self.has_blob(key):
+                self.delete_blob(key)
+
+    def sync_blobs(self, keys: Iterable[str]):
+        """Make the last writes and deletes of these blobs survive a power loss"""
+
+
+class AsyncBlobStorage(Protocol):
+    async def write_blob(self, key: str, blob: Blob): ...
+
+    async def read_blob(self, key: str) -> Blob: ...
+
+    async def has_blob(self, key: str) -> bool: ...
+
+    async def delete_blob(self, key: str): ...
+
+    async def delete_blobs(self, keys: Iterable[str]):
+        """Delete several blobs at once, skipping any that do not exist (see BlobStorage.delete_blobs)"""
+        for key in keys:
+            if await self.has_blob(key):
+                await self.delete_blob(key)
+
+
+def _read_index(index: Blob) -> tuple[dict[int, str], int, dict[int, tuple[str, str]]]:
+    """
+    Return the sequence number -> key map, the next sequence number
+     and the (type, task_id) of the records (where the index has them) stored in a key index
+    """
+    if isinstance(index, list):
+        # Written before records carried sequence numbers: a list of hash-based keys
+        return dict(enumerate(index)), len(index), {}
+    # Entries are [seq, key] or, since the index holds record headers, [seq, key, type, task_id]
+    keys = {entry[0]: entry[1] for entry in index['keys']}
+    headers = {entry[0]: (entry[2], entry[3]) for entry in index['keys'] if len(entry) == 4}
+    return keys, index['next_seq'], headers
+
+
+def _make_index(keys: dict[int, str], next_seq: int, headers: dict[int, tuple[str, str]] = None) -> Blob:
+    headers = headers or {}
+    return {
+        'next_seq': next_seq,
+        'keys': [[seq, key, *headers[seq]] if seq in headers else [seq, key] for seq, key in keys.items()]
+    }
+
 
 class PersistentHistory(History):
-    def __init__(self, namespace: str, storage: BlobStorage):
+    def __init__(self, namespace: str, storage: BlobStorage, committer: GroupCommitter = None,
+                 cache_size: int = 1024, chunk_size: int = 256):
+        """
+        Only the key index is read up front.
+        Records are read from storage when they are iterated (see also snapshot()),
+        and the most recently used `cache_size` records are kept in memory.
+
+        Each appended record is given the next sequence number of the history (`record['seq']`),
+        which is also its storage key. Removing a record finds it by that number.
+
+        The index also holds the type and task ID of each record,
+        so the historian can plan the replay without reading the records (see snapshot()).
+        """
         self._namespace = namespace
         self._storage = storage
-        self._items = []
-        self._keys: list[str] = []
+        self._keys: dict[int, str] = {}  # sequence number -> storage key, in history order
+        self._headers: dict[int, tuple[str, str]] = {}  # sequence number -> (type, task_id)
+        self._next_seq = 0
+        self._cache: OrderedDict[int, EventRecord] = OrderedDict()
+        self._cache_size = cache_size
+        self._chunk_size = chunk_size
+
+        # Snapshots that are still being read; see _LazyRecords
+        self._snapshots: WeakSet[_LazyRecords] = WeakSet()
+
+        # With a committer, changes are buffered and written once per batch
+        # (the key index is rewritten once per batch instead of once per change)
+        self._committer = committer
+        self._pending_writes: dict[int, EventRecord] = {}
+        self._pending_deletes: set[str] = set()
+        self._index_dirty = False  # changes were written but the index was not
+        self._unsynced_keys: set[str] = set()  # written or deleted by the committer since the last sync
+        self._fence: Callable[[], None] | None = None
 
         if storage.has_blob(namespace):
-            self._keys = storage.read_blob(namespace)
-            for key in self._keys:
-                self._items.append(storage.read_blob(key))
+            self._keys, self._next_seq, self._headers = _read_index(storage.read_blob(namespace))
+
+    def _write_index(self):
+        self._storage.write_blob(self._namespace, _make_index(self._keys, self._next_seq, self._headers))
+
+    def _cache_record(self, seq: int, item: EventRecord):
+        self._cache[seq] = item
+        self._cache.move_to_end(seq)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def get_record(self, seq: int) -> EventRecord:
+        if (item := self._pending_writes.get(seq)) is not None:
+            return item
+        if (item := self._cache.get(seq)) is not None:
+            self._cache.move_to_end(seq)
+            return item
+        item = self._storage.read_blob(self._keys[seq])
+        item['seq'] = seq
+        # Indexes written before they held headers get them as the records are read
+        self._headers[seq] = (item['type'], item['task_id'])
+        self._cache_record(seq, item)
+        return item
+
+    def append(self, item: EventRecord):
+        item['seq'] = seq = self._next_seq
+        self._next_seq += 1
+        self._keys[seq] = key = f'{self._namespace}.{seq}'
+        self._headers[seq] = (item['type'], item['task_id'])
+        self._cache_record(seq, item)
+        if self._committer is None:
+            self._storage.write_blob(key, item)
+            self._write_index()
+        else:
+            self._pending_writes[seq] = item
+            self._committer.schedule(self)
+
+    def remove(self, item: EventRecord):
+        self.remove_many([item])
+
+    def remove_many(self, items: Iterable[EventRecord]):
+        """Remove the records and rewrite the key index once"""
+        keys = []
+        removed = 0
+        for item in items:
+            removed += 1
+            seq = item['seq']
+            key = self._keys.pop(seq)
+            self._headers.pop(seq, None)
+            self._cache.pop(seq, None)
+            for snapshot in self._snapshots:
+                snapshot.mark_removed(seq)
+            if self._pending_writes.pop(seq, None) is None:
+                keys.append(key)
+
+        if not removed:
+            return
+        if self._committer is None:
+            # The index stops referring to the records before they are deleted
+            self._write_index()
+            self._storage.delete_blobs(keys)
+        else:
+            self._pending_deletes.update(keys)
+            self._committer.schedule(self)
+
+    def set_fence(self, fence: Callable[[], None]):
+        """`fence` is called before buffered changes are written, and raises if they must not be (see _FencedHistory)"""
+        self._fence = fence
+
+    def can_sync(self) -> bool:
+        return self._storage.can_sync
+
+    def write_pending(self, sync: bool) -> int:
+        # Changes are dropped from the buffers as they are written,
+        #  so if a write fails, the committer's retry picks up where this one stopped.
+        changes = len(self._pending_writes) + len(self._pending_deletes)
+        if changes or self._index_dirty:
+            self._write_changes()
+        if sync and self._unsynced_keys:
+            self._storage.sync_blobs(self._unsynced_keys)
+            self._unsynced_keys.clear()
+        return changes
+
+    def _write_changes(self):
+        if self._fence is not None:
+            try:
+                self._fence()
+            except Exception:
+                # The changes are never to be written
+                self._pending_writes.clear()
+                self._pending_deletes.clear()
+                self._index_dirty = False
+                raise
+        self._index_dirty = True
+        while self._pending_writes:
+            seq, item = next(iter(self._pending_writes.items()))
+            self._storage.write_blob(key := self._keys[seq], item)
+            self._unsynced_keys.add(key)
+            del self._pending_writes[seq]
+        if self._pending_deletes:
+            # Deleting again after a failed batch is harmless, as delete_blobs skips missing blobs
+            self._storage.delete_blobs(list(self._pending_deletes))
+            self._unsynced_keys.update(self._pending_deletes)
+            self._pending_deletes.clear()
+        self._write_index()
+        self._unsynced_keys.add(self._namespace)
+        self._index_dirty = False
+
+    async def commit(self, immediate: bool = False):
+        if self._committer is not None:
+            await self._committer.commit(self, immediate)
+
+    def clear(self):
+        if self._committer is not None:
+            self._committer.discard(self)
+        self._storage.delete_blobs([
+            *(key for seq, key in self._keys.items() if seq not in self._pending_writes),
+            *self._pending_deletes
+        ])
+        self._pending_writes.clear()
+        self._pending_deletes.clear()
+        self._index_dirty = False
+        self._unsynced_keys.clear()
+        self._keys.clear()
+        self._headers.clear()
+        self._cache.clear()
+        if self._storage.has_blob(self._namespace):
+            self._storage.delete_blob(self._namespace)
+
+    def snapshot(self) -> '_LazyRecords':
+        self._snapshots.add(snapshot := _LazyRecords(self, list(self._keys), self._chunk_size))
+        return snapshot
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __reversed__(self):
+        for seq in reversed(list(self._keys)):
+            yield self.get_record(seq)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class AsyncPersistentHistory(History):
+    """
+    A PersistentHistory over an AsyncBlobStorage (see ThreadPoolBlobStorage).
+
+    The records are read by load(), which the historian awaits before replaying.
+    Changes are written behind the workflow by one writer task per history.
+    The writer makes one storage call at a time, in order, so a slow history
+    holds at most one worker of a shared pool and never blocks the event loop.
+    A change whose storage call fails is kept; commit() raises the error and the next commit() retries it.
+    """
+
+    def __init__(self, namespace: str, storage: AsyncBlobStorage, read_concurrency: int = 16):
+        self._namespace = namespace
+        self._storage = storage
+        self._read_concurrency = read_concurrency
+        self._items: dict[int, EventRecord] = {}  # by sequence number, in history order
+        self._keys: dict[int, str] = {}
+        self._next_seq = 0
+        self._loaded = False
+
+        self._pending_writes: dict[int, EventRecord] = {}
+        self._pending_deletes: set[str] = set()
+        self._index_action: Literal['write', 'delete'] | None = None
+        self._writer: asyncio.Task | None = None
+        self._writing_seq: int | None = None  # the record being written by the writer
+        self._write_error: Exception | None = None
+        self._fence: Callable[[], None] | None = None
 
-    def _get_key(self, item: EventRecord) -> str:
-        return self._namespace + '.' + md5((item['timestamp'] + item['step_id'] + item['type']).encode()).hexdigest()
+    async def load(self):
+        if self._loaded:
+            return
+
+        if await self._storage.has_blob(self._namespace):
+            self._keys, self._next_seq, _ = _read_index(await self._storage.read_blob(self._namespace))
+            seqs = list(self._keys)
+            for start in range(0, len(seqs), self._read_concurrency):
+                chunk = seqs[start:start + self._read_concurrency]
+                items = await asyncio.gather(*(self._storage.read_blob(self._keys[seq]) for seq in chunk))
+                for seq, item in zip(chunk, items):
+                    item['seq'] = seq
+                    self._items[seq] = item
+
+        self._loaded = True
 
     def append(self, item: EventRecord):
-        self._items.append(item)
-        self._keys.append(key := self._get_key(item))
-        self._storage.write_blob(key, item)
-        self._storage.write_blob(self._namespace, self._keys)
+        item['seq'] = seq = self._next_seq
+        self._next_seq += 1
+        self._items[seq] = item
+        self._keys[seq] = f'{self._namespace}.{seq}'
+        self._pending_writes[seq] = item
+        self._index_action = 'write'
+        self._schedule_write()
 
     def remove(self, item: EventRecord):
-        self._items.remove(item)
-        self._keys.remove(key := self._get_key(item))
-        self._storage.delete_blob(key)
-        self._storage.write_blob(self._namespace, self._keys)
+        self.remove_many([item])
+
+    def remove_many(self, items: Iterable[EventRecord]):
+        removed = 0
+        for item in items:
+            removed += 1
+            seq = item['seq']
+            del self._items[seq]
+            key = self._keys.pop(seq)
+            if self._pending_writes.pop(seq, None) is None or seq == self._writing_seq:
+                self._pending_deletes.add(key)
+        if removed:
+            self._index_action = 'write'
+            self._schedule_write()
 
     def clear(self):
-        for key in self._keys:
-            self._storage.delete_blob(key)
+        # Anything not waiting to be written is (or is being) stored
+        self._pending_deletes.update(
+            key for seq, key in self._keys.items() if seq not in self._pending_writes or seq == self._writing_seq
+        )
+        self._pending_writes.clear()
         self._items.clear()
         self._keys.clear()
-        self._storage.delete_blob(self._namespace)
+        self._index_action = 'delete'
+        self._schedule_write()
+
+    def set_fence(self, fence: Callable[[], None]):
+        """`fence` is called before each storage call of the writer, and raises if it must not be made"""
+        self._fence = fence
+
+    def _schedule_write(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending(), name=f'{self._namespace}.writer')
+
+    async def _write_pending(self):
+        # Changes stay in the buffers until their storage call succeeds,
+        #  so after an error the next writer (see commit()) picks up where this one stopped
+        self._write_error = None
+        try:
+            while True:
+                if self._fence is not None and (self._pending_writes or self._index_action or self._pending_deletes):
+                    try:
+                        self._fence()
+                    except Exception:
+                        # The changes are never to be written
+                        self._pending_writes.clear()
+                        self._pending_deletes.clear()
+                        self._index_action = None
+                        raise
+
+                if self._pending_writes:
+                    # New records are stored before the index refers to them
+                    seq, item = next(iter(self._pending_writes.items()))
+                    key = self._keys[seq]
+                    self._writing_seq = seq
+                    try:
+                        await self._storage.write_blob(key, item)
+                    except BaseException:
+                        if seq not in self._pending_writes:
+                            # Removed while it was written: there is nothing to delete
+                            self._pending_deletes.discard(key)
+                        raise
+                    finally:
+                        self._writing_seq = None
+                    self._pending_writes.pop(seq, None)
+
+                elif self._index_action is not None:
+                    # Only written once every record it lists is stored
+                    index_action, self._index_action = self._index_action, None
+                    try:
+                        if index_action == 'write':
+                            headers = {seq: (item['type'], item['task_id']) for seq, item in self._items.items()}
+                            index = _make_index(self._keys, self._next_seq, headers)
+                            await self._storage.write_blob(self._namespace, index)
+                        elif await self._storage.has_blob(self._namespace):
+                            await self._storage.delete_blob(self._namespace)
+                    except BaseException:
+                        if self._index_action is None:
+                            self._index_action = index_action
+                        raise
+
+                elif self._pending_deletes:
+                    # Removed records are deleted after the index stops referring to them
+                    keys = list(self._pending_deletes)
+                    await self._storage.delete_blobs(keys)
+                    self._pending_deletes.difference_update(keys)
+
+                else:
+                    return
+
+        except Exception as ex:
+            quest_logger.exception(f'Error writing history {self._namespace}')
+            self._write_error = ex
+
+    async def commit(self, immediate: bool = False):
+        # The writer already runs as soon as the loop allows, so `immediate` changes nothing
+        if self._write_error is not None:
+            # Retry the changes the failed writer left behind
+            self._schedule_write()
+
+        while self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+
+        if self._write_error is not None:
+            raise self._write_error
 
     def __iter__(self):
-        return iter(self._items)
+        return iter(self._items.values())
 
     def __reversed__(self):
-        return reversed(self._items)
+        return reversed(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _LazyRecords(Sequence):
+    """
+    The records of a PersistentHistory at the time of the snapshot.
+    Records are read from storage a chunk at a time as they are accessed,
+    and only the most recently used chunks are kept in memory.
+
+    Records removed from the history after the snapshot was taken
+    (i.e. pruned during the replay) are returned as None.
+    """
+
+    def __init__(self, history: PersistentHistory, seqs: list[int], chunk_size: int, max_chunks: int = 4):
+        self._history = history
+        self._seqs = seqs
+        self._chunk_size = chunk_size
+        self._max_chunks = max_chunks
+        self._removed: set[int] = set()
+        self._headers: list[tuple[str, str]] | None = None
+        self._chunks: OrderedDict[int, list[EventRecord | None]] = OrderedDict()
+
+    def _get_chunk(self, number: int) -> list[EventRecord | None]:
+        if (chunk := self._chunks.get(number)) is None:
+            start = number * self._chunk_size
+            chunk = [
+                None if seq in self._removed else self._history.get_record(seq)
+                for seq in self._seqs[start:start + self._chunk_size]
+            ]
+            self._chunks[number] = chunk
+            if len(self._chunks) > self._max_chunks:
+                self._chunks.popitem(last=False)
+        else:
+            self._chunks.move_to_end(number)
+        return chunk
+
+    def __getitem__(self, index: int) -> EventRecord | None:
+        if index < 0:
+            index += len(self._seqs)
+        if not 0 <= index < len(self._seqs):
+            raise IndexError(index)
+        return self._get_chunk(index // self._chunk_size)[index % self._chunk_size]
+
+    def __len__(self):
+        return len(self._seqs)
+
+    def mark_removed(self, seq: int):
+        # Records appended after the snapshot are not part of it (sequence numbers only go up),
+        #  so a snapshot kept for the whole run does not collect every later removal
+        if self._seqs and seq <= self._seqs[-1]:
+            self._removed.add(seq)
+
+    def headers(self) -> list[tuple[str, str]] | None:
+        """The (type, task_id) of each record, from the key index (None if the index does not have them all)"""
+        if self._headers is None:
+            headers = self._history._headers
+            if not all(seq in headers for seq in self._seqs):
+                return None
+            # Kept, as records removed later lose their header in the history
+            self._headers = [headers[seq] for seq in self._seqs]
+        return self._headers
+
+    def __iter__(self):
+        for number in range(0, (len(self._seqs) + self._chunk_size - 1) // self._chunk_size):
+            # Hold on to the chunk while iterating it, even if other readers evict it
+            for item in self._get_chunk(number):
+                if item is not None:
+                    yield item
 
 
 class LocalFileSystemBlobStorage(BlobStorage):
+    can_sync = True
+
     def __init__(self, root_folder: Path):
         root_folder.mkdir(parents=True, exist_ok=True)
         self._root = root_folder
@@ -82,6 +520,18 @@ class LocalFileSystemBlobStorage(BlobStorage):
     def delete_blob(self, key: str):
         self._get_file(key).unlink()
 
+    def delete_blobs(self, keys: Iterable[str]):
+        for key in keys:
+            self._get_file(key).unlink(missing_ok=True)
+
+    def sync_blobs(self, keys: Iterable[str]):
+        for key in keys:
+            if (file := self._get_file(key)).exists():
+                with file.open('rb') as handle:
+                    os.fsync(handle.fileno())
+        # New and deleted files
+        sync_folder(self._root)
+
 
 class InMemoryBlobStorage(BlobStorage):
     def __init__(self):
@@ -98,3 +548,38 @@ class InMemoryBlobStorage(BlobStorage):
 
     def delete_blob(self, key: str):
         del self._data[key]
+
+    def delete_blobs(self, keys: Iterable[str]):
+        for key in keys:
+            self._data.pop(key, None)
+
+
+class ThreadPoolBlobStorage(AsyncBlobStorage):
+    """
+    Runs a synchronous BlobStorage on a bounded thread pool so its I/O does not block the event loop.
+
+    Share one executor between the storages of many workflows to bound the total number of threads.
+    The wrapped storage must be safe to call from the worker threads.
+    """
+
+    def __init__(self, storage: BlobStorage, executor: Executor = None, max_workers: int = 8):
+        self._storage = storage
+        self._executor = executor or ThreadPoolExecutor(max_workers, thread_name_prefix='quest-storage')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def write_blob(self, key: str, blob: Blob):
+        return await self._run(self._storage.write_blob, key, blob)
+
+    async def read_blob(self, key: str) -> Blob:
+        return await self._run(self._storage.read_blob, key)
+
+    async def has_blob(self, key: str) -> bool:
+        return await self._run(self._storage.has_blob, key)
+
+    async def delete_blob(self, key: str):
+        return await self._run(self._storage.delete_blob, key)
+
+    async def delete_blobs(self, keys: Iterable[str]):
+        return await self._run(self._storage.delete_blobs, list(keys))
@@ -1,4 +1,4 @@
-from typing import TypedDict, Literal, Any
+from typing import TypedDict, Literal, Any, NotRequired
 
 
 class ExceptionDetails(TypedDict):
@@ -7,7 +7,13 @@ class ExceptionDetails(TypedDict):
     details: str
 
 
-class VersionRecord(TypedDict):
+class _SequencedRecord(TypedDict, total=False):
+    # Assigned by persistent histories when the record is appended
+    #  (see PersistentHistory); records kept in plain lists do not have one
+    seq: int
+
+
+class VersionRecord(_SequencedRecord):
     type: Literal['set_version', 'after_version']
     timestamp: str
     step_id: str  # stores the version name
@@ -15,7 +21,7 @@ class VersionRecord(TypedDict):
     version: str
 
 
-class ConfigurationRecord(TypedDict):
+class ConfigurationRecord(_SequencedRecord):
     type: Literal['configuration']
     timestamp: str
     step_id: Literal['configuration']
@@ -25,14 +31,14 @@ class ConfigurationRecord(TypedDict):
     kwargs: dict
 
 
-class StepStartRecord(TypedDict):
+class StepStartRecord(_SequencedRecord):
     type: Literal['start']
     timestamp: str
     step_id: str
     task_id: str
 
 
-class StepEndRecord(TypedDict):
+class StepEndRecord(_SequencedRecord):
     type: Literal['end']
     timestamp: str
     step_id: str
@@ -48,7 +54,7 @@ class ResourceEntry(TypedDict):
     resource: Any
 
 
-class ResourceLifecycleEvent(TypedDict):
+class ResourceLifecycleEvent(_SequencedRecord):
     type: Literal['create_resource', 'delete_resource']
     timestamp: str
     step_id: str
@@ -57,7 +63,7 @@ class ResourceLifecycleEvent(TypedDict):
     resource_type: str
 
 
-class ResourceAccessEvent(TypedDict):
+class ResourceAccessEvent(_SequencedRecord):
     type: Literal['external', 'internal_start', 'internal_end']
     timestamp: str
     step_id: str
@@ -69,17 +75,47 @@ class ResourceAccessEvent(TypedDict):
     result: Any
 
 
-class TaskEvent(TypedDict):
+class TaskEvent(_SequencedRecord):
     type: Literal['start_task', 'complete_task']
     timestamp: str
     step_id: str
     task_id: str  # the name of the task created/completed
 
 
+class ContinueRecord(_SequencedRecord):
+    # Written by continue_as_new; only configuration records precede it
+    type: Literal['continue']
+    timestamp: str
+    step_id: Literal['continue']
+    task_id: str
+    args: list
+    kwargs: dict
+    # The external puts of items the previous run left in its queues, put again in the new run's queues
+    pending: NotRequired[list[ResourceAccessEvent]]
+
+
 EventRecord = StepStartRecord \
               | StepEndRecord \
               | ResourceAccessEvent \
               | TaskEvent \
               | VersionRecord \
               | ConfigurationRecord \
-              | ResourceLifecycleEvent
\ No newline at end of file
+              | ResourceLifecycleEvent \
+              | ContinueRecord
+
+ResourceKey = tuple[str, str | None]  # (name, identity)
+
+
+class ResourceSnapshot(TypedDict):
+    # The resources of a stream's identity as of the change with this sequence number
+    epoch: str  # changes with different epochs come from different historians
+    seq: int
+    resources: dict[ResourceKey, str]  # resource type by key
+
+
+class ResourceDelta(TypedDict):
+    # Apply the removals first, then the additions
+    epoch: str
+    seq: int
+    added: dict[ResourceKey, str]
+    removed: list[ResourceKey]
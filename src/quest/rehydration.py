@@ -0,0 +1,110 @@
+# Rehydrating the workflows of a WorkflowManager at startup
+#
+# Starting every workflow at once makes all of them read their histories
+# and replay at the same time. The RehydrationScheduler starts them in
+# priority order and keeps at most `concurrency` of them replaying at once.
+# A workflow that is needed before its turn (e.g. an event is sent to it)
+# is taken out of the queue and started right away by the manager.
+#
+# Without background rehydration (the manager's lazy mode), workflows only
+# leave the queue that way, so dormant workflows are never replayed.
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable
+
+from .utils import quest_logger
+
+
+class RehydrationScheduler:
+    def __init__(self, rehydrate: Callable[[str], Awaitable], concurrency: int):
+        """
+        :param rehydrate: Starts the workflow and returns once its replay is done (or the workflow has stopped).
+        :param concurrency: Maximum number of workflows replaying at once.
+        """
+        self._rehydrate = rehydrate
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queued: dict[str, None] = {}  # dict used as an ordered set, in priority order
+        self._replaying: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+        self._total = 0
+        self._replayed = 0
+        self._taken = 0
+        self._start_time = time.monotonic()
+        self._end_time: float | None = None
+
+    def schedule(self, workflow_ids: Iterable[str], background: bool = True):
+        """
+        Rehydrate the workflows in the given order (highest priority first).
+        Without `background`, the workflows wait in the queue until they are taken (see take()).
+        """
+        self._queued.update(dict.fromkeys(workflow_ids))
+        self._total = len(self._queued)
+        self._start_time = time.monotonic()
+        if background:
+            self._task = asyncio.create_task(self._run(), name='quest.rehydration')
+
+    def is_queued(self, workflow_id: str) -> bool:
+        return workflow_id in self._queued
+
+    def take(self, workflow_id: str):
+        """Remove a workflow from the queue, because it is being started out of turn"""
+        del self._queued[workflow_id]
+        self._taken += 1
+
+    async def _run(self):
+        rehydrations = set()
+        while self._queued:
+            await self._slots.acquire()
+            if not self._queued:
+                self._slots.release()
+                break
+
+            workflow_id = next(iter(self._queued))
+            del self._queued[workflow_id]
+            self._replaying.add(workflow_id)
+
+            rehydrations.add(rehydration := asyncio.create_task(self._rehydrate_one(workflow_id)))
+            rehydration.add_done_callback(rehydrations.discard)
+
+        if rehydrations:
+            await asyncio.gather(*rehydrations)
+
+        self._end_time = time.monotonic()
+        quest_logger.info(f'Rehydrated {self._replayed} workflows in {self._end_time - self._start_time:.2f} s')
+
+    async def _rehydrate_one(self, workflow_id: str):
+        try:
+            await self._rehydrate(workflow_id)
+        except Exception:
+            quest_logger.exception(f'Error rehydrating {workflow_id}')
+        finally:
+            self._replaying.discard(workflow_id)
+            self._replayed += 1
+            self._slots.release()
+
+    async def wait(self):
+        """Wait until every scheduled workflow has been rehydrated"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def get_metrics(self) -> dict:
+        elapsed = (self._end_time or time.monotonic()) - self._start_time
+        return {
+            'total': self._total,
+            'queued': len(self._queued),
+            'replaying': len(self._replaying),
+            'replayed': self._replayed,
+            'started_on_demand': self._taken,
+            'done': not self._queued and not self._replaying,
+            'elapsed': elapsed,
+            'replays_per_second': self._replayed / elapsed if elapsed > 0 else 0,
+        }
@@ -1,47 +1,169 @@
 import asyncio
-from typing import Callable, Coroutine
+import uuid
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Callable, Coroutine
+
+from .quest_types import ResourceDelta, ResourceKey, ResourceSnapshot
 from .utils import quest_logger
 
+# Every change to the resources of a workflow gets a sequence number and is kept,
+#  as a delta (the resources added and removed), in a bounded change log.
+#  A stream starts with a snapshot of the resources and then gets the deltas of the changes
+#  its identity can see (changes to public resources or to resources of that identity;
+#  an action on a resource is a change with no additions or removals).
+#  A subscriber that reconnects can resync from the last sequence number it saw:
+#  it gets the deltas it missed, or a new snapshot if they are no longer in the log.
+#
+# Streams are indexed by identity. The streams of an identity share a channel:
+#  the log of the deltas they can see and a generation counter (how many deltas it has had).
+#  An update appends its delta to one channel (or to every channel, for public updates)
+#  and wakes the streams waiting on it, so it does not touch each stream.
+#  Each stream keeps the generation it has read up to, and reads the deltas it has not seen
+#  from the channel log. Those pending deltas are its buffer.
+#  What happens when more than buffer_size deltas are pending depends on the stream:
+#
+#   'block'     the update waits until the subscriber has handled all but buffer_size deltas
+#               (with buffer_size=0, the workflow moves in lockstep with the subscriber)
+#   'coalesce'  the subscriber gets the pending deltas merged into one
+#   'drop'      the subscriber gets a new snapshot instead of the pending deltas
+#
+# Only 'block' streams can hold up the workflow; the update waits for them all at once.
+# A stream that falls further behind than the channel log gets a new snapshot.
+OVERFLOW_POLICIES = ('block', 'coalesce', 'drop')
+
+
+def merge_deltas(first: ResourceDelta, second: ResourceDelta) -> ResourceDelta:
+    """
+    A delta with the effect of applying `first` and then `second`
+    It is a new delta: the deltas given may be in a change log, which must not change.
+    """
+    # Most changes are actions on resources, which add and remove nothing
+    if not first['added'] and not first['removed']:
+        return ResourceDelta(epoch=second['epoch'], seq=second['seq'], added=second['added'], removed=second['removed'])
+    if not second['added'] and not second['removed']:
+        return ResourceDelta(epoch=second['epoch'], seq=second['seq'], added=first['added'], removed=first['removed'])
+
+    removed = set(second['removed'])
+    added = {key: value for key, value in first['added'].items() if key not in removed}
+    added.update(second['added'])
+    return ResourceDelta(
+        epoch=second['epoch'],
+        seq=second['seq'],
+        added=added,
+        removed=list(dict.fromkeys(first['removed'] + second['removed']))
+    )
+
+
+def apply_delta(resources: dict[ResourceKey, str], delta: ResourceDelta):
+    for key in delta['removed']:
+        resources.pop(key, None)
+    resources.update(delta['added'])
+
+
+class _Channel:
+    """The deltas visible to the streams of one identity"""
+
+    def __init__(self, log_size: int):
+        self.log: deque[ResourceDelta] = deque(maxlen=log_size)
+        self.generation = 0
+        self.changed = asyncio.Event()
+        self.streams: set[ResourceStreamManager.ResourceStream] = set()
+        self.blocking: set[ResourceStreamManager.ResourceStream] = set()
+
+    def publish(self, delta: ResourceDelta):
+        self.log.append(delta)
+        self.generation += 1
+        self.wake()
+
+    def wake(self):
+        # Wake the streams waiting on this channel; later waiters wait on a new event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
 
 # noinspection PyProtectedMember
 class ResourceStreamManager:
-    def __init__(self):
-        self._resource_streams: dict[str | None, set[ResourceStreamManager.ResourceStream]] = {}
+    def __init__(self, log_size: int = 1000):
+        self._log_size = log_size
+        self._resource_streams: dict[str | None, _Channel] = {}
+
+        self._epoch = uuid.uuid4().hex
+        self._seq = 0
+        # The identity of each change and its delta, see _changes_since
+        self._changes: deque[tuple[str | None, ResourceDelta]] = deque(maxlen=log_size)
 
     class ResourceStream:
         def __init__(self,
+                     manager: 'ResourceStreamManager',
+                     identity: str | None,
                      get_resources: Callable[[], Coroutine],
-                     on_open: Callable[['ResourceStreamManager.ResourceStream'], None],
-                     on_close: Callable[['ResourceStreamManager.ResourceStream'], None]
+                     buffer_size: int = 0,
+                     overflow: str = 'block'
                      ):
-            self._stream_gate = asyncio.Event()
-            self._update_event = asyncio.Event()
+            if overflow not in OVERFLOW_POLICIES:
+                raise ValueError(f'Unknown overflow policy: {overflow}')
+            if buffer_size < (0 if overflow == 'block' else 1):
+                raise ValueError(f'Invalid buffer size for {overflow} streams: {buffer_size}')
+
+            self._channel: _Channel | None = None  # Set when the stream is opened
+            self._generation = 0  # The generation of the channel read up to
+            self._buffer_size = buffer_size
+            self._overflow = overflow
+            self._held = 0  # 1 while the subscriber handles a delta
+            self._dropped = 0
+
+            self._consumed_event = asyncio.Event()
             self._is_entered = False
+            self._is_closed = False
             self._workflow_stopped = False
 
+            self._manager = manager
+            self._identity = identity
             self._get_resources = get_resources
-            self._on_open = on_open
-            self._on_close = on_close
 
         def __enter__(self):
             self._is_entered = True
-            self._on_open(self)
+            self._manager._on_open(self._identity, self)
             quest_logger.debug(f'Resource stream opened for {id(self)}')
             return self
 
         def __exit__(self, exc_type, exc_value, traceback):
             self._is_entered = False
-            self._on_close(self)
+            self._is_closed = True
+            self._consumed_event.set()
+            self._manager._on_close(self._identity, self)
             quest_logger.debug(f'Resource stream closed for {id(self)}')
 
+        @property
+        def dropped(self) -> int:
+            """The number of deltas this stream dropped or merged away"""
+            return self._dropped
+
         async def __aiter__(self):
             """
             Provide a stream of resource snapshots for this workflow.
             Everytime the workflow resource state changes, an update will be published.
 
-            NOTE: Once you start the resource stream,
+            NOTE: With the default 'block' policy and buffer_size=0,
             the workflow will not progress unless you iterate this stream or exit the `with` context.
             """
+            resources = {}
+            async for message in self.deltas():
+                if 'resources' in message:
+                    resources = dict(message['resources'])
+                else:
+                    apply_delta(resources, message)
+                yield dict(resources)
+
+        async def deltas(self, since: tuple[str, int] | None = None) \
+                -> AsyncIterator[ResourceSnapshot | ResourceDelta]:
+            """
+            Provide a snapshot of the resources followed by a delta for each change.
+            `since` is the (epoch, seq) of the last snapshot or delta seen before reconnecting:
+             the stream then starts with the deltas missed since then, merged into one,
+             or with a new snapshot if they are no longer available.
+            """
 
             if not self._is_entered:
                 raise ResourceStreamNotEnteredError('ResourceStream must be used in a `with` context')
@@ -49,68 +171,133 @@ class ResourceStreamManager:
             if self._workflow_stopped:
                 raise ResourceStreamExpiredException('ResourceStream is expired because workflow was stopped')
 
-            yield await self._get_resources()  # Yield the current resources immediately
+            if since is None or (message := self._manager._changes_since(since, self._identity)) is None:
+                message = await self._snapshot()
+            yield message
 
             # Yield new resources updates as they become available
+            # A delta published before the snapshot was taken is already part of it,
+            #  but applying it again leaves the resources the same
+            channel = self._channel
             while True:
-                await self._update_event.wait()
-                if self._workflow_stopped:
-                    return
-                self._update_event.clear()
-                yield await self._get_resources()
-                self._stream_gate.set()
+                if not (pending := self._pending()):
+                    if self._workflow_stopped or self._is_closed:
+                        return
+                    await channel.changed.wait()
+                    continue
+
+                if pending > len(channel.log) or (self._overflow == 'drop' and pending > self._buffer_size):
+                    if self._workflow_stopped:
+                        return
+                    self._dropped += pending
+                    self._generation = channel.generation
+                    message = await self._snapshot()
+                elif self._overflow == 'coalesce' and pending > self._buffer_size:
+                    message = channel.log[-pending]
+                    for delta in islice(channel.log, len(channel.log) - pending + 1, None):
+                        message = merge_deltas(message, delta)
+                    self._dropped += pending - 1
+                    self._generation = channel.generation
+                else:
+                    message = channel.log[-pending]
+                    self._generation += 1
+
+                self._held = 1
+                yield message
+                self._held = 0
+                self._consumed_event.set()
+
+        async def _snapshot(self) -> ResourceSnapshot:
+            resources = await self._get_resources()
+            return ResourceSnapshot(epoch=self._manager._epoch, seq=self._manager._seq, resources=resources)
+
+        def _pending(self) -> int:
+            return self._channel.generation - self._generation
+
+        def _is_full(self) -> bool:
+            return self._pending() + self._held > self._buffer_size
+
+        async def _wait_for_room(self):
+            while self._is_full() and not (self._is_closed or self._workflow_stopped):
+                self._consumed_event.clear()
+                await self._consumed_event.wait()
 
     def _on_open(self, identity, res_stream: ResourceStream):
-        if identity not in self._resource_streams:
-            self._resource_streams[identity] = set()
+        if (channel := self._resource_streams.get(identity)) is None:
+            channel = self._resource_streams[identity] = _Channel(self._log_size)
 
-        self._resource_streams[identity].add(res_stream)
+        channel.streams.add(res_stream)
+        if res_stream._overflow == 'block':
+            channel.blocking.add(res_stream)
+        res_stream._channel = channel
+        res_stream._generation = channel.generation
 
     def _on_close(self, identity, res_stream: ResourceStream):
-        res_stream._stream_gate.set()
-        self._resource_streams[identity].remove(res_stream)
+        channel = self._resource_streams[identity]
+        channel.streams.remove(res_stream)
+        channel.blocking.discard(res_stream)
 
-        if not self._resource_streams[identity]:  # Clean up dictionary values if needed
+        if not channel.streams:  # Clean up dictionary values if needed
             self._resource_streams.pop(identity)
+            # Wake the streams still iterating it, so they see they are closed
+            channel.wake()
+
+    def _changes_since(self, since: tuple[str, int], identity) -> ResourceDelta | None:
+        """The changes after `since` that `identity` can see, merged into one delta (None if some are not in the log)"""
+        epoch, seq = since
+        if epoch != self._epoch or not self._seq - len(self._changes) <= seq <= self._seq:
+            return None
+
+        missed = ResourceDelta(epoch=self._epoch, seq=self._seq, added={}, removed=[])
+        for change_identity, delta in islice(self._changes, len(self._changes) - (self._seq - seq), None):
+            if change_identity is None or change_identity == identity:
+                missed = merge_deltas(missed, delta)
+        # Up to the latest change, even if the identity cannot see it
+        return ResourceDelta(epoch=self._epoch, seq=self._seq, added=missed['added'], removed=missed['removed'])
 
     def get_resource_stream(self,
                             identity,
                             get_resources: Callable[[], Coroutine],
+                            buffer_size: int = 0,
+                            overflow: str = 'block'
                             ):
-        rs = ResourceStreamManager.ResourceStream(
-            get_resources,
-            lambda res_stream: self._on_open(identity, res_stream),
-            lambda res_stream: self._on_close(identity, res_stream)
-        )
-        return rs
-
-    async def update(self, identity):
+        return ResourceStreamManager.ResourceStream(self, identity, get_resources, buffer_size, overflow)
+
+    async def update(self, identity, added: dict[ResourceKey, str] = None, removed: list[ResourceKey] = None):
+        self._seq += 1
+        delta = ResourceDelta(epoch=self._epoch, seq=self._seq, added=added or {}, removed=removed or [])
+        self._changes.append((identity, delta))
+
         # If the updates is public, we notify everyone.
         # If there is no resource stream associated with `identity`, no update needed.
-        if identity is not None and identity not in self._resource_streams:
-            return
-
-        # As we iterate through the streams, some of them may close and be removed.
-        # To avoid set size changed exception, we use a copy of the streams.
         if identity is None:
-            streams = {key: value.copy() for key, value in self._resource_streams.items()}
+            channels = self._resource_streams.values()
+        elif identity in self._resource_streams:
+            channels = [self._resource_streams[identity]]
         else:
-            streams = {identity: self._resource_streams[identity].copy()}
+            return
 
-        for stream_identity, stream_set in streams.items():
-            for stream in stream_set:
-                if stream not in self._resource_streams[stream_identity]:  # Continue if the stream has closed
-                    continue
-                stream._update_event.set()
-                await stream._stream_gate.wait()
-                stream._stream_gate.clear()
+        # Nothing here awaits, so streams cannot open or close while the channels are visited
+        blocked = []
+        for channel in channels:
+            channel.publish(delta)
+            for stream in channel.blocking:
+                if stream._is_full():
+                    blocked.append(stream._wait_for_room())
+
+        if blocked:
+            await asyncio.gather(*blocked)
+
+    def has_streams(self) -> bool:
+        return bool(self._resource_streams)
 
     # This function is called by historian to notify when the workflow is suspended or completed
     def notify_of_workflow_stop(self):
-        for stream_identity, stream_set in self._resource_streams.items():
-            for stream in stream_set:
+        for channel in self._resource_streams.values():
+            for stream in channel.streams:
                 stream._workflow_stopped = True
-                stream._update_event.set()
+                stream._consumed_event.set()
+            channel.wake()
 
 class ResourceStreamNotEnteredError(Exception):
     """Exception raised when ResourceStream is not used in a `with` context."""
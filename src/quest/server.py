@@ -1,15 +1,21 @@
 #!/usr/bin/env python
 import asyncio
-import json
 from typing import Callable
 from websockets import WebSocketException, Headers
 from websockets.asyncio.server import serve, ServerConnection
 from websockets.exceptions import ConnectionClosedOK
 
 from quest import WorkflowManager
+from quest.codec import Codec, JSON_CODEC, available_codecs, encode_resource_key, from_subprotocol, get_codec, \
+    to_subprotocol
 from quest.utils import quest_logger, serialize_exception
 
 
+# Manager methods whose result is a dict of resources (keyed by (name, identity) tuples):
+#  their responses carry the result as 'resources', in the codec's format for resources (see codec.py)
+RESOURCE_METHODS = {'get_resources'}
+
+
 class MethodNotFoundException(Exception):
     pass
 
@@ -22,18 +28,31 @@ class InvalidPathException(Exception):
     pass
 
 
-async def serialize_resources(resources):
-    serialized_resources = {}
-    for key, value in resources.items():
-        assert isinstance(key, tuple)
-        new_key = '||'.join(k if k is not None else '' for k in key)
-        serialized_resources[new_key] = value
-    return {'resources': serialized_resources}
+def serialize_resource_key(key: tuple) -> str:
+    return encode_resource_key(key)
+
+
+async def serialize_resources(resources, codec: Codec = JSON_CODEC):
+    return {'resources': codec.encode_resources(resources)}
+
+
+async def serialize_resource_message(message, codec: Codec = JSON_CODEC):
+    """Serialize a snapshot or delta from ResourceStream.deltas()"""
+    if 'resources' in message:
+        serialized = await serialize_resources(message['resources'], codec)
+    else:
+        serialized = {
+            'added': codec.encode_resources(message['added']),
+            'removed': codec.encode_resource_keys(message['removed'])
+        }
+    return {'epoch': message['epoch'], 'seq': message['seq'], **serialized}
 
 
 class Server:
     def __init__(self, manager: WorkflowManager, host: str, port: int,
-                 authorizer: Callable[[Headers], bool] = lambda headers: True):
+                 authorizer: Callable[[Headers], bool] = lambda headers: True,
+                 stream_buffer_size: int = 1, stream_overflow: str = 'coalesce',
+                 max_concurrent_calls: int = 64, codecs: list[str] = None, compression: str | None = 'deflate'):
         """
         Initialize the server.
 
@@ -41,18 +60,33 @@ class Server:
         :param host: Host address for the server.
         :param port: Port for the server.
         :param authorizer: Used to authenticate incoming connections.
+        :param stream_buffer_size: Resource snapshots buffered for each /stream connection.
+        :param stream_overflow: What a full buffer does (see ResourceStreamManager);
+            the default keeps slow connections from holding up workflows and sends them the latest resources.
+        :param max_concurrent_calls: Calls that run at the same time for each /call connection.
+        :param codecs: The wire codecs clients may choose from, in order of preference (see codec.py);
+            all the installed codecs by default.
+        :param compression: 'deflate' to compress messages when clients support it, or None.
         """
         self._server = None
         self._manager: WorkflowManager = manager
         self._host = host
         self._port = port
         self._authorizer = authorizer
+        self._stream_buffer_size = stream_buffer_size
+        self._stream_overflow = stream_overflow
+        self._max_concurrent_calls = max_concurrent_calls
+        self._codecs = [get_codec(name).name for name in (codecs or available_codecs())]
+        self._compression = compression
 
     async def __aenter__(self):
         """
         Start the server in an async with context.
         """
-        self._server = serve(self.handler, self._host, self._port)
+        self._server = serve(self.handler, self._host, self._port,
+                             subprotocols=[to_subprotocol(name) for name in self._codecs],
+                             select_subprotocol=self._select_subprotocol,
+                             compression=self._compression)
         await self._server.__aenter__()
         quest_logger.info(f'Server started at ws://{self._host}:{self._port}')
         return self
@@ -64,6 +98,13 @@ class Server:
         await self._server.__aexit__(exc_type, exc_val, exc_tb)
         quest_logger.info(f'Server at ws://{self._host}:{self._port} stopped')
 
+    def _select_subprotocol(self, ws: ServerConnection, subprotocols):
+        # Clients that offer no codec (or none of ours) get JSON
+        for name in self._codecs:
+            if to_subprotocol(name) in subprotocols:
+                return to_subprotocol(name)
+        return None
+
     async def handler(self, ws: ServerConnection):
         """
         Handle incoming WebSocket connections and messages.
@@ -77,65 +118,164 @@ class Server:
 
         try:
             quest_logger.info(f'Opened connection id: {ws.id}, address: {ws.remote_address[0]}')
+            codec = from_subprotocol(ws.subprotocol)
             match ws.request.path:
                 case "/call":
-                    await self.handle_call(ws)
+                    await self.handle_call(ws, codec)
                 case "/stream":
-                    await self.handle_stream(ws)
+                    await self.handle_stream(ws, codec)
                 case _:
                     response = {
                         'exception': serialize_exception(InvalidPathException(f'Invalid path: {ws.request.path}'))}
-                    await ws.send(json.dumps(response))
+                    await ws.send(codec.encode(response))
         except ConnectionClosedOK:
             pass
         finally:
             quest_logger.info(f'Closed connection id: {ws.id}, address: {ws.remote_address[0]}')
 
-    async def handle_call(self, ws: ServerConnection):
-        async for message in ws:
+    async def handle_call(self, ws: ServerConnection, codec: Codec = JSON_CODEC):
+        # Calls that carry an 'id' are run concurrently (up to max_concurrent_calls per connection)
+        #  and their responses carry the same 'id', in the order the calls finish.
+        # Calls without one are answered in order, one at a time.
+        # A message with a 'batch' of calls (instead of one call) gets one response with all their results.
+        # Calls of RESOURCE_METHODS get their result as 'resources' instead of 'result'.
+        limit = asyncio.Semaphore(self._max_concurrent_calls)
+        calls = set()
+        try:
+            async for message in ws:
+                try:
+                    data = codec.decode(message)
+                except Exception as e:
+                    await ws.send(codec.encode({'exception': serialize_exception(e)}))
+                    continue
+
+                if not isinstance(data, dict) or 'id' not in data:
+                    await self._respond(ws, codec, data)
+                    continue
+
+                # Stop reading calls while the connection has too many in flight
+                await limit.acquire()
+                call = asyncio.create_task(self._respond(ws, codec, data))
+                call.add_done_callback(lambda _: limit.release())
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+        finally:
+            # Calls that were already started are allowed to finish
+            if calls:
+                await asyncio.gather(*calls, return_exceptions=True)
+
+    async def _respond(self, ws: ServerConnection, codec: Codec, data):
+        if isinstance(data, dict) and 'batch' in data:
+            response = await self._call_batch(data['batch'], codec)
+        else:
+            response = await self._call(data, codec)
+        if isinstance(data, dict) and 'id' in data:
+            response['id'] = data['id']
+
+        try:
+            message = codec.encode(response)
+        except Exception as e:
+            # The result cannot be sent (e.g. it is not serializable), so the caller gets the error instead
+            error = {'exception': serialize_exception(e)}
+            if 'id' in response:
+                error['id'] = response['id']
             try:
-                data = json.loads(message)
-
-                if 'method' not in data or 'args' not in data or 'kwargs' not in data:
-                    raise InvalidParametersException()
-                method_name = data['method']
-                args = data['args']
-                kwargs = data['kwargs']
-
-                if not hasattr(self._manager, method_name):
-                    raise MethodNotFoundException(f'{method_name} is not a valid method')
-                method = getattr(self._manager, method_name)
-                if not callable(method):
-                    raise MethodNotFoundException(f'{method_name} is not callable')
-
-                result = method(*args, **kwargs)
-                if asyncio.iscoroutine(result):
-                    result = await result
-                response = {'result': result}
+                message = codec.encode(error)
+            except Exception:
+                # Closing the connection fails the calls the client is waiting on
+                quest_logger.exception(f'Could not send a response on connection {ws.id}')
+                await ws.close(1011, 'Could not encode a response')
+                return
+        await ws.send(message)
+
+    async def _call(self, data, codec: Codec = JSON_CODEC) -> dict:
+        try:
+            if not isinstance(data, dict) or 'method' not in data or 'args' not in data or 'kwargs' not in data:
+                raise InvalidParametersException()
+            method_name = data['method']
+            args = data['args']
+            kwargs = data['kwargs']
+
+            if not hasattr(self._manager, method_name):
+                raise MethodNotFoundException(f'{method_name} is not a valid method')
+            method = getattr(self._manager, method_name)
+            if not callable(method):
+                raise MethodNotFoundException(f'{method_name} is not callable')
+
+            result = method(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                result = await result
+            if method_name in RESOURCE_METHODS:
+                return {'resources': codec.encode_resources(result)}
+            return {'result': result}
+        except WebSocketException as e:
+            raise e
+        except Exception as e:
+            return {'exception': serialize_exception(e)}
+
+    async def _call_batch(self, calls, codec: Codec = JSON_CODEC) -> dict:
+        # The calls of a batch run concurrently (up to max_concurrent_calls)
+        #  and the response has the result or exception of each one, in the order of the calls.
+        # Its start_workflow calls are made first, and together (with start_workflows, if the manager has it),
+        #  so the other calls find the workflows they start.
+        if not isinstance(calls, list):
+            return {'exception': serialize_exception(InvalidParametersException())}
+
+        results: list[dict | None] = [None] * len(calls)
+        starts = [
+            index for index, call in enumerate(calls)
+            if isinstance(call, dict) and call.get('method') == 'start_workflow'
+               and isinstance(call.get('args'), list) and len(call['args']) >= 2
+               and isinstance(call.get('kwargs'), dict)
+        ]
+        if starts and (start_workflows := getattr(self._manager, 'start_workflows', None)) is not None:
+            try:
+                exceptions = await start_workflows(
+                    [(calls[i]['args'][0], calls[i]['args'][1], calls[i]['args'][2:], calls[i]['kwargs'])
+                     for i in starts],
+                    return_exceptions=True
+                )
+                for index, exception in zip(starts, exceptions):
+                    results[index] = {'result': None} if exception is None \
+                        else {'exception': serialize_exception(exception)}
             except WebSocketException as e:
                 raise e
             except Exception as e:
-                response = {'exception': serialize_exception(e)}
-            await ws.send(json.dumps(response))
+                for index in starts:
+                    results[index] = {'exception': serialize_exception(e)}
+        else:
+            for index in starts:
+                results[index] = await self._call(calls[index], codec)
+
+        limit = asyncio.Semaphore(self._max_concurrent_calls)
+
+        async def run(index: int):
+            async with limit:
+                results[index] = await self._call(calls[index], codec)
+
+        await asyncio.gather(*(run(index) for index, result in enumerate(results) if result is None))
+        return {'results': results}
 
-    async def handle_stream(self, ws: ServerConnection):
+    async def handle_stream(self, ws: ServerConnection, codec: Codec = JSON_CODEC):
         try:
             # Receive initial parameters
             message = await ws.recv()
-            params = json.loads(message)
+            params = codec.decode(message)
             if 'wid' not in params or 'identity' not in params:
                 raise InvalidParametersException()
             wid = params['wid']
             ident = params['identity']
+            # The (epoch, seq) of the last message a reconnecting client saw
+            since = tuple(params['since']) if params.get('since') is not None else None
 
-            # Stream resource updates via ws messages
-            with self._manager.get_resource_stream(wid, ident) as stream:
-                async for resources in stream:
-                    # Serialize tuple keys into strings joined by '||'
-                    resources = await serialize_resources(resources)
-                    await ws.send(json.dumps(resources))
+            # Stream a snapshot and then resource deltas via ws messages
+            with self._manager.get_resource_stream(wid, ident, self._stream_buffer_size,
+                                                   self._stream_overflow) as stream:
+                async for message in stream.deltas(since):
+                    message = await serialize_resource_message(message, codec)
+                    await ws.send(codec.encode(message))
         except WebSocketException as e:
             raise e
         except Exception as e:
             response = {'exception': serialize_exception(e)}
-            await ws.send(json.dumps(response))
+            await ws.send(codec.encode(response))
@@ -0,0 +1,328 @@
+# Sharding workflows across worker processes
+#
+# A WorkflowManager runs all of its workflows on one event loop, so replay and
+# serialization are limited to one core. ShardedWorkflowManager starts N worker
+# processes, each running its own WorkflowManager, and routes every call for a
+# workflow to the worker that owns it.
+#
+# Ownership is decided by consistent hashing of the workflow ID. Each worker
+# persists the workflows it owns under its own namespace (see `create_manager`),
+# so the number of workers must stay the same across restarts.
+#
+# The supervisor talks to each worker over a Unix domain socket. Calls are pickled
+# and tagged with a request ID, so many calls can be in flight on one connection.
+#
+# Aliases (see quest.alias) are registered by workflows on their worker, so the
+# supervisor cannot hash them to find the workflow. Instead each worker reports
+# its aliases as they are registered and removed (messages without a request ID),
+# and the supervisor routes calls for an alias to the worker that reported it.
+# An alias can be used once its report has reached the supervisor.
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import pickle
+import struct
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+from .manager import WorkflowManager
+from .utils import quest_logger, serialize_exception, deserialize_exception
+
+# The manager methods a worker answers (see ShardedWorkflowManager)
+WORKER_METHODS = {
+    'start_workflow',
+    'start_workflows',
+    'has_workflow',
+    'send_event',
+    'get_resources',
+    'has_resource',
+    'get_workflow_result',
+    'delete_workflow',
+    'get_workflow_metrics',
+}
+
+_HEADER = struct.Struct('!I')
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ConsistentHashRing:
+    def __init__(self, nodes: list[int], replicas: int = 64):
+        """
+        :param nodes: The nodes (e.g. shard numbers) that keys are assigned to.
+        :param replicas: Points on the ring per node; more points spread the keys more evenly.
+        """
+        self._ring = sorted((_hash(f'{node}:{replica}'), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in self._ring]
+
+    def get_node(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+async def _send(writer: asyncio.StreamWriter, message):
+    data = pickle.dumps(message)
+    writer.write(_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def _receive(reader: asyncio.StreamReader):
+    (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return pickle.loads(await reader.readexactly(length))
+
+
+# Worker side
+
+def _run_worker(create_manager: Callable[[int], WorkflowManager], shard: int, socket_path: str):
+    asyncio.run(_serve_worker(create_manager, shard, socket_path))
+
+
+async def _serve_worker(create_manager: Callable[[int], WorkflowManager], shard: int, socket_path: str):
+    stopped = asyncio.Event()
+
+    async with create_manager(shard) as manager:
+        async def handle_call(writer, write_lock, request_id, method_name, args, kwargs):
+            try:
+                if method_name not in WORKER_METHODS:
+                    raise AttributeError(f'{method_name} is not a valid method')
+                result = getattr(manager, method_name)(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                response = (request_id, None, result)
+            except Exception as ex:
+                response = (request_id, serialize_exception(ex), None)
+
+            async with write_lock:
+                await _send(writer, response)
+
+        async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            write_lock = asyncio.Lock()
+            calls = set()
+
+            async def report_aliases(aliases: dict[str, str | None]):
+                async with write_lock:
+                    await _send(writer, (None, None, aliases))
+
+            def report_alias(alias: str, workflow_id: str | None):
+                # The lock is taken in the order of the reports
+                calls.add(report := asyncio.create_task(report_aliases({alias: workflow_id})))
+                report.add_done_callback(calls.discard)
+
+            calls.add(report := asyncio.create_task(report_aliases(manager.watch_aliases(report_alias))))
+            report.add_done_callback(calls.discard)
+            try:
+                while True:
+                    request_id, method_name, args, kwargs = await _receive(reader)
+                    if method_name == 'stop':
+                        stopped.set()
+                        break
+                    calls.add(call := asyncio.create_task(
+                        handle_call(writer, write_lock, request_id, method_name, args, kwargs)))
+                    call.add_done_callback(calls.discard)
+            except asyncio.IncompleteReadError:
+                pass  # The supervisor went away
+
+        server = await asyncio.start_unix_server(handle_connection, socket_path)
+        async with server:
+            quest_logger.info(f'Shard {shard} listening on {socket_path}')
+            await stopped.wait()
+
+
+# Supervisor side
+
+class _WorkerConnection:
+    def __init__(self, shard: int, socket_path: str, process: multiprocessing.Process,
+                 on_aliases: Callable[[int, dict[str, str | None]], None]):
+        self.shard = shard
+        self.process = process
+        self._on_aliases = on_aliases
+        self._socket_path = socket_path
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._write_lock = asyncio.Lock()
+        self._next_request_id = 0
+        self._pending: dict[int, asyncio.Future] = {}
+        self._receiver: asyncio.Task | None = None
+
+    async def connect(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self._socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not self.process.is_alive():
+                    raise RuntimeError(f'Shard {self.shard} exited with code {self.process.exitcode}')
+                if loop.time() > deadline:
+                    raise TimeoutError(f'Shard {self.shard} did not start within {timeout} seconds')
+                await asyncio.sleep(0.05)
+        self._receiver = asyncio.create_task(self._receive_responses())
+
+    async def _receive_responses(self):
+        try:
+            while True:
+                request_id, exception, result = await _receive(self._reader)
+                if request_id is None:
+                    # Not a response: the worker reports its aliases
+                    self._on_aliases(self.shard, result)
+                    continue
+                if (future := self._pending.pop(request_id, None)) is None or future.done():
+                    continue
+                if exception is not None:
+                    future.set_exception(deserialize_exception(exception))
+                else:
+                    future.set_result(result)
+        except asyncio.IncompleteReadError:
+            error = ConnectionError(f'Lost connection to shard {self.shard}')
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def call(self, method_name: str, *args, **kwargs):
+        request_id = self._next_request_id
+        self._next_request_id += 1
+        self._pending[request_id] = future = asyncio.get_running_loop().create_future()
+        async with self._write_lock:
+            await _send(self._writer, (request_id, method_name, args, kwargs))
+        return await future
+
+    async def stop(self):
+        async with self._write_lock:
+            await _send(self._writer, (None, 'stop', (), {}))
+        self._writer.close()
+        if self._receiver is not None:
+            await self._receiver
+
+
+class ShardedWorkflowManager:
+    """
+    Runs workflows on `workers` processes, each with its own WorkflowManager.
+
+    `create_manager(shard)` is called in each worker process to create its manager.
+    It must be picklable (e.g. a module-level function), and each shard's manager
+    should use its own namespace (e.g. f'{namespace}-{shard}') over the shared storage.
+
+    The supervisor exposes the manager API for calls that name a workflow
+    (start_workflow, start_workflows, has_workflow, send_event, get_resources, get_workflow_result, delete_workflow)
+    as coroutines, and routes each one to the worker that owns the workflow.
+    Calls can also name a workflow by one of its aliases.
+    Each worker checks that the aliases of its own workflows are unique;
+     if workflows on two workers register the same alias, the latest registration is used.
+    Workflow arguments, events and results must be picklable.
+    """
+
+    def __init__(self, create_manager: Callable[[int], WorkflowManager], workers: int = None,
+                 start_timeout: float = 30):
+        self._create_manager = create_manager
+        self._worker_count = workers or multiprocessing.cpu_count()
+        self._start_timeout = start_timeout
+        self._ring = ConsistentHashRing(list(range(self._worker_count)))
+        self._workers: list[_WorkerConnection] = []
+        self._aliases: dict[str, int] = {}  # alias -> the shard that registered it
+        self._socket_folder: tempfile.TemporaryDirectory | None = None
+
+    async def __aenter__(self) -> 'ShardedWorkflowManager':
+        self._socket_folder = tempfile.TemporaryDirectory(prefix='quest-shards-')
+        context = multiprocessing.get_context('spawn')
+        for shard in range(self._worker_count):
+            socket_path = str(Path(self._socket_folder.name) / f'shard-{shard}.sock')
+            process = context.Process(
+                target=_run_worker,
+                args=(self._create_manager, shard, socket_path),
+                name=f'quest-shard-{shard}',
+                daemon=True
+            )
+            process.start()
+            self._workers.append(_WorkerConnection(shard, socket_path, process, self._update_aliases))
+
+        await asyncio.gather(*(worker.connect(self._start_timeout) for worker in self._workers))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # Each worker suspends its workflows and saves its manager state as it stops
+        await asyncio.gather(*(worker.stop() for worker in self._workers), return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.process.join)
+        self._workers = []
+        self._socket_folder.cleanup()
+
+    def _update_aliases(self, shard: int, aliases: dict[str, str | None]):
+        for alias, workflow_id in aliases.items():
+            if workflow_id is not None:
+                if self._aliases.get(alias, shard) != shard:
+                    quest_logger.warning(f'Alias "{alias}" is registered on shards {self._aliases[alias]} and {shard}')
+                self._aliases[alias] = shard
+            elif self._aliases.get(alias) == shard:
+                del self._aliases[alias]
+
+    def get_shard(self, workflow_id: str) -> int:
+        return self._ring.get_node(workflow_id)
+
+    def _get_worker(self, workflow_id: str) -> _WorkerConnection:
+        """The worker of the workflow, or of the workflow registered under this alias"""
+        if (shard := self._aliases.get(workflow_id)) is not None:
+            return self._workers[shard]
+        return self._workers[self.get_shard(workflow_id)]
+
+    async def start_workflow(self, workflow_type: str, workflow_id: str, *workflow_args,
+                             delete_on_finish: bool = True, **workflow_kwargs):
+        # A new workflow goes to the shard of its ID, even if the ID is also an alias
+        await self._workers[self.get_shard(workflow_id)].call(
+            'start_workflow', workflow_type, workflow_id, *workflow_args,
+            delete_on_finish=delete_on_finish, **workflow_kwargs
+        )
+
+    async def start_workflows(self, workflows, return_exceptions: bool = False) -> list[Exception | None]:
+        """
+        Like WorkflowManager.start_workflows, with one call per worker.
+        Each worker starts its workflows or none of them, so without `return_exceptions`
+         the workflows of the other workers may have started when the exception is raised.
+        """
+        workflows = list(workflows)
+        by_worker: dict[int, list[int]] = {}
+        for index, (_, workflow_id, _, _) in enumerate(workflows):
+            by_worker.setdefault(self.get_shard(workflow_id), []).append(index)
+
+        shard_results = await asyncio.gather(*(
+            self._workers[shard].call('start_workflows', [workflows[i] for i in indexes],
+                                      return_exceptions=return_exceptions)
+            for shard, indexes in by_worker.items()
+        ), return_exceptions=not return_exceptions)
+
+        exceptions: list[Exception | None] = [None] * len(workflows)
+        for indexes, results in zip(by_worker.values(), shard_results):
+            if isinstance(results, BaseException):
+                raise results
+            for index, exception in zip(indexes, results):
+                exceptions[index] = exception
+        return exceptions
+
+    async def has_workflow(self, workflow_id: str) -> bool:
+        return await self._get_worker(workflow_id).call('has_workflow', workflow_id)
+
+    async def send_event(self, workflow_id: str, name: str, identity, action, *args, **kwargs):
+        return await self._get_worker(workflow_id).call('send_event', workflow_id, name, identity, action,
+                                                        *args, **kwargs)
+
+    async def get_resources(self, workflow_id: str, identity):
+        return await self._get_worker(workflow_id).call('get_resources', workflow_id, identity)
+
+    async def has_resource(self, workflow_id: str, name: str, identity) -> bool:
+        return await self._get_worker(workflow_id).call('has_resource', workflow_id, name, identity)
+
+    async def get_workflow_result(self, workflow_id: str, delete: bool = False):
+        return await self._get_worker(workflow_id).call('get_workflow_result', workflow_id, delete=delete)
+
+    async def delete_workflow(self, workflow_id: str):
+        return await self._get_worker(workflow_id).call('delete_workflow', workflow_id)
+
+    async def get_workflow_metrics(self) -> list[dict]:
+        metrics = await asyncio.gather(*(worker.call('get_workflow_metrics') for worker in self._workers))
+        return [entry for shard_metrics in metrics for entry in shard_metrics]
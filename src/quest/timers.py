@@ -0,0 +1,37 @@
+# Durable timers
+#
+# sleep and sleep_until record the deadline in the history (as the result of a step),
+# so a workflow that is suspended and resumed keeps its original deadline
+# instead of starting its wait over.
+#
+# While the workflow waits, its historian reports the deadline (see Historian.get_next_timer).
+# A WorkflowManager keeps the deadlines of the workflows it does not have in memory
+# (hibernated, or not yet rehydrated) and wakes each one when its deadline comes,
+# so sleeping workflows can be dropped from memory.
+from datetime import datetime, timedelta, timezone
+
+from .historian import find_historian
+from .wrappers import step
+
+
+@step
+async def start_timer(seconds: float | None, deadline: str | None) -> str:
+    if deadline is None:
+        deadline = (datetime.utcnow() + timedelta(seconds=seconds)).isoformat()
+    return deadline
+
+
+async def sleep(duration: float | timedelta):
+    """Wait for `duration` (seconds or a timedelta) from the first time this runs"""
+    if isinstance(duration, timedelta):
+        duration = duration.total_seconds()
+    deadline = await start_timer(duration, None)
+    await find_historian().wait_until(datetime.fromisoformat(deadline))
+
+
+async def sleep_until(deadline: datetime):
+    """Wait until the deadline (naive datetimes are taken to be UTC, like the rest of quest)"""
+    if deadline.tzinfo is not None:
+        deadline = deadline.astimezone(timezone.utc).replace(tzinfo=None)
+    deadline = await start_timer(None, deadline.isoformat())
+    await find_historian().wait_until(datetime.fromisoformat(deadline))
@@ -2,6 +2,9 @@ import logging
 from contextvars import ContextVar
 import traceback
 import asyncio
+import inspect
+import os
+from pathlib import Path
 
 task_name_getter = ContextVar("task_name_getter", default=lambda: "-")
 
@@ -10,6 +13,24 @@ async def ainput(*args):
     return await asyncio.to_thread(input, *args)
 
 
+async def maybe_await(value):
+    """Await the value if it is awaitable (e.g. the result of a BlobStorage or AsyncBlobStorage call)"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def sync_folder(folder: Path):
+    """Make the creation, renaming and deletion of the files in `folder` durable"""
+    if os.name == 'nt':
+        return  # Folders cannot be opened (or synced) on Windows
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 class TaskFieldFilter(logging.Filter):
     def filter(self, record):
         record.task = task_name_getter.get()()
@@ -1,8 +1,10 @@
 import inspect
 from asyncio import Task
-from functools import wraps
+from concurrent.futures import Executor
+from functools import wraps, partial
 from typing import Callable, Coroutine, TypeVar
 
+from .executors import EXECUTORS
 from .historian import find_historian
 
 
@@ -13,21 +15,38 @@ def _get_func_name(func) -> str:
     return func.__class__.__name__
 
 
-def step(func):
+def step(func=None, *, executor: str | Executor = None):
+    """
+    Wrap a function as a step, whose result is recorded in the workflow history.
+
+    With `executor` ('thread', 'process' or a concurrent.futures.Executor),
+     the body runs in that pool instead of on the event loop, and may be sync (see executors.py).
+    """
+    if func is None:
+        return partial(step, executor=executor)
+
     if not callable(func):
         raise ValueError(f'Step can only wrap functions.')
 
     func_name = _get_func_name(func)
 
-    if not inspect.iscoroutinefunction(func) and not inspect.iscoroutinefunction(getattr(func, '__call__')):
+    is_async = inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(getattr(func, '__call__'))
+    if not is_async and executor is None:
         raise ValueError(f'Step function must be async: {func_name}')
 
     if hasattr(func, '_is_quest_step'):
         raise ValueError(f'Step function is already wrapped in @step: {func_name}')
 
+    if executor is not None and not isinstance(executor, Executor) and executor not in EXECUTORS:
+        raise ValueError(f'Unknown step executor: {executor}')
+
     @wraps(func)
     async def new_func(*args, **kwargs):
-        return await find_historian().handle_step(func_name, func, *args, **kwargs)
+        historian = find_historian()
+        if executor is None:
+            return await historian.handle_step(func_name, func, *args, **kwargs)
+        return await historian.handle_step(func_name, partial(historian.run_in_executor, executor, func),
+                                           *args, **kwargs)
 
     new_func._is_quest_step = True
 